@@ -1,118 +1,230 @@
-import argparse
-from termcolor import colored
-from dataset_sculptor import delete_small_images
-from dataset_sculptor import reduce_img
-from dataset_sculptor import image_converter
-from dataset_sculptor import caption_to_metadata
-from dataset_sculptor import move_bw_images
-from dataset_sculptor import move_string
-from dataset_sculptor import advanced_quality
-from dataset_sculptor import label_bw
-from dataset_sculptor import tag_questions
-from dataset_sculptor import autocaption_plus
-from dataset_sculptor.move_bw_images import main_execution_loop
-from dataset_sculptor.move_string import MoveString
-
-
-
-def display_menu():
-    print(colored('''
-                             		
-      __       ___       __   ___ ___     __   __             __  ___  __   __  
-     |  \  /\   |   /\  /__` |__   |     /__` /  ` |  | |    |__)  |  /  \ |__) 
-     |__/ /~~\  |  /~~\ .__/ |___  |     .__/ \__, \__/ |___ |     |  \__/ |  \  0.9                                                                       
-                                                                       
-     ┌──────────────────────────────────────────────────────────────────────────────┐
-     |                        BASIC TOOLS | PYTHON (Fast)                           |
-     |------------------------------------------------------------------------------|
-     |          1 - Delete Small Images and Orphan Captions                         |
-     |          2 - Reduce Image Size                                               |
-     |          3 - Convert to .jpg or .png                                         |
-     |          4 - Captions > Metadata | Metadata > Captions                       |
-     |          5 - Tag / Move Black and White Image                                |
-     |          6 - Move Image-Caption Pairs Based on Filename String               |
-     |                                                                              |
-     ┌──────────────────────────────────────────────────────────────────────────────┐
-     |             ADVANCED TOOLS | BLIP MACHINE VISION (GPU-intensive)             |
-     |------------------------------------------------------------------------------|
-     |          7 - Advanced Quality Analysis (Tag / Caption / Move)                |
-     |          8 - Next-Gen Black and White Filter (Tag / Caption / Move)          |
-     |          9 - Tags from BlipQuestions (Experimental)                          |
-     |          0 - Autocaption Plus (In Development)                               |
-     |                                                                              |
-     ┌──────────────────────────────────────────────────────────────────────────────┐
-     └──────────────────────────────────────────────────────────────────────────────┘
-     |          I - Set input      O - Set Output       X - Exit to Prompt          |
-     └──────────────────────────────────────────────────────────────────────────────┘
-	''', 'white'))
-    print(colored(''' 
-                        WARNING: Dataset Sculptor is experimental
-              Test thoroughly on smaller trial folders and backup your dataset
-    ''', 'red'))
-
-def process_choice(choice, input_dir, output_dir):
-    if choice == '1':
-        small_image_deleter = delete_small_images.DeleteSmallImages()
-        small_image_deleter.set_input_dir(input_dir)
-        small_image_deleter.run()
-    elif choice == '2':
-        image_resizer = reduce_img.ReduceImage()
-        image_resizer.set_input_dir(input_dir)
-        image_resizer.set_output_dir(output_dir)  # only needed if you want to output to a different directory
-        image_resizer.run()
-    elif choice == '3':
-        img_converter = image_converter.ImageConverter(input_dir, output_dir)
-        img_converter.run()
-    elif choice == '4':
-        metadata_converter = caption_to_metadata.MetadataCaptionConverter(input_dir, output_dir)
-        metadata_converter.run()
-    elif choice == '5':
-        main_execution_loop(input_dir, output_dir)
-    elif choice == '6':
-        mover = MoveString()
-        mover.set_input_dir(input_dir)
-        mover.set_output_dir(output_dir)
-        mover.run()
-    elif choice == '7':
-        advanced_quality.run_advanced_quality(input_dir, output_dir)
-    elif choice == '8':
-        label_bw.run_advanced_greyscale(input_dir, output_dir)
-    elif choice == '9':
-        tag_questions.run(input_dir, output_dir)
-    elif choice == '0':
-        autocaption_plus.run(input_dir, output_dir)
-    elif choice.lower() == 'i':
-        input_dir = input("Enter new input directory: ")
-    elif choice.lower() == 'o':
-        output_dir = input("Enter new output directory: ")
-    elif choice.lower() == 'x':
-        return None, None
-
-    return input_dir, output_dir
-
-def main():
-    parser = argparse.ArgumentParser(description='Dataset Sculptor')
-    parser.add_argument('--input_dir', type=str, default=None, help='Input directory')
-    parser.add_argument('--output_dir', type=str, default=None, help='Output directory')
-
-    args = parser.parse_args()
-
-    input_dir = args.input_dir
-    output_dir = args.output_dir
-
-    if not input_dir:
-        input_dir = input("Enter input directory: ")
-    if not output_dir:
-        output_dir = input("Enter output directory: ")
-
-    while True:
-        display_menu()
-        choice = input("Choose an option (0-9, I, O) or press 'X' to exit: ")
-
-        input_dir, output_dir = process_choice(choice, input_dir, output_dir)
-
-        if input_dir is None and output_dir is None:
-            break
-
-if __name__ == "__main__":
-    main()
+import argparse
+from termcolor import colored
+from dataset_sculptor import catalog
+from dataset_sculptor import progress
+
+# Modules are imported when their menu option is chosen, so starting the tool does not
+# pay for torch, transformers and OpenCV unless a machine vision module is used.
+
+
+
+def display_menu(sample=None):
+    print(colored('''
+                             		
+      __       ___       __   ___ ___     __   __             __  ___  __   __  
+     |  \  /\   |   /\  /__` |__   |     /__` /  ` |  | |    |__)  |  /  \ |__) 
+     |__/ /~~\  |  /~~\ .__/ |___  |     .__/ \__, \__/ |___ |     |  \__/ |  \  0.9                                                                       
+                                                                       
+     ┌──────────────────────────────────────────────────────────────────────────────┐
+     |                        BASIC TOOLS | PYTHON (Fast)                           |
+     |------------------------------------------------------------------------------|
+     |          1 - Delete Small Images and Orphan Captions                         |
+     |          2 - Reduce Image Size                                               |
+     |          3 - Convert to .jpg or .png                                         |
+     |          4 - Captions > Metadata | Metadata > Captions                       |
+     |          5 - Tag / Move Black and White Image                                |
+     |          6 - Move Image-Caption Pairs Based on Filename String               |
+     |                                                                              |
+     ┌──────────────────────────────────────────────────────────────────────────────┐
+     |             ADVANCED TOOLS | BLIP MACHINE VISION (GPU-intensive)             |
+     |------------------------------------------------------------------------------|
+     |          7 - Advanced Quality Analysis (Tag / Caption / Move)                |
+     |          8 - Next-Gen Black and White Filter (Tag / Caption / Move)          |
+     |          9 - Tags from BlipQuestions (Experimental)                          |
+     |          0 - Autocaption Plus (In Development)                               |
+     |                                                                              |
+     ┌──────────────────────────────────────────────────────────────────────────────┐
+     |                       DATASET ANALYSIS | PYTHON (Fast)                       |
+     |------------------------------------------------------------------------------|
+     |         10 - Find Near-Duplicate Images (Report / Tag / Move)                |
+     |         11 - Find Exact Duplicate Images (Report / Move / Delete)            |
+     |         12 - Aspect Ratio Buckets (Manifest / Copy / Move)                   |
+     |         13 - Bulk Caption Editor (Replace / Tags / Dedup / Reorder)          |
+     |         14 - Search Captions (Boolean / Phrase / Copy / Move)                |
+     |         15 - Sharded Tar Export (WebDataset / Resize / Convert)              |
+     |         16 - Fast Quality Metrics (Sharpness / Noise / Blockiness)           |
+     |         17 - Image Integrity Scan (Truncated / Corrupt / Quarantine)         |
+     |                                                                              |
+     ┌──────────────────────────────────────────────────────────────────────────────┐
+     └──────────────────────────────────────────────────────────────────────────────┘
+     |  I - Set input    O - Set Output    S - Sample Preview    X - Exit to Prompt |
+     └──────────────────────────────────────────────────────────────────────────────┘
+	''', 'white'))
+    print(colored(''' 
+                        WARNING: Dataset Sculptor is experimental
+              Test thoroughly on smaller trial folders and backup your dataset
+    ''', 'red'))
+    if sample:
+        print(colored(f"     Sample preview ON: modules run on {sample['size']} sampled pairs (seed {sample['seed']}) in DS_Sample, the dataset is not changed\n", 'yellow'))
+
+def set_sample(sample):
+    """Prompt for the sample preview size and seed, 0 turns it off."""
+    from dataset_sculptor import sampling
+    seed = sample['seed'] if sample else sampling.DEFAULT_SEED
+    try:
+        size = int(input(f"Sample size in image-caption pairs (e.g. {sampling.DEFAULT_SIZE}, 0 turns sample preview off): ") or 0)
+        seed = int(input(f"Seed (Enter keeps {seed}): ") or seed)
+    except ValueError:
+        print("Not a number, no changes made")
+        return sample
+    return {'size': size, 'seed': seed} if size > 0 else None
+
+def process_choice(choice, input_dir, output_dir):
+    if choice == '1':
+        from dataset_sculptor import delete_small_images
+        small_image_deleter = delete_small_images.DeleteSmallImages()
+        small_image_deleter.set_input_dir(input_dir)
+        small_image_deleter.run()
+    elif choice == '2':
+        from dataset_sculptor import reduce_img
+        image_resizer = reduce_img.ReduceImage()
+        image_resizer.set_input_dir(input_dir)
+        image_resizer.set_output_dir(output_dir)  # only needed if you want to output to a different directory
+        image_resizer.run()
+    elif choice == '3':
+        from dataset_sculptor import image_converter
+        img_converter = image_converter.ImageConverter(input_dir, output_dir)
+        img_converter.run()
+    elif choice == '4':
+        from dataset_sculptor import caption_to_metadata
+        metadata_converter = caption_to_metadata.MetadataCaptionConverter(input_dir, output_dir)
+        metadata_converter.run()
+    elif choice == '5':
+        from dataset_sculptor.move_bw_images import main_execution_loop
+        main_execution_loop(input_dir, output_dir)
+    elif choice == '6':
+        from dataset_sculptor.move_string import MoveString
+        mover = MoveString()
+        mover.set_input_dir(input_dir)
+        mover.set_output_dir(output_dir)
+        mover.run()
+    elif choice == '7':
+        from dataset_sculptor import advanced_quality
+        advanced_quality.run_advanced_quality(input_dir, output_dir)
+    elif choice == '8':
+        from dataset_sculptor import label_bw
+        label_bw.run_advanced_greyscale(input_dir, output_dir)
+    elif choice == '9':
+        from dataset_sculptor import tag_questions
+        tag_questions.run(input_dir, output_dir)
+    elif choice == '0':
+        from dataset_sculptor import autocaption_plus
+        autocaption_plus.run(input_dir, output_dir)
+    elif choice == '10':
+        from dataset_sculptor.near_duplicates import NearDuplicates
+        NearDuplicates(input_dir, output_dir).run()
+    elif choice == '11':
+        from dataset_sculptor.exact_duplicates import ExactDuplicates
+        ExactDuplicates(input_dir, output_dir).run()
+    elif choice == '12':
+        from dataset_sculptor.aspect_buckets import AspectBuckets
+        AspectBuckets(input_dir, output_dir).run()
+    elif choice == '13':
+        from dataset_sculptor.caption_editor import CaptionEditor
+        CaptionEditor(input_dir, output_dir).run()
+    elif choice == '14':
+        from dataset_sculptor.caption_search import CaptionSearch
+        CaptionSearch(input_dir, output_dir).run()
+    elif choice == '15':
+        from dataset_sculptor.shard_export import ShardExport
+        ShardExport(input_dir, output_dir).run()
+    elif choice == '16':
+        from dataset_sculptor.quality_metrics import QualityMetrics
+        QualityMetrics(input_dir, output_dir).run()
+    elif choice == '17':
+        from dataset_sculptor.integrity_scan import IntegrityScan
+        IntegrityScan(input_dir, output_dir).run()
+    elif choice.lower() == 'i':
+        input_dir = input("Enter new input directory: ")
+    elif choice.lower() == 'o':
+        output_dir = input("Enter new output directory: ")
+    elif choice.lower() == 'x':
+        return None, None
+
+    return input_dir, output_dir
+
+def main():
+    parser = argparse.ArgumentParser(description='Dataset Sculptor')
+    parser.add_argument('--input_dir', type=str, default=None, help='Input directory')
+    parser.add_argument('--output_dir', type=str, default=None, help='Output directory')
+    parser.add_argument('--pipeline', type=str, default=None, help='Run the stages in this config file without menus')
+    parser.add_argument('--profile', action='store_true', help='Print per-stage timings and memory use on exit')
+    parser.add_argument('--profile-json', type=str, default=None, help='Write per-stage timings to this JSON file on exit')
+    parser.add_argument('--cprofile', type=str, default=None, help='Write cProfile stats to this file on exit')
+    parser.add_argument('--quiet', action='store_true', help='No progress line, only summaries and errors')
+    parser.add_argument('--log_dir', type=str, default=None, help='Per-file logs folder (default: Output/DS_Logs)')
+    parser.add_argument('--catalog', type=str, default=None, help='Catalog database (default: Output/DS_Catalog/catalog.sqlite)')
+    parser.add_argument('--no_catalog', action='store_true', help='Recompute everything, neither read nor write the catalog')
+    parser.add_argument('--pixel_budget', type=int, default=None, help='Megapixels above which images are decoded reduced where possible (default: 64)')
+    parser.add_argument('--memory_budget', type=int, default=None, help='MB of decoded pixels shared by concurrent decodes (default: 4096)')
+    parser.add_argument('--max_pixels', type=int, default=None, help='Megapixels above which images are quarantined (default: 1000)')
+    parser.add_argument('--sample', type=int, default=None, help='Sample preview: run on this many sampled image-caption pairs in Output/DS_Sample, the dataset is not changed')
+    parser.add_argument('--seed', type=int, default=0, help='Seed of the sample preview, the same seed picks the same files')
+    parser.add_argument('--copy_mode', type=str, default=None, choices=['reflink', 'hardlink', 'copy'],
+                        help='How images are copied within one volume (default: reflink, a normal copy where unsupported)')
+
+    args = parser.parse_args()
+
+    if args.profile or args.profile_json or args.cprofile:
+        from dataset_sculptor import instrumentation
+        instrumentation.start(summary=args.profile, json_path=args.profile_json, cprofile_path=args.cprofile)
+
+    input_dir = args.input_dir
+    output_dir = args.output_dir
+
+    progress.configure(quiet=args.quiet)
+    if args.copy_mode:
+        from dataset_sculptor import file_ops
+        file_ops.configure(copy_mode=args.copy_mode)
+    if args.pixel_budget or args.memory_budget or args.max_pixels:
+        from dataset_sculptor import memory_guard
+        memory_guard.configure(pixel_budget=args.pixel_budget and args.pixel_budget * 1_000_000,
+                               memory_budget_mb=args.memory_budget,
+                               max_pixels=args.max_pixels and args.max_pixels * 1_000_000)
+
+    if args.pipeline:
+        from dataset_sculptor import pipeline
+        config = pipeline.load_config(args.pipeline, input_dir, output_dir)
+        progress.configure(log_dir=args.log_dir or progress.default_log_dir(config.get('output_dir', config['input_dir'])))
+        if not args.no_catalog:
+            catalog.configure(args.catalog or catalog.default_path(config.get('output_dir', config['input_dir'])))
+        if args.sample:
+            from dataset_sculptor import sampling
+            with sampling.Sandbox(config['input_dir'], config.get('output_dir'), args.sample, args.seed) as sandbox:
+                pipeline.Pipeline(dict(config, input_dir=sandbox.input_dir, output_dir=sandbox.output_dir)).run()
+            sandbox.summary()
+            return
+        pipeline.Pipeline(config).run()
+        return
+
+    if not input_dir:
+        input_dir = input("Enter input directory: ")
+    if not output_dir:
+        output_dir = input("Enter output directory: ")
+
+    sample = {'size': args.sample, 'seed': args.seed} if args.sample else None
+
+    while True:
+        display_menu(sample)
+        choice = input("Choose an option (0-17, I, O, S) or press 'X' to exit: ")
+
+        progress.configure(log_dir=args.log_dir or progress.default_log_dir(output_dir))
+        if not args.no_catalog:
+            catalog.configure(args.catalog or catalog.default_path(output_dir))
+        if choice.lower() == 's':
+            sample = set_sample(sample)
+            continue
+        if sample and choice.isdigit() and int(choice) <= 17:
+            # The module runs on a copy of the sample, what it did is read back from its logs
+            from dataset_sculptor import sampling
+            with sampling.Sandbox(input_dir, output_dir, sample['size'], sample['seed']) as sandbox:
+                process_choice(choice, sandbox.input_dir, sandbox.output_dir)
+            sandbox.summary()
+            continue
+        input_dir, output_dir = process_choice(choice, input_dir, output_dir)
+
+        if input_dir is None and output_dir is None:
+            break
+
+if __name__ == "__main__":
+    main()
@@ -1,227 +1,324 @@
-import glob
-import os
-import cv2
-from termcolor import colored
-from torchvision.transforms.functional import InterpolationMode
-from transformers import AutoProcessor, BlipForQuestionAnswering
-import shutil
-
-MODEL_NAME = "Salesforce/blip-vqa-base"
-
-def query_blip(blip_model, processor, image, question, max_new_tokens=30):
-    inputs = processor(images=image, text=question, return_tensors="pt")
-    outputs = blip_model.generate(**inputs, max_new_tokens=max_new_tokens)
-    return processor.decode(outputs[0], skip_special_tokens=True)
-
-def move_to_quality_dir(file_path, output_dir):
-    x_quality_dir = os.path.join(output_dir, "DS_LowQuality")
-
-    destination_path = os.path.join(x_quality_dir, os.path.basename(file_path))
-    if not os.path.exists(x_quality_dir):
-        os.makedirs(x_quality_dir)
-
-    shutil.move(file_path, destination_path)
-
-    print(f"Moved file to: {destination_path}")
-
-    return destination_path
-
-def rename_and_update_file(base_path, options):
-    base_file_name, file_extension = os.path.splitext(os.path.basename(base_path))
-    
-    # Renaming Logic for Image
-    if "_XQ" not in base_file_name:
-        new_file_name = f"{base_file_name}_XQ{file_extension}"
-    else:
-        new_file_name = f"{base_file_name}{file_extension}"
-
-    new_path = os.path.join(os.path.dirname(base_path), new_file_name)
-
-    if options['rename']:
-        os.rename(base_path, new_path)
-        print(f"Renamed image file: {base_path} -> {new_path}")
-
-    # Renaming Logic for Text Filename
-    txt_file_name = os.path.splitext(base_path)[0] + ".txt"
-    if os.path.isfile(txt_file_name):
-        if "_XQ" not in base_file_name:
-            new_txt_file_name = f"{base_file_name}_XQ.txt"
-        else:
-            new_txt_file_name = f"{base_file_name}.txt"
-        
-        new_txt_path = os.path.join(os.path.dirname(txt_file_name), new_txt_file_name)
-        
-        if options['rename']:
-            os.rename(txt_file_name, new_txt_path)
-            print(f"Renamed caption file: {txt_file_name} -> {new_txt_path}")
-
-    # Append BLIP's answer to .txt content if option 2 is enabled
-    if options['update_caption']:
-        with open(new_txt_path, 'r+') as f:  # We're reading the possibly renamed file, hence "new_txt_path"
-            existing_caption = f.read().rstrip('\n')
-            content = f"{options['update_text']} {existing_caption}"
-            f.seek(0)
-            f.write(content)
-            f.truncate()
-        print(f"Updated content in: {new_txt_path}")
-
-    if options['move_files']:
-        new_path = move_to_quality_dir(new_path, options['output_dir'])
-        if os.path.isfile(new_txt_path):
-            new_txt_path = move_to_quality_dir(new_txt_path, options['output_dir'])
-
-    return new_path
-
-def label_bad_quality_images(input_dir, output_dir, options):
-    print("Starting...")
-
-    blip_model = BlipForQuestionAnswering.from_pretrained(MODEL_NAME)
-    print("Model loaded.")
-
-    processor = AutoProcessor.from_pretrained(MODEL_NAME)
-    print("Processor loaded.")
-
-    ext = ('.jpg', '.jpeg', '.png', '.webp', '.tif', '.tga', '.tiff', '.bmp', '.gif',
-           '.JPG', '.JPEG', '.PNG', '.WEBP', '.TIF', '.TGA', '.TIFF', '.BMP', '.GIF')
-    files_processed = 0
-
-    # Define a dictionary to track the counts of different responses
-    answer_counts = {}
-
-    for idx, img_file_name in enumerate(glob.glob(os.path.join(input_dir, "**", "*.*"), recursive=True)):
-        if img_file_name.endswith(ext):
-            print(f"Processing image: {img_file_name}")
-
-            try:
-                image = cv2.imread(img_file_name)
-                if image is None:
-                    print(f"Failed to read image: {img_file_name}")
-                    continue
-
-                if image.shape[2] == 1:
-                    image = cv2.cvtColor(image, cv2.COLOR_GRAY2RGB)
-                elif image.shape[2] == 4:
-                    image = cv2.cvtColor(image, cv2.COLOR_RGBA2RGB)
-
-                answer = query_blip(blip_model, processor, image, "Is the image an old photo, and of low-quality?")
-                print(f"BLIP's answer: {answer}")
-
-                # Update the counts of different responses
-                if answer.lower() in answer_counts:
-                    answer_counts[answer.lower()] += 1
-                else:
-                    answer_counts[answer.lower()] = 1
-
-                if "yes" in answer or "poor" in answer or "blurry" in answer or "black and white" in answer or "old" in answer or "grainy" in answer:
-                    answer_quality = query_blip(blip_model, processor, image, "Can you describe the quality of the photo?")
-                    print(f"BLIP's answer: {answer_quality}")
-                    # Change the string below to modify how the caption is entered to the front of the caption
-                    options['update_text'] = f"A bad quality {answer_quality} photo reproduction of"
-                    img_file_name = rename_and_update_file(img_file_name, options)
-
-                files_processed += 1
-
-            except Exception as e:
-                print(f"Failed to process image: {img_file_name}. Error: {e}")
-                continue
-
-    print(f"Processed {files_processed} files.")
-    print(f"Answer counts: {answer_counts}")  # Print the counts of different answers
-
-def run_advanced_quality(input_dir, output_dir):
-    options = {
-        'rename': False,
-        'update_caption': False,
-        'move_files': False,
-        'output_dir': output_dir,
-        'update_text': ""
-    }
-
-    while True:
-        print(colored(f'''
-                 ___      __   ___  __           ___      ___           
-                |__  \_/ |__) |__  |__) |  |\/| |__  |\ |  |   /\  |    
-                |___ / \ |    |___ |  \ |  |  | |___ | \|  |  /~~\ |___ 
-        ''', 'light_green'))                                              
-        print(colored(f'''
-        Current Input Directory: {input_dir}
-        Current Output Directory: {output_dir}
-    ┌──────────────────────────────────────────────────────────────────────────────┐
-    |                      ADVANCED QUALITY DETECTION MODULE                       |
-    |------------------------------------------------------------------------------|
-    |                                                                              |
-    |              Settings                                                        | 
-    |                                                                              |
-    |          1 - Label Filenames with _XQ ({'ON' if options['rename'] else 'OFF'})
-    |          2 - Blip quality description to caption ({'ON' if options['update_caption'] else 'OFF'})                                             
-    |          3 - Move Low Quality to Output/DS_LowQuality ({'ON' if options['move_files'] else 'OFF'})                                                 
-    |                                                                              |
-    └──────────────────────────────────────────────────────────────────────────────┘
-    |          I - Set Input         R - Run         X - Exit to Menu              |
-    └──────────────────────────────────────────────────────────────────────────────┘
-
-    Module uses machine vision (BlipForQuestionAnswering) to analyze images for damaged or low quality photos
-	Options label filenames, add quality descriptions to the caption specific to the image, 
-	or move files to Output Directory DS_LowQuality
-
-    ''', 'light_red'))
-
-        choice = input("\nEnter your selection: ").strip().upper()
-
-        if choice == '1':
-            user_response = input("Would you like to add a label to the filenames of low-quality images? (Y/N) ").strip().upper()
-            if user_response == 'Y':
-                options['rename'] = True
-            elif user_response == 'N':
-                options['rename'] = False
-            else:
-                print(colored("Invalid input. Please select Y or N.", "red"))
-
-        elif choice == '2':
-            user_response = input("Would you like to add a description of the quality to the caption? (Y/N) ").strip().upper()
-            if user_response == 'Y':
-                options['update_caption'] = True
-            elif user_response == 'N':
-                options['update_caption'] = False
-            else:
-                print(colored("Invalid input. Please select Y or N.", "red"))
-
-        elif choice == '3':
-            user_response = input("Move the images to Output Directory? (Y/N) ").strip().upper()
-            if user_response == 'Y':
-                options['move_files'] = True
-            elif user_response == 'N':
-                options['move_files'] = False
-            else:
-                print(colored("Invalid input. Please select Y or N.", "red"))
-
-        elif choice == 'I':
-            input_dir = input("Enter new Input Directory path: ").strip()
-            if not os.path.exists(input_dir):
-                print(colored("The provided input directory doesn't exist. Please try again.", "red"))
-
-        elif choice == 'R':
-            warning_message = """
-            WARNING: Module will alter files based on quality
-            Dataset Sculptor is experimental and only intended for backed up datasets
-            Use at your own risk
-            Run the module? (Y/N) 
-            """
-            user_response = input(warning_message).strip().upper()
-            if user_response in ['Y', 'YES']:
-                try:
-                    label_bad_quality_images(input_dir, output_dir, options)
-                except Exception as e:
-                    print(colored(f"An error occurred while processing: {e}", "red"))
-            else:
-                print("Module execution aborted.")
-
-
-        elif choice == 'X':
-            print("Exiting to main menu.")
-            break
-
-        else:
-            print(colored("Invalid selection. Please try again.", "red"))
-
-
+import os
+import cv2
+import numpy as np
+from termcolor import colored
+from dataset_sculptor import archive_io
+from dataset_sculptor import blip_daemon
+from dataset_sculptor import file_ops
+from dataset_sculptor import instrumentation
+from dataset_sculptor import integrity_scan
+from dataset_sculptor import memory_guard
+from dataset_sculptor import progress
+from dataset_sculptor import run_journal
+from dataset_sculptor.run_journal import ask_once, move_once, update_caption_once
+
+MODEL_NAME = "Salesforce/blip-vqa-base"
+LOW_QUALITY_QUESTION = "Is the image an old photo, and of low-quality?"
+DESCRIBE_QUALITY_QUESTION = "Can you describe the quality of the photo?"
+
+def query_blip(blip_model, processor, image, question, max_new_tokens=30):
+    inputs = processor(images=image, text=question, return_tensors="pt")
+    outputs = blip_model.generate(**inputs, max_new_tokens=max_new_tokens)
+    return processor.decode(outputs[0], skip_special_tokens=True)
+
+def move_to_quality_dir(file_path, output_dir):
+    x_quality_dir = os.path.join(output_dir, "DS_LowQuality")
+
+    destination_path = os.path.join(x_quality_dir, os.path.basename(file_path))
+    file_ops.ensure_dir(x_quality_dir)
+    file_ops.move(file_path, destination_path)
+
+    progress.file_event(file_path, 'moved', destination=destination_path)
+
+    return destination_path
+
+def rename_and_update_file(base_path, options, journal=None, key=None):
+    # With a journal, every step runs at most once per image so a resumed run
+    # never renames _XQ twice or prefixes the caption twice
+    base_file_name, file_extension = os.path.splitext(os.path.basename(base_path))
+    
+    # Renaming Logic for Image
+    if "_XQ" not in base_file_name:
+        new_file_name = f"{base_file_name}_XQ{file_extension}"
+    else:
+        new_file_name = f"{base_file_name}{file_extension}"
+
+    new_path = base_path
+
+    if options['rename']:
+        new_path = move_once(journal, key, 'rename_image', base_path, os.path.join(os.path.dirname(base_path), new_file_name))
+        progress.file_event(base_path, 'renamed', destination=new_path)
+
+    # Renaming Logic for Text Filename
+    txt_file_name = os.path.splitext(base_path)[0] + ".txt"
+    new_txt_path = None
+    if os.path.isfile(txt_file_name) or (journal and journal.started(key, 'rename_caption', 'move_caption')):
+        new_txt_path = txt_file_name
+        if options['rename']:
+            new_txt_path = move_once(journal, key, 'rename_caption', txt_file_name, os.path.splitext(new_path)[0] + ".txt")
+            progress.file_event(txt_file_name, 'renamed', destination=new_txt_path)
+
+    # Append BLIP's answer to .txt content if option 2 is enabled
+    if options['update_caption'] and new_txt_path:
+        def prefix_caption(existing_caption):
+            existing_caption = existing_caption.rstrip('\n')
+            return f"{options['update_text']} {existing_caption}"
+
+        if update_caption_once(journal, key, 'update_caption', new_txt_path, prefix_caption):
+            progress.file_event(new_txt_path, 'caption_updated', text=options['update_text'])
+
+    if options['move_files']:
+        quality_dir = os.path.join(options['output_dir'], "DS_LowQuality")
+        move = lambda src, dst: move_to_quality_dir(src, options['output_dir'])
+        new_path = move_once(journal, key, 'move_image', new_path, os.path.join(quality_dir, os.path.basename(new_path)), move)
+        if new_txt_path:
+            new_txt_path = move_once(journal, key, 'move_caption', new_txt_path, os.path.join(quality_dir, os.path.basename(new_txt_path)), move)
+
+    return new_path
+
+def load_image(img_file_name):
+    with instrumentation.stage('decode'):
+        image = cv2.imread(img_file_name)
+    if image is None:
+        return None
+
+    if image.shape[2] == 1:
+        image = cv2.cvtColor(image, cv2.COLOR_GRAY2RGB)
+    elif image.shape[2] == 4:
+        image = cv2.cvtColor(image, cv2.COLOR_RGBA2RGB)
+    return image
+
+def load_image_bytes(data):
+    """load_image() for an image held in memory, e.g. read from an archive."""
+    with memory_guard.decoded_data(data) as img:
+        with instrumentation.stage('process'):
+            # Same channel order as cv2.imread, so answers match a run on the extracted folder
+            return cv2.cvtColor(np.asarray(img.convert('RGB')), cv2.COLOR_RGB2BGR)
+
+def process_image(img_file_name, image, ask, options, answer_counts, journal=None, key=None):
+    answer = ask_once(journal, key, ask, image, LOW_QUALITY_QUESTION, img_file_name)
+    progress.file_event(img_file_name, 'answer', question=LOW_QUALITY_QUESTION, answer=answer)
+
+    # Update the counts of different responses
+    if answer.lower() in answer_counts:
+        answer_counts[answer.lower()] += 1
+    else:
+        answer_counts[answer.lower()] = 1
+
+    if "yes" in answer or "poor" in answer or "blurry" in answer or "black and white" in answer or "old" in answer or "grainy" in answer:
+        answer_quality = ask_once(journal, key, ask, image, DESCRIBE_QUALITY_QUESTION, img_file_name)
+        progress.file_event(img_file_name, 'answer', question=DESCRIBE_QUALITY_QUESTION, answer=answer_quality)
+        # Change the string below to modify how the caption is entered to the front of the caption
+        options['update_text'] = f"A bad quality {answer_quality} photo reproduction of"
+        img_file_name = rename_and_update_file(key or img_file_name, options, journal, key)
+
+    if journal:
+        journal.finish(key)
+    return img_file_name
+
+def label_archive(archive, output_dir, options):
+    """
+    label_bad_quality_images() for a zip or tar archive. Pairs are read without
+    extracting the archive and the actions are applied to a copy of it, saved in
+    output_dir as <archive name>_advanced_quality with the archive's extension. There
+    is no journal, an interrupted run starts over.
+    """
+    answer_counts = {}
+    output_path = None
+    if options['rename'] or options['update_caption'] or options['move_files']:
+        output_path = archive_io.output_path(archive, output_dir, "advanced_quality")
+
+    # Share the model with a running BLIP daemon instead of loading another copy
+    ask, client = blip_daemon.load_ask(MODEL_NAME, query_blip)
+
+    def handle(img_file_name, scratch_output_dir, pair):
+        image = load_image_bytes(pair.image)
+        process_image(img_file_name, image, ask, dict(options, output_dir=scratch_output_dir), answer_counts)
+
+    with progress.Progress("Advanced Quality") as bar:
+        files_processed, failures = archive_io.run_on_files(archive, output_path, handle, bar)
+
+    print(f"Processed {files_processed} files.")
+    print(f"Answer counts: {answer_counts}")
+    if failures:
+        print(f"Failed {failures} files, kept unchanged.")
+    if output_path:
+        print(f"Output archive: {output_path}")
+
+    if client:
+        client.close()
+
+def label_bad_quality_images(input_dir, output_dir, options):
+    print("Starting...")
+    if archive_io.is_archive(input_dir):
+        label_archive(input_dir, output_dir, options)
+        return
+
+    journal = run_journal.RunJournal(output_dir, "advanced_quality", input_dir, resume=options.get('resume', False))
+
+    ext = ('.jpg', '.jpeg', '.png', '.webp', '.tif', '.tga', '.tiff', '.bmp', '.gif',
+           '.JPG', '.JPEG', '.PNG', '.WEBP', '.TIF', '.TGA', '.TIFF', '.BMP', '.GIF')
+    files_processed = 0
+    files_skipped = 0
+    visited = set()
+
+    # Define a dictionary to track the counts of different responses
+    answer_counts = {}
+
+    image_files = []
+    for root, dirs, files in os.walk(input_dir):
+        # Output folders such as DS_Quarantine can sit inside the input folder
+        dirs[:] = sorted(d for d in dirs if not d.startswith('DS_'))
+        image_files.extend(os.path.join(root, name) for name in sorted(files) if name.endswith(ext))
+    # Corrupt files would only fail once the model is loaded, they are quarantined first
+    image_files = integrity_scan.quarantine_corrupt(image_files, output_dir)
+
+    # Share the model with a running BLIP daemon instead of loading another copy
+    ask, client = blip_daemon.load_ask(MODEL_NAME, query_blip)
+
+    with progress.Progress("Advanced Quality", total=len(image_files)) as bar:
+        for img_file_name in image_files:
+            bar.advance()
+            if journal.is_done(img_file_name):
+                files_skipped += 1
+                continue
+
+            key = journal.key_for(img_file_name)
+            visited.add(key)
+
+            try:
+                image = load_image(img_file_name)
+                if image is None:
+                    bar.error(f"Failed to read image: {img_file_name}", img_file_name)
+                    continue
+
+                journal.begin(key)
+                process_image(img_file_name, image, ask, options, answer_counts, journal, key)
+                files_processed += 1
+
+            except Exception as e:
+                bar.error(f"Failed to process image: {img_file_name}. Error: {e}", img_file_name)
+                continue
+
+        # Images interrupted after they were already moved out of the input directory.
+        # Their answers are in the journal, so only the remaining file actions are applied.
+        for key in journal.unfinished_keys():
+            if key not in visited and journal.answer(key, LOW_QUALITY_QUESTION) is not None:
+                bar.file(key, 'finishing_interrupted')
+                try:
+                    process_image(key, None, ask, options, answer_counts, journal, key)
+                    files_processed += 1
+                except Exception as e:
+                    bar.error(f"Failed to process image: {key}. Error: {e}", key)
+
+    journal.close()
+
+    print(f"Processed {files_processed} files.")
+    if files_skipped:
+        print(f"Skipped {files_skipped} files finished in a previous run.")
+    print(f"Answer counts: {answer_counts}")  # Print the counts of different answers
+
+    if client:
+        client.close()
+
+def run_advanced_quality(input_dir, output_dir):
+    options = {
+        'rename': False,
+        'update_caption': False,
+        'move_files': False,
+        'output_dir': output_dir,
+        'update_text': ""
+    }
+
+    while True:
+        print(colored(f'''
+                 ___      __   ___  __           ___      ___           
+                |__  \_/ |__) |__  |__) |  |\/| |__  |\ |  |   /\  |    
+                |___ / \ |    |___ |  \ |  |  | |___ | \|  |  /~~\ |___ 
+        ''', 'light_green'))                                              
+        print(colored(f'''
+        Current Input Directory: {input_dir}
+        Current Output Directory: {output_dir}
+    ┌──────────────────────────────────────────────────────────────────────────────┐
+    |                      ADVANCED QUALITY DETECTION MODULE                       |
+    |------------------------------------------------------------------------------|
+    |                                                                              |
+    |              Settings                                                        | 
+    |                                                                              |
+    |          1 - Label Filenames with _XQ ({'ON' if options['rename'] else 'OFF'})
+    |          2 - Blip quality description to caption ({'ON' if options['update_caption'] else 'OFF'})                                             
+    |          3 - Move Low Quality to Output/DS_LowQuality ({'ON' if options['move_files'] else 'OFF'})                                                 
+    |                                                                              |
+    └──────────────────────────────────────────────────────────────────────────────┘
+    |          I - Set Input         R - Run         X - Exit to Menu              |
+    └──────────────────────────────────────────────────────────────────────────────┘
+
+    Module uses machine vision (BlipForQuestionAnswering) to analyze images for damaged or low quality photos
+	Options label filenames, add quality descriptions to the caption specific to the image, 
+	or move files to Output Directory DS_LowQuality
+
+    ''', 'light_red'))
+
+        choice = input("\nEnter your selection: ").strip().upper()
+
+        if choice == '1':
+            user_response = input("Would you like to add a label to the filenames of low-quality images? (Y/N) ").strip().upper()
+            if user_response == 'Y':
+                options['rename'] = True
+            elif user_response == 'N':
+                options['rename'] = False
+            else:
+                print(colored("Invalid input. Please select Y or N.", "red"))
+
+        elif choice == '2':
+            user_response = input("Would you like to add a description of the quality to the caption? (Y/N) ").strip().upper()
+            if user_response == 'Y':
+                options['update_caption'] = True
+            elif user_response == 'N':
+                options['update_caption'] = False
+            else:
+                print(colored("Invalid input. Please select Y or N.", "red"))
+
+        elif choice == '3':
+            user_response = input("Move the images to Output Directory? (Y/N) ").strip().upper()
+            if user_response == 'Y':
+                options['move_files'] = True
+            elif user_response == 'N':
+                options['move_files'] = False
+            else:
+                print(colored("Invalid input. Please select Y or N.", "red"))
+
+        elif choice == 'I':
+            input_dir = input("Enter new Input Directory path: ").strip()
+            if not os.path.exists(input_dir):
+                print(colored("The provided input directory doesn't exist. Please try again.", "red"))
+
+        elif choice == 'R':
+            warning_message = """
+            WARNING: Module will alter files based on quality
+            Dataset Sculptor is experimental and only intended for backed up datasets
+            Use at your own risk
+            Run the module? (Y/N) 
+            """
+            user_response = input(warning_message).strip().upper()
+            if user_response in ['Y', 'YES']:
+                options['resume'] = False
+                if run_journal.has_unfinished_run(output_dir, "advanced_quality", input_dir):
+                    resume_response = input("An interrupted run was found for this Input Directory. Resume it? (Y/N) ").strip().upper()
+                    options['resume'] = resume_response in ['Y', 'YES']
+                try:
+                    label_bad_quality_images(input_dir, output_dir, options)
+                except Exception as e:
+                    print(colored(f"An error occurred while processing: {e}", "red"))
+            else:
+                print("Module execution aborted.")
+
+
+        elif choice == 'X':
+            print("Exiting to main menu.")
+            break
+
+        else:
+            print(colored("Invalid selection. Please try again.", "red"))
+
+
@@ -0,0 +1,290 @@
+"""
+Image-caption pairs read from and written to zip and tar archives.
+
+Datasets often arrive as multi-GB archives. Instead of extracting them, the pipeline
+reads the members in the order they are stored, in one sequential pass, and writes
+the pairs it keeps to a new archive:
+
+    with ArchiveWriter(output_path) as writer:
+        for pair in read_pairs(input_path):
+            ...
+            writer.add(pair.image_name, pair.image)
+
+An image and its caption come out together as one Pair. Archives written by sorting
+names keep them next to each other, otherwise an image waits in memory for its
+caption, up to PENDING_MB of waiting images. Past that the oldest image comes out
+without its caption and the caption follows later as a Pair of its own with late set.
+Captions without any image come out last.
+
+Modules whose actions rename, edit and move files run on archives through
+run_on_files(), one pair at a time in a scratch folder.
+"""
+import collections
+import contextlib
+import io
+import os
+import shutil
+import tarfile
+import tempfile
+import time
+import zipfile
+
+from dataset_sculptor import instrumentation
+from dataset_sculptor.delete_small_images import SUPPORTED_FORMATS
+
+ARCHIVE_EXTENSIONS = ('.zip', '.tar', '.tar.gz', '.tgz', '.tar.bz2', '.tbz2', '.tar.xz', '.txz')
+PENDING_MB = 512
+ENCODING = 'utf-8'
+
+Pair = collections.namedtuple('Pair', 'stem image_name image caption_name caption late', defaults=(False,))
+
+
+def is_archive(path):
+    return os.path.isfile(path) and path.lower().endswith(ARCHIVE_EXTENSIONS)
+
+
+def archive_extension(path):
+    """The archive extension of path, double ones like .tar.gz included."""
+    return next((extension for extension in sorted(ARCHIVE_EXTENSIONS, key=len, reverse=True)
+                 if path.lower().endswith(extension)), os.path.splitext(path)[1])
+
+
+def archive_stem(path):
+    """The archive's name without its extension."""
+    name = os.path.basename(path)
+    return name[:len(name) - len(archive_extension(name))]
+
+
+def output_path(path, output_dir, suffix):
+    """<output_dir>/<archive name>_<suffix> with the archive's own extension."""
+    return os.path.join(output_dir, archive_stem(path) + '_' + suffix + archive_extension(path))
+
+
+def _kind(name):
+    extension = os.path.splitext(name)[1].lower()
+    if extension == '.txt':
+        return 'caption'
+    if extension in SUPPORTED_FORMATS:
+        return 'image'
+    return None
+
+
+def _zip_members(path):
+    """(name, bytes) of the files in a zip in the order they are stored, so the file is read front to back."""
+    with zipfile.ZipFile(path) as archive:
+        infos = sorted((info for info in archive.infolist() if not info.is_dir()), key=lambda info: info.header_offset)
+        captions = {os.path.splitext(info.filename)[0] for info in infos if _kind(info.filename) == 'caption'}
+        yield captions
+        for info in infos:
+            if _kind(info.filename):
+                data = archive.read(info)
+                instrumentation.read_bytes(len(data))
+                yield info.filename, data
+
+
+def _tar_members(path):
+    """(name, bytes) of the files in a tar, streamed, compressed tars included."""
+    # Nothing is known about the captions before they are read
+    yield None
+    with tarfile.open(path, 'r|*') as archive:
+        for member in archive:
+            if member.isfile() and _kind(member.name):
+                data = archive.extractfile(member).read()
+                instrumentation.read_bytes(len(data))
+                yield member.name, data
+
+
+def read_pairs(path, pending_mb=PENDING_MB):
+    """Yield a Pair for every image and for every caption that came out without its image, see above."""
+    members = _zip_members(path) if path.lower().endswith('.zip') else _tar_members(path)
+    known_captions = next(members)
+    captions = {}  # stem -> (name, text) of captions whose image has not been seen
+    waiting = collections.OrderedDict()  # stem -> (name, bytes) of images whose caption has not been seen
+    waiting_bytes = 0
+    released = set()  # stems of images that came out before their caption
+    limit = pending_mb * 1024 * 1024
+
+    for name, data in members:
+        stem = os.path.splitext(name)[0]
+        if _kind(name) == 'caption':
+            text = data.decode(ENCODING, errors='ignore')
+            if stem in waiting:
+                image_name, image = waiting.pop(stem)
+                waiting_bytes -= len(image)
+                yield Pair(stem, image_name, image, name, text)
+            elif stem in released:
+                released.discard(stem)
+                yield Pair(stem, None, None, name, text, True)
+            else:
+                captions[stem] = (name, text)
+            continue
+
+        if stem in captions:
+            caption_name, text = captions.pop(stem)
+            yield Pair(stem, name, data, caption_name, text)
+        elif known_captions is not None and stem not in known_captions:
+            yield Pair(stem, name, data, None, None)
+        elif stem in waiting:
+            # Two images with one stem, the caption goes with the first
+            yield Pair(stem, name, data, None, None)
+        else:
+            waiting[stem] = (name, data)
+            waiting_bytes += len(data)
+            while waiting_bytes > limit and waiting:
+                old_stem, (image_name, image) = waiting.popitem(last=False)
+                waiting_bytes -= len(image)
+                released.add(old_stem)
+                instrumentation.count('archive_released_images')
+                yield Pair(old_stem, image_name, image, None, None)
+
+    for stem, (image_name, image) in waiting.items():
+        yield Pair(stem, image_name, image, None, None)
+    for stem, (caption_name, text) in captions.items():
+        yield Pair(stem, None, None, caption_name, text)
+
+
+class ArchiveWriter:
+    """
+    Writes members to a new zip or tar, picked by the extension of path. The archive is
+    written under a temporary name and only takes its real name once it is complete.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.temp_path = f"{path}.{os.getpid()}.tmp"
+        self.names = set()
+        self.zip = self.tar = None
+        lower = path.lower()
+        if lower.endswith('.zip'):
+            self.zip = zipfile.ZipFile(self.temp_path, 'w')
+        else:
+            compression = next((kind for extension, kind in (('.gz', 'gz'), ('.tgz', 'gz'), ('.bz2', 'bz2'), ('.tbz2', 'bz2'), ('.xz', 'xz'), ('.txz', 'xz'))
+                                if lower.endswith(extension)), '')
+            self.tar = tarfile.open(self.temp_path, f"w|{compression}")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close(keep=exc_type is None)
+
+    def unique_name(self, name):
+        """name, or name with _1, _2, ... before the extension if the archive already has it."""
+        name = name.replace(os.sep, '/')
+        base, extension = os.path.splitext(name)
+        counter = 1
+        while name in self.names:
+            name = f"{base}_{counter}{extension}"
+            counter += 1
+        return name
+
+    def add(self, name, data):
+        if isinstance(data, str):
+            data = data.encode(ENCODING)
+        name = name.replace(os.sep, '/')
+        self.names.add(name)
+        with instrumentation.stage('write'):
+            if self.zip:
+                # Images are compressed already, captions are worth deflating
+                compression = zipfile.ZIP_DEFLATED if name.lower().endswith('.txt') else zipfile.ZIP_STORED
+                info = zipfile.ZipInfo(name, time.localtime()[:6])
+                info.external_attr = 0o644 << 16
+                self.zip.writestr(info, data, compress_type=compression)
+            else:
+                info = tarfile.TarInfo(name)
+                info.size = len(data)
+                info.mtime = int(time.time())
+                info.mode = 0o644
+                self.tar.addfile(info, io.BytesIO(data))
+        instrumentation.wrote_bytes(len(data))
+
+    def close(self, keep=True):
+        (self.zip or self.tar).close()
+        if keep:
+            os.replace(self.temp_path, self.path)
+        elif os.path.exists(self.temp_path):
+            os.remove(self.temp_path)
+
+
+def _results(input_dir, output_dir, folder):
+    """(archive name, bytes) of the files a module left in the scratch folders."""
+    results = []
+    for base, prefix in ((input_dir, folder), (output_dir, '')):
+        for root, dirs, files in os.walk(base):
+            dirs.sort()
+            for filename in sorted(files):
+                file_path = os.path.join(root, filename)
+                with open(file_path, 'rb') as f:
+                    results.append((os.path.join(prefix, os.path.relpath(file_path, base)), f.read()))
+    return results
+
+
+def _add_results(writer, results):
+    """Add results to writer, captions next to their image under the name it got. Returns the image's name."""
+    captions = {os.path.splitext(name)[0]: data for name, data in results if _kind(name) == 'caption'}
+    image_name = None
+    for name, data in results:
+        if _kind(name) == 'caption':
+            continue
+        image_name = writer.unique_name(name)
+        writer.add(image_name, data)
+        caption = captions.pop(os.path.splitext(name)[0], None)
+        if caption is not None:
+            writer.add(os.path.splitext(image_name)[0] + '.txt', caption)
+    for stem, data in captions.items():
+        writer.add(writer.unique_name(stem + '.txt'), data)
+    return image_name
+
+
+def run_on_files(path, output_path, handle, bar):
+    """
+    Run file-based module code on the pairs of the archive at path. Each pair is written
+    to a scratch input folder and handle(image_path, output_dir, pair) acts on it as it
+    would in a dataset folder, output_dir being a scratch output folder. The files it
+    leaves go to a new archive at output_path: those in the input folder at the pair's
+    own folder, those in the output folder under the folders the module made, such as
+    DS_LowQuality. A pair handle fails on is kept unchanged. A caption that comes after
+    its image follows the image unchanged. Without output_path nothing is written.
+    Returns (processed, failures).
+    """
+    processed = failures = 0
+    released = {}  # stem -> caption name, for images that came out before their caption
+    with tempfile.TemporaryDirectory(prefix='ds_archive_') as scratch, \
+            (ArchiveWriter(output_path) if output_path else contextlib.nullcontext()) as writer:
+        input_dir = os.path.join(scratch, 'input')
+        output_dir = os.path.join(scratch, 'output')
+        for pair in read_pairs(path):
+            bar.advance()
+            if pair.image_name is None:
+                if writer:
+                    name = released.pop(pair.stem, None) if pair.late else None
+                    writer.add(name or writer.unique_name(pair.caption_name), pair.caption)
+                continue
+
+            os.makedirs(input_dir)
+            os.makedirs(output_dir)
+            try:
+                image_path = os.path.join(input_dir, os.path.basename(pair.image_name))
+                with open(image_path, 'wb') as f:
+                    f.write(pair.image)
+                if pair.caption is not None:
+                    with open(os.path.splitext(image_path)[0] + '.txt', 'w', encoding=ENCODING) as f:
+                        f.write(pair.caption)
+                try:
+                    handle(image_path, output_dir, pair)
+                    results = _results(input_dir, output_dir, os.path.dirname(pair.image_name))
+                    processed += 1
+                except Exception as e:
+                    failures += 1
+                    bar.error(f"Failed to process image: {pair.image_name}. Error: {e}", pair.image_name)
+                    results = [(pair.image_name, pair.image)]
+                    if pair.caption is not None:
+                        results.append((pair.caption_name, pair.caption))
+                if writer:
+                    image_name = _add_results(writer, results)
+                    if pair.caption is None and image_name:
+                        released[pair.stem] = os.path.splitext(image_name)[0] + '.txt'
+            finally:
+                shutil.rmtree(input_dir)
+                shutil.rmtree(output_dir)
+    return processed, failures
@@ -0,0 +1,299 @@
+"""
+Aspect-ratio bucketing for training datasets.
+
+Every image is assigned to the bucket resolution closest to its aspect ratio, in one
+pass: dimensions come from the image header (or the catalog), only images that are
+cropped and resized into bucket folders are decoded. Results go to a manifest in
+Output/DS_Buckets that trainers can read instead of opening every image again.
+
+Buckets are generated from a base resolution the way most trainers do it (sides in
+multiples of 64, at most base x base pixels, aspect ratio up to 2:1) or given as a
+list such as 1024x1024,1152x896,896x1152.
+"""
+import bisect
+import collections
+import csv
+import math
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from PIL import Image
+from termcolor import colored
+
+from dataset_sculptor import catalog
+from dataset_sculptor import file_ops
+from dataset_sculptor import instrumentation
+from dataset_sculptor import memory_guard
+from dataset_sculptor import progress
+from dataset_sculptor.delete_small_images import SUPPORTED_FORMATS
+from dataset_sculptor.image_converter import prepare_for_filetype
+
+BUCKETS_DIR = "DS_Buckets"
+MANIFEST_FILE = "buckets.csv"
+BUCKET_STEP = 64
+MAX_ASPECT = 2.0
+BUCKET_WORKERS = 8
+WINDOW = 256  # tasks in flight, submitting millions of futures at once would hold them all in memory
+
+ACTIONS = {1: 'Manifest only', 2: 'Copy into bucket folders', 3: 'Move into bucket folders'}
+
+
+def make_buckets(base_resolution=1024, step=BUCKET_STEP, max_aspect=MAX_ASPECT):
+    """Bucket sizes with sides in multiples of step and no more pixels than base_resolution squared."""
+    area = base_resolution * base_resolution
+    widest = {}
+    for width in range(base_resolution // step * step, int(base_resolution * max_aspect) + 1, step):
+        height = area // width // step * step
+        if height < step or width / height > max_aspect:
+            continue
+        # Several widths can round to the same height, keep the one with the most pixels
+        widest[height] = max(width, widest.get(height, 0))
+    # Portrait buckets mirror the landscape ones
+    return sorted({(width, height) for height, width in widest.items()} | {(height, width) for height, width in widest.items()})
+
+
+def parse_buckets(text):
+    """'1024x1024,1152x896' -> [(1024, 1024), (1152, 896)]"""
+    buckets = []
+    for entry in text.split(','):
+        width, height = entry.lower().strip().split('x')
+        buckets.append((int(width), int(height)))
+    return sorted(set(buckets))
+
+
+class BucketSet:
+    """Finds the bucket with the closest aspect ratio by bisecting the sorted log ratios."""
+
+    def __init__(self, buckets):
+        self.buckets = sorted(buckets, key=lambda bucket: bucket[0] / bucket[1])
+        self.log_ratios = [math.log(width / height) for width, height in self.buckets]
+
+    def nearest(self, width, height):
+        log_ratio = math.log(width / height)
+        i = bisect.bisect_left(self.log_ratios, log_ratio)
+        candidates = [j for j in (i - 1, i) if 0 <= j < len(self.buckets)]
+        return self.buckets[min(candidates, key=lambda j: abs(self.log_ratios[j] - log_ratio))]
+
+
+def crop_box(width, height, bucket):
+    """Centred box of the image with the bucket's aspect ratio."""
+    ratio = bucket[0] / bucket[1]
+    if width / height > ratio:
+        crop_width = height * ratio
+        left = (width - crop_width) / 2
+        return (left, 0, left + crop_width, height)
+    crop_height = width / ratio
+    top = (height - crop_height) / 2
+    return (0, top, width, top + crop_height)
+
+
+def fit_to_bucket(img, bucket):
+    """Centre crop img to the bucket's aspect ratio and resize it to the bucket size in one resample."""
+    width, height = img.size
+    scale = max(bucket[0] / width, bucket[1] / height)
+    cover = (math.ceil(width * scale), math.ceil(height * scale))
+    # JPEGs can be decoded at a reduced scale that still covers the bucket
+    img.draft(img.mode, cover)
+    with memory_guard.decoding(img, cover) as img:
+        if img.mode in ('1', 'P'):
+            img = img.convert('RGBA' if 'transparency' in img.info else 'RGB')
+        return img.resize(bucket, Image.LANCZOS, box=crop_box(img.size[0], img.size[1], bucket))
+
+
+def _in_order(pool, function, items, window=WINDOW):
+    """pool.map that only keeps window tasks in flight."""
+    pending = collections.deque()
+    for item in items:
+        pending.append(pool.submit(function, item))
+        if len(pending) >= window:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
+
+
+class AspectBuckets:
+
+    def __init__(self, input_dir, output_dir):
+        self.input_dir = input_dir
+        self.output_dir = output_dir
+        self.base_resolution = 1024
+        self.custom_buckets = None
+        self.action = 1
+        self.resize = True
+        self.recursive = False
+        self.lock = threading.Lock()
+        self.reserved = set()
+
+    def set_input_dir(self, input_dir):
+        if os.path.isdir(input_dir):
+            self.input_dir = input_dir
+        else:
+            print("Not valid, no changes made")
+
+    def set_output_dir(self, output_dir):
+        if os.path.isdir(output_dir):
+            self.output_dir = output_dir
+        else:
+            print("Not valid, no changes made")
+
+    def buckets(self):
+        return self.custom_buckets or make_buckets(self.base_resolution)
+
+    def display_menu(self):
+        print(colored(f'''
+    Current Input Directory: {self.input_dir}
+    Current Output Directory: {self.output_dir}
+    ┌──────────────────────────────────────────────────────────────────────────────┐
+    |                          ASPECT RATIO BUCKETS MODULE                         |
+    |------------------------------------------------------------------------------|
+    |                                                                              |
+    |              Settings                                                        |
+    |                                                                              |
+    |          1 - Base Resolution ({self.base_resolution})
+    |          2 - Custom Bucket List ({len(self.custom_buckets) if self.custom_buckets else 'Off'})
+    |          3 - Action ({ACTIONS[self.action]})
+    |          4 - Crop and Resize to Bucket ({'On' if self.resize else 'Off'})
+    |          5 - Recursive ({'On' if self.recursive else 'Off'})
+    |                                                                              |
+    └──────────────────────────────────────────────────────────────────────────────┘
+    |      I - Set Input     O - Set Output     R - Run     X - Exit to Menu       |
+    └──────────────────────────────────────────────────────────────────────────────┘
+    ''', 'light_blue'))
+
+        print("Module assigns every image to the bucket resolution closest to its aspect ratio")
+        print("Buckets are generated from the Base Resolution, or given as a list such as 1024x1024,1152x896")
+        print("Copy or Move places image-caption pairs in DS_Buckets/<width>x<height>")
+        print("Crop and Resize centre crops images to the bucket aspect ratio and scales them to the bucket size")
+        print("A manifest of every image and its bucket is saved to DS_Buckets")
+        print("Recursive ON processes subfolders of the input directory\n")
+
+    def list_images(self):
+        for root, dirs, files in os.walk(self.input_dir):
+            dirs[:] = [d for d in dirs if d != BUCKETS_DIR]
+            for filename in files:
+                if filename.lower().endswith(tuple(SUPPORTED_FORMATS)):
+                    yield os.path.join(root, filename)
+            if not self.recursive:
+                break
+
+    def reserve(self, bucket_dir, filename):
+        """A free path in bucket_dir. Workers placing images with the same name must not pick the same one."""
+        with self.lock:
+            path = os.path.join(bucket_dir, filename)
+            base, extension = os.path.splitext(path)
+            counter = 1
+            while path in self.reserved or os.path.exists(path):
+                path = f"{base}_{counter}{extension}"
+                counter += 1
+            self.reserved.add(path)
+            return path
+
+    def place(self, path, bucket):
+        bucket_dir = os.path.join(self.output_dir, BUCKETS_DIR, f"{bucket[0]}x{bucket[1]}")
+        file_ops.ensure_dir(bucket_dir)
+        target = self.reserve(bucket_dir, os.path.basename(path))
+        if self.resize:
+            with memory_guard.open_image(path) as img:
+                with instrumentation.stage('process'):
+                    resized = fit_to_bucket(img, bucket)
+            instrumentation.save_image(prepare_for_filetype(resized, os.path.splitext(target)[1]), target)
+            if self.action == 3:
+                os.remove(path)
+        else:
+            file_ops.transfer(path, target, 'move' if self.action == 3 else 'copy')
+
+        caption = os.path.splitext(path)[0] + '.txt'
+        if os.path.isfile(caption):
+            file_ops.transfer(caption, os.path.splitext(target)[0] + '.txt', 'move' if self.action == 3 else 'copy')
+        return target
+
+    def process_image(self, path, bucket_set):
+        try:
+            width, height = catalog.image_size(path)
+            bucket = bucket_set.nearest(width, height)
+            target = self.place(path, bucket) if self.action != 1 else ''
+        except Exception as e:
+            return path, e
+        return path, (width, height, bucket, target)
+
+    def bucket_images(self):
+        bucket_set = BucketSet(self.buckets())
+        report_dir = os.path.join(self.output_dir, BUCKETS_DIR)
+        os.makedirs(report_dir, exist_ok=True)
+        manifest_path = os.path.join(report_dir, MANIFEST_FILE)
+        self.reserved = set()
+        counts = collections.Counter()
+        upscaled = 0
+
+        with progress.Progress("Aspect Buckets") as bar, ThreadPoolExecutor(max_workers=BUCKET_WORKERS) as pool, \
+                open(manifest_path, 'w', newline='', encoding='utf-8') as f:
+            writer = csv.writer(f)
+            writer.writerow(['path', 'width', 'height', 'bucket_width', 'bucket_height', 'output'])
+            for path, result in _in_order(pool, lambda path: self.process_image(path, bucket_set), self.list_images()):
+                bar.advance()
+                if isinstance(result, Exception):
+                    bar.error(f"Unable to bucket {path}: {result}", path)
+                    continue
+                width, height, bucket, target = result
+                writer.writerow([path, width, height, bucket[0], bucket[1], target])
+                counts[bucket] += 1
+                upscaled += width < bucket[0] or height < bucket[1]
+                if target:
+                    bar.file(path, 'moved' if self.action == 3 else 'copied', bucket=list(bucket), destination=target)
+
+        for bucket in sorted(counts, key=lambda bucket: bucket[0] / bucket[1]):
+            print(f"{bucket[0]:>5}x{bucket[1]:<5} {counts[bucket]:>9}")
+        print(f"Total images bucketed: {sum(counts.values())}")
+        if upscaled:
+            print(colored(f"Images smaller than their bucket: {upscaled}", 'yellow'))
+        print(f"Manifest saved to: {manifest_path}")
+        return counts
+
+    def run(self):
+        while True:
+            self.display_menu()
+            choice = input("Enter your selection: ")
+
+            if choice == '1':
+                resolution = input("Enter Base Resolution in Pixels (e.g. 512, 768, 1024): ").strip()
+                if resolution.isdigit() and int(resolution) >= BUCKET_STEP:
+                    self.base_resolution = int(resolution)
+                    self.custom_buckets = None
+                else:
+                    print("Invalid option, no changes made.")
+            elif choice == '2':
+                text = input("Enter buckets as WIDTHxHEIGHT separated by commas, empty to generate from Base Resolution: ").strip()
+                try:
+                    self.custom_buckets = parse_buckets(text) if text else None
+                except ValueError:
+                    print("Invalid option, no changes made.")
+            elif choice == '3':
+                action = input("Manifest only [1], Copy into bucket folders [2] or Move into bucket folders [3]: ").strip()
+                if action.isdigit() and int(action) in ACTIONS:
+                    self.action = int(action)
+                else:
+                    print("Invalid option, no changes made.")
+            elif choice == '4':
+                user_input = input("Crop and resize images to their bucket size? (Y/N)").lower()
+                self.resize = user_input in ['y', 'yes']
+            elif choice == '5':
+                user_input = input("Process folders recursively? (Y/N)").lower()
+                self.recursive = user_input in ['y', 'yes']
+            elif choice.lower() == 'i':
+                new_input_dir = input("Change Input Directory: ")
+                self.set_input_dir(new_input_dir)
+            elif choice.lower() == 'o':
+                new_output_dir = input("Change Output Directory: ")
+                self.set_output_dir(new_output_dir)
+            elif choice.lower() == 'r':
+                if self.action != 3:
+                    self.bucket_images()
+                    continue
+                confirm = input("WARNING: Module will move images and their captions into bucket folders\nDataset Sculptor is experimental and only intended for backed up datasets\nUse only on backed up datasets and at your own risk\nRun the module? (Y/N) ")
+                if confirm.lower() in ['y', 'yes']:
+                    self.bucket_images()
+            elif choice.lower() == 'x':
+                break
+            else:
+                print("Invalid choice. Please choose a valid option or press 'x' to exit.")
@@ -0,0 +1,370 @@
+"""
+Performance benchmarks for Dataset Sculptor.
+
+    python -m dataset_sculptor.benchmark startup
+    python -m dataset_sculptor.benchmark modules --count 300 --save-baseline
+
+The startup benchmark times how long the entry point takes to import, on top of a
+bare interpreter start, and checks that none of the heavy machine vision
+dependencies get imported before a module that needs them is chosen. It exits
+with status 1 when the regression budget is exceeded.
+
+The modules benchmark generates a synthetic dataset and runs the file modules over
+a fresh copy of it, each in its own process so peak memory is measured per module.
+Results are compared against a stored baseline and the run exits with status 1
+when a module got slower or hungrier than the tolerance allows.
+"""
+import argparse
+import contextlib
+import json
+import multiprocessing
+import os
+import queue
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from termcolor import colored
+
+from dataset_sculptor import instrumentation
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+ENTRY_POINT = os.path.join(REPO_DIR, "dataset_sculptor.py")
+
+# Seconds the entry point may add to a bare interpreter start
+STARTUP_BUDGET = 0.5
+STARTUP_RUNS = 5
+
+HEAVY_MODULES = ('torch', 'torchvision', 'transformers', 'cv2')
+
+# Modules that must start without pulling in any of HEAVY_MODULES
+LIGHT_MODULES = ('dataset_sculptor.delete_small_images', 'dataset_sculptor.reduce_img',
+                 'dataset_sculptor.image_converter', 'dataset_sculptor.move_bw_images',
+                 'dataset_sculptor.move_string', 'dataset_sculptor.blip_daemon',
+                 'dataset_sculptor.instrumentation', 'dataset_sculptor.near_duplicates',
+                 'dataset_sculptor.exact_duplicates')
+
+_IMPORT_PROBE = '''
+import json, sys, time
+start = time.perf_counter()
+{statement}
+elapsed = time.perf_counter() - start
+print(json.dumps({{"seconds": elapsed, "heavy": [m for m in {heavy!r} if m in sys.modules]}}))
+'''
+
+
+# Synthetic dataset used by the modules benchmark, stored with the baseline so results stay comparable
+MODULE_DATASET = {'count': 200, 'resolutions': [[256, 256], [512, 768], [1024, 1024], [3000, 2000]],
+                  'formats': ['jpg', 'png', 'webp'], 'greyscale_ratio': 0.3, 'caption_ratio': 0.9,
+                  'orphan_captions': 10, 'subfolders': 2, 'seed': 0}
+BASELINE_FILE = os.path.join(REPO_DIR, "benchmark_baseline.json")
+# Allowed slowdown in files/sec and growth in peak RSS against the baseline
+BASELINE_TOLERANCE = 0.25
+
+
+def _probe(statement):
+    """Run an import statement in a fresh interpreter. Returns (wall seconds, import seconds, heavy modules loaded)."""
+    code = _IMPORT_PROBE.format(statement=statement, heavy=HEAVY_MODULES)
+    start = time.perf_counter()
+    result = subprocess.run([sys.executable, "-c", code], cwd=REPO_DIR, capture_output=True, text=True)
+    wall = time.perf_counter() - start
+    if result.returncode != 0:
+        raise RuntimeError(f"Probe failed: {statement}\n{result.stderr}")
+    report = json.loads(result.stdout.strip().splitlines()[-1])
+    return wall, report['seconds'], report['heavy']
+
+
+def startup_benchmark(runs=STARTUP_RUNS, budget=STARTUP_BUDGET):
+    """Time the entry point and the light modules. Returns a report dict with a 'passed' flag."""
+    baseline = statistics.median(_probe("pass")[0] for _ in range(runs))
+
+    entry_statement = f"import runpy; runpy.run_path({ENTRY_POINT!r}, run_name='startup_benchmark')"
+    entry_runs = [_probe(entry_statement) for _ in range(runs)]
+    entry_wall = statistics.median(run[0] for run in entry_runs)
+    entry_heavy = sorted(set(module for run in entry_runs for module in run[2]))
+
+    modules = {}
+    for module in LIGHT_MODULES:
+        module_runs = [_probe(f"import {module}") for _ in range(runs)]
+        modules[module] = {
+            'import_seconds': statistics.median(run[1] for run in module_runs),
+            'heavy_modules': sorted(set(m for run in module_runs for m in run[2])),
+        }
+
+    overhead = entry_wall - baseline
+    passed = overhead <= budget and not entry_heavy and not any(m['heavy_modules'] for m in modules.values())
+    return {
+        'python_startup_seconds': baseline,
+        'entry_point_seconds': entry_wall,
+        'entry_point_overhead_seconds': overhead,
+        'entry_point_heavy_modules': entry_heavy,
+        'budget_seconds': budget,
+        'modules': modules,
+        'passed': passed,
+    }
+
+
+def print_startup_report(report):
+    print(f"Python startup:        {report['python_startup_seconds']:.3f}s")
+    print(f"Entry point startup:   {report['entry_point_seconds']:.3f}s")
+    print(f"Entry point overhead:  {report['entry_point_overhead_seconds']:.3f}s (budget {report['budget_seconds']:.3f}s)")
+    if report['entry_point_heavy_modules']:
+        print(colored(f"Entry point imports heavy modules: {', '.join(report['entry_point_heavy_modules'])}", "red"))
+    for module, result in report['modules'].items():
+        line = f"  {module}: {result['import_seconds']:.3f}s"
+        if result['heavy_modules']:
+            print(colored(f"{line} imports {', '.join(result['heavy_modules'])}", "red"))
+        else:
+            print(line)
+    print(colored("PASSED", "green") if report['passed'] else colored("FAILED", "red"))
+
+
+def _bench_delete_small(dataset_dir, output_dir, stage):
+    from dataset_sculptor.delete_small_images import DeleteSmallImages
+
+    module = DeleteSmallImages()
+    module.input_dir = dataset_dir
+    module.recursive = True
+    with stage('delete_small_images_and_orphans'):
+        module.delete_small_images_and_orphans()
+
+
+def _bench_reduce(dataset_dir, output_dir, stage):
+    from dataset_sculptor.reduce_img import ReduceImage
+
+    module = ReduceImage()
+    module.input_dir = dataset_dir
+    module.output_dir = output_dir
+    module.recursive = True
+    with stage('resize_images'):
+        module.resize_images()
+
+
+def _bench_convert(dataset_dir, output_dir, stage):
+    from dataset_sculptor.image_converter import ImageConverter
+
+    module = ImageConverter(dataset_dir, output_dir)
+    module.target_filetype = '.png'
+    module.recursive = True
+    with stage('convert_images'):
+        module.convert_images()
+
+
+def _bench_bw(dataset_dir, output_dir, stage):
+    from dataset_sculptor.move_bw_images import BWImageMenu
+
+    module = BWImageMenu({"INPUT_DIR": dataset_dir, "OUTPUT_DIR": output_dir, "MSE_CUTOFF": 22,
+                          "LABEL_FILENAME": True, "APPEND_CAPTION": 4, "MOVE_OR_COPY": 2, "RECURSIVE": True})
+    with stage('run'):
+        module.run()
+
+
+def _bench_metadata(dataset_dir, output_dir, stage):
+    from dataset_sculptor.caption_to_metadata import MetadataCaptionConverter
+
+    module = MetadataCaptionConverter(dataset_dir, output_dir)
+    module.recursive = True
+    with stage('captions_to_metadata'):
+        module.captions_to_metadata()
+    with stage('metadata_to_captions'):
+        module.metadata_to_captions()
+
+
+def _metadata_unavailable():
+    try:
+        import exiftool  # noqa: F401
+    except ImportError:
+        return "pyexiftool is not installed"
+    if shutil.which('exiftool') is None:
+        return "exiftool was not found on PATH"
+    return None
+
+
+# name -> (benchmark, check returning a reason to skip or None)
+MODULE_BENCHMARKS = {
+    'delete_small': (_bench_delete_small, None),
+    'reduce': (_bench_reduce, None),
+    'convert': (_bench_convert, None),
+    'bw': (_bench_bw, None),
+    'metadata': (_bench_metadata, _metadata_unavailable),
+}
+
+
+def _module_worker(name, dataset_dir, work_dir, results):
+    """Runs in a fresh process: benchmark one module on its own copy of the dataset."""
+    stages = {}
+
+    @contextlib.contextmanager
+    def stage(stage_name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            stages[stage_name] = stages.get(stage_name, 0) + time.perf_counter() - start
+
+    copy_dir = os.path.join(work_dir, 'dataset')
+    output_dir = os.path.join(work_dir, 'output')
+    with stage('copy_dataset'):
+        shutil.copytree(dataset_dir, copy_dir)
+    os.makedirs(output_dir)
+
+    # The per-file prints would otherwise time the terminal instead of the module
+    instrumentation.metrics.enable(sample_memory=False)
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        MODULE_BENCHMARKS[name][0](copy_dir, output_dir, stage)
+    profile = instrumentation.metrics.snapshot()
+    results.put({'stages': stages, 'peak_rss_mb': profile['peak_rss_mb'], 'instrumentation': profile})
+
+
+def modules_benchmark(names=None, dataset=None, work_dir=None):
+    """Generate the synthetic dataset and benchmark each module. Returns a report dict."""
+    from dataset_sculptor import synthetic_dataset
+
+    dataset = dict(MODULE_DATASET, **(dataset or {}))
+    names = names or list(MODULE_BENCHMARKS)
+    keep_work_dir = work_dir is not None
+    work_dir = work_dir or tempfile.mkdtemp(prefix='ds_benchmark_')
+    dataset_dir = os.path.join(work_dir, 'synthetic')
+
+    start = time.perf_counter()
+    summary = synthetic_dataset.generate(dataset_dir, dataset['count'], [tuple(r) for r in dataset['resolutions']],
+                                         dataset['formats'], dataset['greyscale_ratio'], dataset['caption_ratio'],
+                                         dataset['orphan_captions'], dataset['subfolders'], dataset['seed'])
+    report = {'dataset': dataset, 'generate_seconds': time.perf_counter() - start, 'modules': {}}
+
+    context = multiprocessing.get_context('spawn')
+    try:
+        for name in names:
+            benchmark, check = MODULE_BENCHMARKS[name]
+            reason = check() if check else None
+            if reason:
+                report['modules'][name] = {'skipped': reason}
+                continue
+
+            module_dir = os.path.join(work_dir, name)
+            os.makedirs(module_dir)
+            results = context.Queue()
+            process = context.Process(target=_module_worker, args=(name, dataset_dir, module_dir, results))
+            process.start()
+            process.join()
+            try:
+                result = results.get(timeout=1)
+            except queue.Empty:
+                result = None
+            if process.exitcode != 0 or result is None:
+                report['modules'][name] = {'error': f"benchmark process exited with {process.exitcode}"}
+                continue
+
+            seconds = sum(t for stage_name, t in result['stages'].items() if stage_name != 'copy_dataset')
+            report['modules'][name] = {
+                'files': summary['images'],
+                'seconds': seconds,
+                'files_per_sec': summary['images'] / seconds if seconds else None,
+                'peak_rss_mb': result['peak_rss_mb'],
+                'stages': result['stages'],
+                'instrumented_stages': {stage_name: stats['total_seconds']
+                                        for stage_name, stats in result['instrumentation']['stages'].items()},
+                'bytes_read': result['instrumentation']['bytes_read'],
+                'bytes_written': result['instrumentation']['bytes_written'],
+            }
+            shutil.rmtree(module_dir, ignore_errors=True)
+    finally:
+        shutil.rmtree(work_dir if not keep_work_dir else dataset_dir, ignore_errors=True)
+    return report
+
+
+def compare_to_baseline(report, baseline, tolerance=BASELINE_TOLERANCE):
+    """List the regressions of report against baseline. Each one is a readable string."""
+    regressions = []
+    if baseline.get('dataset') != report['dataset']:
+        regressions.append("baseline was recorded on a different synthetic dataset, save a new one")
+        return regressions
+    for name, result in report['modules'].items():
+        previous = baseline['modules'].get(name)
+        if not previous or 'files_per_sec' not in previous or 'files_per_sec' not in result:
+            continue
+        if result['files_per_sec'] < previous['files_per_sec'] * (1 - tolerance):
+            regressions.append(f"{name}: {result['files_per_sec']:.1f} files/sec, "
+                               f"baseline {previous['files_per_sec']:.1f}")
+        if result['peak_rss_mb'] and previous.get('peak_rss_mb') and \
+                result['peak_rss_mb'] > previous['peak_rss_mb'] * (1 + tolerance):
+            regressions.append(f"{name}: peak RSS {result['peak_rss_mb']:.0f} MB, "
+                               f"baseline {previous['peak_rss_mb']:.0f} MB")
+    return regressions
+
+
+def print_modules_report(report, regressions=None):
+    print(f"Synthetic dataset: {report['dataset']['count']} images, generated in {report['generate_seconds']:.1f}s")
+    for name, result in report['modules'].items():
+        if 'skipped' in result:
+            print(colored(f"  {name}: skipped ({result['skipped']})", "yellow"))
+        elif 'error' in result:
+            print(colored(f"  {name}: {result['error']}", "red"))
+        else:
+            rss = f"{result['peak_rss_mb']:.0f} MB" if result['peak_rss_mb'] else "n/a"
+            print(f"  {name}: {result['files_per_sec']:.1f} files/sec, {result['seconds']:.2f}s, peak RSS {rss}")
+            for stage_name, seconds in result['stages'].items():
+                print(f"      {stage_name}: {seconds:.2f}s")
+            for stage_name, seconds in result['instrumented_stages'].items():
+                print(f"        {stage_name}: {seconds:.2f}s")
+    if regressions is None:
+        return
+    for regression in regressions:
+        print(colored(f"Regression: {regression}", "red"))
+    print(colored("FAILED", "red") if regressions else colored("PASSED", "green"))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Dataset Sculptor benchmarks')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    startup = subparsers.add_parser('startup', help='Entry point startup time and lazy import check')
+    startup.add_argument('--runs', type=int, default=STARTUP_RUNS, help='Runs per measurement (median is used)')
+    startup.add_argument('--budget', type=float, default=STARTUP_BUDGET, help='Allowed seconds on top of Python startup')
+    startup.add_argument('--json', type=str, default=None, help='Also write the report to this JSON file')
+
+    modules = subparsers.add_parser('modules', help='Files/sec and peak memory per module on a synthetic dataset')
+    modules.add_argument('names', nargs='*', help=f"Modules to benchmark: {', '.join(MODULE_BENCHMARKS)} (default: all)")
+    modules.add_argument('--count', type=int, default=MODULE_DATASET['count'], help='Number of synthetic images')
+    modules.add_argument('--seed', type=int, default=MODULE_DATASET['seed'], help='Synthetic dataset seed')
+    modules.add_argument('--work_dir', type=str, default=None, help='Scratch folder (default: a temporary folder)')
+    modules.add_argument('--baseline', type=str, default=BASELINE_FILE, help='Baseline file to compare against')
+    modules.add_argument('--save-baseline', action='store_true', help='Store this run as the new baseline')
+    modules.add_argument('--tolerance', type=float, default=BASELINE_TOLERANCE, help='Allowed regression (0-1)')
+    modules.add_argument('--json', type=str, default=None, help='Also write the report to this JSON file')
+
+    args = parser.parse_args()
+
+    if args.command == 'modules':
+        unknown = [name for name in args.names if name not in MODULE_BENCHMARKS]
+        if unknown:
+            parser.error(f"Unknown module {', '.join(unknown)}. Choose from: {', '.join(MODULE_BENCHMARKS)}")
+        report = modules_benchmark(args.names, {'count': args.count, 'seed': args.seed}, args.work_dir)
+        regressions = None
+        if not args.save_baseline and os.path.isfile(args.baseline):
+            with open(args.baseline, 'r') as f:
+                regressions = compare_to_baseline(report, json.load(f), args.tolerance)
+        print_modules_report(report, regressions)
+        if args.json:
+            with open(args.json, 'w') as f:
+                json.dump(report, f, indent=2)
+        if args.save_baseline:
+            with open(args.baseline, 'w') as f:
+                json.dump(report, f, indent=2)
+            print(f"Baseline saved to {args.baseline}")
+        sys.exit(1 if regressions else 0)
+
+    if args.command == 'startup':
+        report = startup_benchmark(args.runs, args.budget)
+        print_startup_report(report)
+        if args.json:
+            with open(args.json, 'w') as f:
+                json.dump(report, f, indent=2)
+        sys.exit(0 if report['passed'] else 1)
+
+
+if __name__ == "__main__":
+    main()
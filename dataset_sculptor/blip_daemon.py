@@ -0,0 +1,352 @@
+"""
+Local BLIP inference daemon.
+
+Loads BlipForQuestionAnswering once and serves VQA requests over a Unix socket.
+Requests from every connected client go into one scheduler that merges them into
+shared batches, so two Dataset Sculptor sessions share a single copy of the model.
+
+Start it in a separate terminal:
+
+    python -m dataset_sculptor.blip_daemon
+
+Options 7, 8 and 9 use it automatically while it is running and fall back to
+loading the model themselves when it is not, or when it stops during a run.
+"""
+import argparse
+import json
+import os
+import queue
+import socket
+import socketserver
+import struct
+import tempfile
+import threading
+import time
+
+from termcolor import colored
+
+from dataset_sculptor import instrumentation
+
+MODEL_NAME = "Salesforce/blip-vqa-base"
+SOCKET_PATH = os.environ.get("DS_BLIP_SOCKET", os.path.join(tempfile.gettempdir(), "dataset_sculptor_blip.sock"))
+MAX_BATCH_SIZE = 16
+MAX_WAIT_MS = 20
+
+_HEADER = struct.Struct("!I")
+
+
+def _recv_exact(sock, size):
+    chunks = []
+    while size:
+        chunk = sock.recv(min(size, 1 << 20))
+        if not chunk:
+            raise ConnectionError("Connection closed by peer")
+        chunks.append(chunk)
+        size -= len(chunk)
+    return b"".join(chunks)
+
+
+def send_message(sock, header, payload=b""):
+    """Send a JSON header followed by an optional raw payload."""
+    header = dict(header, payload=len(payload))
+    encoded = json.dumps(header).encode("utf-8")
+    sock.sendall(_HEADER.pack(len(encoded)) + encoded + payload)
+
+
+def recv_message(sock):
+    """Receive a message sent by send_message. Returns (header, payload)."""
+    (length,) = _HEADER.unpack(_recv_exact(sock, _HEADER.size))
+    header = json.loads(_recv_exact(sock, length).decode("utf-8"))
+    payload = _recv_exact(sock, header.get("payload", 0))
+    return header, payload
+
+
+class _Request:
+    def __init__(self, image, question, max_new_tokens):
+        self.image = image
+        self.question = question
+        self.max_new_tokens = max_new_tokens
+        self.answer = None
+        self.error = None
+        self.done = threading.Event()
+
+
+class BatchScheduler:
+    """Collects requests from all clients and runs them through the model in batches."""
+
+    def __init__(self, model_name=MODEL_NAME, device=None, max_batch_size=MAX_BATCH_SIZE, max_wait_ms=MAX_WAIT_MS):
+        import torch
+        from transformers import AutoProcessor, BlipForQuestionAnswering
+
+        self.torch = torch
+        self.model_name = model_name
+        self.device = device or ("cuda" if torch.cuda.is_available() else "cpu")
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+
+        self.blip_model = BlipForQuestionAnswering.from_pretrained(model_name).to(self.device)
+        self.blip_model.eval()
+        print("Model loaded.")
+        self.processor = AutoProcessor.from_pretrained(model_name)
+        print("Processor loaded.")
+
+        self.requests = queue.Queue()
+        self.batches_run = 0
+        self.requests_served = 0
+        self.worker = threading.Thread(target=self._loop, daemon=True)
+        self.worker.start()
+
+    def submit(self, image, question, max_new_tokens=30):
+        request = _Request(image, question, max_new_tokens)
+        self.requests.put(request)
+        return request
+
+    def _collect_batch(self):
+        batch = [self.requests.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self.requests.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run_batch(self, batch):
+        inputs = self.processor(images=[r.image for r in batch], text=[r.question for r in batch],
+                                return_tensors="pt", padding=True).to(self.device)
+        max_new_tokens = max(r.max_new_tokens for r in batch)
+        with self.torch.inference_mode():
+            outputs = self.blip_model.generate(**inputs, max_new_tokens=max_new_tokens)
+        return self.processor.batch_decode(outputs, skip_special_tokens=True)
+
+    def _answer(self, batch):
+        try:
+            answers = self._run_batch(batch)
+        except Exception as e:
+            if len(batch) == 1:
+                batch[0].error = str(e)
+                return
+            # A merged batch holds other clients' requests, only the bad one should fail
+            for request in batch:
+                self._answer([request])
+            return
+        for request, answer in zip(batch, answers):
+            request.answer = answer
+
+    def _loop(self):
+        while True:
+            batch = self._collect_batch()
+            self._answer(batch)
+            self.batches_run += 1
+            self.requests_served += len(batch)
+            for request in batch:
+                request.done.set()
+
+
+class _ClientHandler(socketserver.BaseRequestHandler):
+
+    def handle(self):
+        import numpy as np
+
+        scheduler = self.server.scheduler
+        while True:
+            try:
+                header, payload = recv_message(self.request)
+            except (ConnectionError, OSError):
+                return
+
+            if header.get("cmd") == "ping":
+                send_message(self.request, {"ok": True, "model": scheduler.model_name, "device": scheduler.device})
+                continue
+
+            # A message carries one or more images; every item joins the shared queue
+            # so it can be batched together with requests from other clients.
+            pending = []
+            offset = 0
+            for item in header["items"]:
+                image = np.frombuffer(payload, dtype=item["dtype"], count=int(np.prod(item["shape"])), offset=offset)
+                offset += item["nbytes"]
+                pending.append(scheduler.submit(image.reshape(item["shape"]), item["question"],
+                                                item.get("max_new_tokens", 30)))
+
+            for request in pending:
+                request.done.wait()
+            send_message(self.request, {"answers": [r.answer for r in pending],
+                                        "errors": [r.error for r in pending]})
+
+
+class _DaemonServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+class DaemonClient:
+    """Connection to a running BLIP daemon."""
+
+    def __init__(self, sock, socket_path, model_name):
+        self.sock = sock
+        self.socket_path = socket_path
+        self.model_name = model_name
+        self.lock = threading.Lock()
+
+    def query_batch(self, images, questions, max_new_tokens=30):
+        """Ask one question per image. Returns the answers in order."""
+        import numpy as np
+
+        items = []
+        payload = []
+        for image, question in zip(images, questions):
+            if image is None:
+                raise ValueError("Cannot query the BLIP daemon without an image")
+            image = np.ascontiguousarray(image)
+            data = image.tobytes()
+            items.append({"question": question, "shape": list(image.shape), "dtype": str(image.dtype),
+                          "nbytes": len(data), "max_new_tokens": max_new_tokens})
+            payload.append(data)
+
+        with self.lock:
+            send_message(self.sock, {"items": items}, b"".join(payload))
+            response, _ = recv_message(self.sock)
+
+        for error in response["errors"]:
+            if error:
+                raise RuntimeError(f"BLIP daemon error: {error}")
+        return response["answers"]
+
+    def query(self, image, question, max_new_tokens=30):
+        return self.query_batch([image], [question], max_new_tokens)[0]
+
+    def reconnect(self):
+        """Connect again to a daemon that was restarted. Returns False if none is running."""
+        self.sock.close()
+        client = connect(self.model_name, self.socket_path)
+        if client is None:
+            return False
+        self.sock = client.sock
+        return True
+
+    def close(self):
+        self.sock.close()
+
+
+def connect(model_name=MODEL_NAME, socket_path=SOCKET_PATH, timeout=2.0):
+    """Return a DaemonClient if a daemon serving model_name is running, otherwise None."""
+    if not hasattr(socket, "AF_UNIX") or not os.path.exists(socket_path):
+        return None
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.settimeout(timeout)
+        sock.connect(socket_path)
+        send_message(sock, {"cmd": "ping"})
+        response, _ = recv_message(sock)
+        sock.settimeout(None)
+    except (OSError, ValueError):
+        sock.close()
+        return None
+    if response.get("model") != model_name:
+        sock.close()
+        return None
+    return DaemonClient(sock, socket_path, model_name)
+
+
+def load_ask(model_name, query_blip):
+    """
+    Returns (ask, client). ask(image, question) goes through a running daemon when there
+    is one, otherwise the model is loaded in this process and queried with query_blip.
+    """
+    client = connect(model_name)
+    if client:
+        print(f"Using BLIP daemon at {client.socket_path}")
+        return _timed_ask(_daemon_ask(client, model_name, query_blip)), client
+    return _timed_ask(_local_ask(model_name, query_blip)), None
+
+
+def _local_ask(model_name, query_blip):
+    from transformers import AutoProcessor, BlipForQuestionAnswering
+
+    with instrumentation.stage('load_model'):
+        blip_model = BlipForQuestionAnswering.from_pretrained(model_name)
+        print("Model loaded.")
+        processor = AutoProcessor.from_pretrained(model_name)
+        print("Processor loaded.")
+    return lambda image, question: query_blip(blip_model, processor, image, question)
+
+
+def _daemon_ask(client, model_name, query_blip):
+    """
+    client.query, reconnecting once when the daemon connection drops and loading the
+    model in this process when no daemon is running any more.
+    """
+    local = []
+
+    def ask(image, question):
+        if local:
+            return local[0](image, question)
+        try:
+            return client.query(image, question)
+        except OSError as e:  # ConnectionError and broken pipes
+            if client.reconnect():
+                print(colored(f"Lost the BLIP daemon ({e}), reconnected", "yellow"))
+                return client.query(image, question)
+            print(colored(f"Lost the BLIP daemon ({e}), loading the model in this process", "yellow"))
+            local.append(_local_ask(model_name, query_blip))
+            return local[0](image, question)
+    return ask
+
+
+def _timed_ask(ask):
+    def timed(image, question):
+        with instrumentation.stage('infer'):
+            return ask(image, question)
+    return timed
+
+
+def serve(model_name=MODEL_NAME, socket_path=SOCKET_PATH, device=None,
+          max_batch_size=MAX_BATCH_SIZE, max_wait_ms=MAX_WAIT_MS):
+    if not hasattr(socket, "AF_UNIX"):
+        print(colored("The BLIP daemon needs Unix socket support, which this platform does not provide.", "red"))
+        return
+
+    if os.path.exists(socket_path):
+        client = connect(model_name, socket_path)
+        if client:
+            client.close()
+            print(colored(f"A BLIP daemon is already running at {socket_path}", "red"))
+            return
+        os.remove(socket_path)  # stale socket left behind by a daemon that did not shut down cleanly
+
+    print("Starting...")
+    scheduler = BatchScheduler(model_name, device, max_batch_size, max_wait_ms)
+    server = _DaemonServer(socket_path, _ClientHandler)
+    server.scheduler = scheduler
+    os.chmod(socket_path, 0o600)
+
+    print(colored(f"BLIP daemon serving {model_name} on {scheduler.device} at {socket_path}", "green"))
+    print("Press Ctrl+C to stop.")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+        print(f"Served {scheduler.requests_served} requests in {scheduler.batches_run} batches.")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Dataset Sculptor BLIP inference daemon')
+    parser.add_argument('--model', type=str, default=MODEL_NAME, help='HuggingFace model name')
+    parser.add_argument('--socket', type=str, default=SOCKET_PATH, help='Unix socket path')
+    parser.add_argument('--device', type=str, default=None, help='Torch device (defaults to cuda when available)')
+    parser.add_argument('--batch_size', type=int, default=MAX_BATCH_SIZE, help='Maximum requests per batch')
+    parser.add_argument('--max_wait_ms', type=int, default=MAX_WAIT_MS, help='How long to wait for a batch to fill')
+    args = parser.parse_args()
+
+    serve(args.model, args.socket, args.device, args.batch_size, args.max_wait_ms)
+
+
+if __name__ == "__main__":
+    main()
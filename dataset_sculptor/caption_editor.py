@@ -0,0 +1,344 @@
+"""
+Bulk caption editor.
+
+Applies a list of rules to every caption in a folder: find and replace (literal or
+regex), prepend or append tags, drop duplicate tags and reorder tags. The rules are
+compiled once per worker process, captions are split into chunks across a process
+pool, and each worker reads and writes its chunk concurrently through caption_io
+with atomic writes. A dry run reports what would change without writing anything.
+
+Rules are plain dicts, so they can come from the menu or a JSON file:
+
+    [
+        {"rule": "replace", "find": "photo of", "replace": "photograph of"},
+        {"rule": "replace", "find": "\\s+,", "replace": ",", "regex": true},
+        {"rule": "prepend", "tags": ["masterpiece"]},
+        {"rule": "dedup"},
+        {"rule": "reorder", "front": ["masterpiece"], "sort": true}
+    ]
+
+    python -m dataset_sculptor.caption_editor --input_dir /data/in --rules rules.json --dry-run
+"""
+import argparse
+import collections
+import glob
+import json
+import os
+import re
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from termcolor import colored
+
+from dataset_sculptor import caption_io
+from dataset_sculptor import progress
+
+CHUNK_SIZE = 2000  # captions per worker task
+EDIT_WORKERS = os.cpu_count() or 4
+SAMPLE_DIFFS = 10  # changes shown after a dry run, every change goes to the per-file log
+
+RULES = ('replace', 'prepend', 'append', 'dedup', 'reorder')
+
+
+def split_tags(text):
+    return [tag.strip() for tag in text.split(',') if tag.strip()]
+
+
+def join_tags(tags):
+    return ', '.join(tags)
+
+
+def compile_rule(spec):
+    """A function text -> text for one rule spec."""
+    rule = spec.get('rule')
+    if rule == 'replace':
+        flags = re.IGNORECASE if spec.get('ignore_case') else 0
+        if not spec.get('regex') and not flags:
+            find, replace = spec['find'], spec.get('replace', '')
+            return lambda text: text.replace(find, replace)
+        pattern = re.compile(spec['find'] if spec.get('regex') else re.escape(spec['find']), flags)
+        # Literal replacements must not expand backreferences
+        replace = spec.get('replace', '') if spec.get('regex') else spec.get('replace', '').replace('\\', '\\\\')
+        return lambda text: pattern.sub(replace, text)
+    if rule in ('prepend', 'append'):
+        tags = [tag.strip() for tag in spec['tags'] if tag.strip()]
+
+        def add(text):
+            existing = split_tags(text)
+            present = {tag.lower() for tag in existing}
+            missing = [tag for tag in tags if tag.lower() not in present]
+            if not missing:
+                return text
+            return join_tags(missing + existing if rule == 'prepend' else existing + missing)
+        return add
+    if rule == 'dedup':
+        def dedup(text):
+            seen = set()
+            kept = []
+            tags = split_tags(text)
+            for tag in tags:
+                if tag.lower() not in seen:
+                    seen.add(tag.lower())
+                    kept.append(tag)
+            # Unchanged captions keep their own spacing and are not counted as edited
+            if len(kept) == len(tags):
+                return text
+            return join_tags(kept)
+        return dedup
+    if rule == 'reorder':
+        # Tags listed in front come first in that order, the rest keeps its order or is sorted
+        front = {tag.strip().lower(): i for i, tag in enumerate(spec.get('front', []))}
+        sort = spec.get('sort', False)
+
+        def reorder(text):
+            tags = split_tags(text)
+            first = sorted((tag for tag in tags if tag.lower() in front), key=lambda tag: front[tag.lower()])
+            rest = [tag for tag in tags if tag.lower() not in front]
+            if sort:
+                rest.sort(key=str.lower)
+            if first + rest == tags:
+                return text
+            return join_tags(first + rest)
+        return reorder
+    raise ValueError(f"Unknown rule {rule}. Choose from: {', '.join(RULES)}")
+
+
+def describe_rule(spec):
+    rule = spec['rule']
+    if rule == 'replace':
+        kind = 'regex' if spec.get('regex') else 'text'
+        case = ', ignore case' if spec.get('ignore_case') else ''
+        return f"replace {kind} '{spec['find']}' with '{spec.get('replace', '')}'{case}"
+    if rule in ('prepend', 'append'):
+        return f"{rule} {join_tags(spec['tags'])}"
+    if rule == 'reorder':
+        return f"reorder, first: {join_tags(spec.get('front', [])) or '-'}{', sort the rest' if spec.get('sort') else ''}"
+    return rule
+
+
+def apply_rules(rules, text, hits):
+    """Run text through every compiled rule, counting in hits which rules changed it."""
+    for i, rule in enumerate(rules):
+        new_text = rule(text)
+        if new_text != text:
+            hits[i] += 1
+            text = new_text
+    return text
+
+
+_worker_rules = None
+
+
+def _init_worker(specs):
+    global _worker_rules
+    _worker_rules = [compile_rule(spec) for spec in specs]
+
+
+def edit_chunk(paths, dry_run, rules=None):
+    """Edit one chunk of captions. Returns (changes, rule hits, errors), changes as (path, before, after)."""
+    rules = rules or _worker_rules
+    hits = collections.Counter()
+    changes = []
+
+    def update(path, text):
+        new_text = apply_rules(rules, text, hits)
+        if new_text != text:
+            changes.append((path, text, new_text))
+        return new_text
+
+    results = caption_io.update_captions(paths, update, write=not dry_run)
+    errors = [(path, str(result)) for path, result in results.items() if isinstance(result, Exception)]
+    return changes, hits, errors
+
+
+class CaptionEditor:
+
+    def __init__(self, input_dir, output_dir):
+        self.input_dir = input_dir
+        self.output_dir = output_dir
+        self.rules = []
+        self.dry_run = True
+        self.recursive = False
+
+    def set_input_dir(self, input_dir):
+        if os.path.isdir(input_dir):
+            self.input_dir = input_dir
+        else:
+            print("Not valid, no changes made")
+
+    def set_output_dir(self, output_dir):
+        if os.path.isdir(output_dir):
+            self.output_dir = output_dir
+        else:
+            print("Not valid, no changes made")
+
+    def add_rule(self, spec):
+        compile_rule(spec)  # fail on bad regexes now, not in every worker
+        self.rules.append(spec)
+
+    def display_menu(self):
+        rules = ''.join(f"\n    |                {describe_rule(spec)}" for spec in self.rules) or "\n    |                (none)"
+        print(colored(f'''
+    Current Input Directory: {self.input_dir}
+    Current Output Directory: {self.output_dir}
+    ┌──────────────────────────────────────────────────────────────────────────────┐
+    |                            BULK CAPTION EDITOR MODULE                        |
+    |------------------------------------------------------------------------------|
+    |                                                                              |
+    |              Rules (applied in order){rules}
+    |                                                                              |
+    |              Settings                                                        |
+    |                                                                              |
+    |          1 - Add Find / Replace (Text or Regex)
+    |          2 - Add Prepend Tags
+    |          3 - Add Append Tags
+    |          4 - Add Remove Duplicate Tags
+    |          5 - Add Reorder Tags
+    |          6 - Clear Rules
+    |          7 - Dry Run ({'On' if self.dry_run else 'Off'})
+    |          8 - Recursive ({'On' if self.recursive else 'Off'})
+    |                                                                              |
+    └──────────────────────────────────────────────────────────────────────────────┘
+    |      I - Set Input     O - Set Output     R - Run     X - Exit to Menu       |
+    └──────────────────────────────────────────────────────────────────────────────┘
+    ''', 'yellow'))
+
+        print("Module edits every .txt caption in the input directory with the rules above")
+        print("Tags are the comma separated parts of a caption")
+        print("Dry Run ON only counts and logs what would change, nothing is written")
+        print("Every change is recorded in the per-file log in DS_Logs")
+        print("Recursive ON processes subfolders of the input directory\n")
+
+    def list_captions(self):
+        pattern = '/**/*.txt' if self.recursive else '/*.txt'
+        return glob.glob(self.input_dir.rstrip('/') + pattern, recursive=self.recursive)
+
+    def edit_captions(self):
+        if not self.rules:
+            print("No rules to apply.")
+            return None
+        paths = self.list_captions()
+        chunks = [paths[i: i + CHUNK_SIZE] for i in range(0, len(paths), CHUNK_SIZE)]
+        hits = collections.Counter()
+        changed = 0
+        errors = 0
+        samples = []
+        start = time.time()
+
+        label = "Caption Editor" + (" (dry run)" if self.dry_run else "")
+        with progress.Progress(label, total=len(paths), log_name='caption_editor') as bar:
+            if len(chunks) > 1:
+                pool = ProcessPoolExecutor(max_workers=EDIT_WORKERS, initializer=_init_worker, initargs=(self.rules,))
+                results = pool.map(edit_chunk, chunks, [self.dry_run] * len(chunks))
+            else:
+                # Not worth starting processes for a single chunk
+                pool = None
+                rules = [compile_rule(spec) for spec in self.rules]
+                results = (edit_chunk(chunk, self.dry_run, rules) for chunk in chunks)
+            try:
+                for chunk, (chunk_changes, chunk_hits, chunk_errors) in zip(chunks, results):
+                    hits.update(chunk_hits)
+                    changed += len(chunk_changes)
+                    for path, before, after in chunk_changes:
+                        bar.file(path, 'would_edit' if self.dry_run else 'edited', before=before, after=after)
+                        if len(samples) < SAMPLE_DIFFS:
+                            samples.append((path, before, after))
+                    for path, message in chunk_errors:
+                        errors += 1
+                        bar.error(f"Unable to edit caption {path}: {message}", path)
+                    bar.advance(len(chunk))
+            finally:
+                if pool:
+                    pool.shutdown()
+
+        for path, before, after in samples:
+            print(path)
+            print(colored(f"  - {before.strip()}", 'red'))
+            print(colored(f"  + {after.strip()}", 'green'))
+        for i, spec in enumerate(self.rules):
+            print(f"{hits[i]:>9}  {describe_rule(spec)}")
+        print(f"Total captions checked: {len(paths)}")
+        print(f"Total captions {'that would change' if self.dry_run else 'changed'}: {changed}")
+        if errors:
+            print(colored(f"Total failures: {errors}", 'red'))
+        print(f"Finished in {time.time() - start:.1f}s")
+        return changed
+
+    def run(self):
+        while True:
+            self.display_menu()
+            choice = input("Enter your selection: ")
+
+            try:
+                if choice == '1':
+                    find = input("Find: ")
+                    replace = input("Replace with: ")
+                    regex = input("Is the find text a regular expression? (Y/N)").lower() in ['y', 'yes']
+                    ignore_case = input("Ignore case? (Y/N)").lower() in ['y', 'yes']
+                    if find:
+                        self.add_rule({'rule': 'replace', 'find': find, 'replace': replace, 'regex': regex, 'ignore_case': ignore_case})
+                elif choice in ('2', '3'):
+                    tags = split_tags(input("Tags, separated by commas: "))
+                    if tags:
+                        self.add_rule({'rule': 'prepend' if choice == '2' else 'append', 'tags': tags})
+                elif choice == '4':
+                    self.add_rule({'rule': 'dedup'})
+                elif choice == '5':
+                    front = split_tags(input("Tags to move to the front in this order, separated by commas (optional): "))
+                    sort = input("Sort the other tags alphabetically? (Y/N)").lower() in ['y', 'yes']
+                    self.add_rule({'rule': 'reorder', 'front': front, 'sort': sort})
+                elif choice == '6':
+                    self.rules = []
+                elif choice == '7':
+                    user_input = input("Dry run, only report what would change? (Y/N)").lower()
+                    self.dry_run = user_input in ['y', 'yes']
+                elif choice == '8':
+                    user_input = input("Process folders recursively? (Y/N)").lower()
+                    self.recursive = user_input in ['y', 'yes']
+                elif choice.lower() == 'i':
+                    new_input_dir = input("Change Input Directory: ")
+                    self.set_input_dir(new_input_dir)
+                elif choice.lower() == 'o':
+                    new_output_dir = input("Change Output Directory: ")
+                    self.set_output_dir(new_output_dir)
+                elif choice.lower() == 'r':
+                    if self.dry_run:
+                        self.edit_captions()
+                        continue
+                    confirm = input("WARNING: Module will rewrite caption files in place\nDataset Sculptor is experimental and only intended for backed up datasets\nUse only on backed up datasets and at your own risk\nRun the module? (Y/N) ")
+                    if confirm.lower() in ['y', 'yes']:
+                        self.edit_captions()
+                elif choice.lower() == 'x':
+                    break
+                else:
+                    print("Invalid choice. Please choose a valid option or press 'x' to exit.")
+            except re.error as e:
+                print(f"Invalid regular expression ({e}), no changes made.")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Dataset Sculptor bulk caption editor')
+    parser.add_argument('--input_dir', type=str, required=True, help='Folder with the .txt captions')
+    parser.add_argument('--rules', type=str, required=True, help='JSON file with a list of rules')
+    parser.add_argument('--recursive', action='store_true', help='Also edit captions in subfolders')
+    parser.add_argument('--dry-run', action='store_true', help='Only report what would change')
+    parser.add_argument('--quiet', action='store_true', help='No progress line, only summaries and errors')
+    parser.add_argument('--log_dir', type=str, default=None, help='Per-file log folder, records every change')
+    args = parser.parse_args()
+
+    with open(args.rules, 'r', encoding='utf-8') as f:
+        specs = json.load(f)
+    editor = CaptionEditor(args.input_dir, args.input_dir)
+    try:
+        for spec in specs:
+            editor.add_rule(spec)
+    except (ValueError, KeyError, re.error) as e:
+        parser.error(f"Invalid rule: {e}")
+    editor.dry_run = args.dry_run
+    editor.recursive = args.recursive
+    progress.configure(quiet=args.quiet, log_dir=args.log_dir)
+    editor.edit_captions()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,127 @@
+"""
+Concurrent caption file I/O.
+
+Captions are thousands of tiny .txt files. Read or written one after another every
+file costs a full round trip, which dominates on network drives. The functions here
+take a whole batch of captions and keep up to CONCURRENCY of them in flight on an
+asyncio loop, using aiofiles when it is installed and the loop's thread pool when
+it is not. They are called from ordinary synchronous code:
+
+    captions = caption_io.read_captions(caption_paths)
+    errors = caption_io.write_captions({path: text for path, text in ...})
+
+Results and errors are per file, one failing caption never stops the batch. Whole
+captions are written atomically, appends are not.
+"""
+import asyncio
+import os
+
+from dataset_sculptor import instrumentation
+
+try:
+    import aiofiles
+except ImportError:
+    aiofiles = None
+
+CONCURRENCY = 64
+ENCODING = 'utf-8'
+
+
+def caption_path(image_path):
+    return os.path.splitext(image_path)[0] + '.txt'
+
+
+def _read_blocking(path):
+    with open(path, 'r', encoding=ENCODING, errors='ignore') as f:
+        return f.read()
+
+
+def _write_blocking(path, text, mode):
+    with open(path, mode, encoding=ENCODING) as f:
+        f.write(text)
+
+
+async def _read(path):
+    if aiofiles:
+        async with aiofiles.open(path, 'r', encoding=ENCODING, errors='ignore') as f:
+            text = await f.read()
+    else:
+        text = await asyncio.get_running_loop().run_in_executor(None, _read_blocking, path)
+    instrumentation.read_bytes(len(text))
+    return text
+
+
+async def _write(path, text, mode='w'):
+    # Whole captions go to a temporary file that then replaces the caption, a crash never leaves half of one
+    target = path
+    if mode == 'w':
+        path = f"{target}.{os.getpid()}.tmp"
+    if aiofiles:
+        async with aiofiles.open(path, mode, encoding=ENCODING) as f:
+            await f.write(text)
+    else:
+        await asyncio.get_running_loop().run_in_executor(None, _write_blocking, path, text, mode)
+    if path != target:
+        await asyncio.get_running_loop().run_in_executor(None, os.replace, path, target)
+    instrumentation.wrote_bytes(len(text))
+
+
+async def _each(function, items, concurrency):
+    """function(item) for every item with at most concurrency running. Returns {item: result or exception}."""
+    results = {}
+    iterator = iter(items)
+
+    async def worker():
+        # Workers share one iterator, so millions of items never become millions of tasks
+        for item in iterator:
+            try:
+                results[item] = await function(item)
+            except Exception as e:
+                results[item] = e
+
+    await asyncio.gather(*(worker() for _ in range(max(1, concurrency))))
+    return results
+
+
+def run(function, items, concurrency=CONCURRENCY):
+    """Run the coroutine function over items on a fresh event loop, see _each."""
+    with instrumentation.stage('caption_io'):
+        return asyncio.run(_each(function, items, concurrency))
+
+
+def read_captions(paths, concurrency=CONCURRENCY):
+    """{path: text}. Missing captions map to None, unreadable ones to the exception."""
+    async def read(path):
+        try:
+            return await _read(path)
+        except FileNotFoundError:
+            return None
+
+    return run(read, paths, concurrency)
+
+
+def write_captions(captions, concurrency=CONCURRENCY, append=False):
+    """Write {path: text}, or append text when append is set. Returns {path: exception} for the failures."""
+    async def write(path):
+        await _write(path, captions[path], 'a' if append else 'w')
+
+    results = run(write, list(captions), concurrency)
+    return {path: result for path, result in results.items() if isinstance(result, Exception)}
+
+
+def update_captions(paths, update, concurrency=CONCURRENCY, write=True):
+    """
+    Read, change and write back each caption. update(path, text) returns the new text,
+    or None to leave the file alone. Returns {path: True if changed, False if left alone,
+    or the exception}. With write=False nothing is written, for dry runs.
+    """
+    async def change(path):
+        text = await _read(path)
+        new_text = update(path, text)
+        if new_text is None or new_text == text:
+            return False
+        if write:
+            await _write(path, new_text)
+        return True
+
+    return run(change, paths, concurrency)
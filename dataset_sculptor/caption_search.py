@@ -0,0 +1,475 @@
+"""
+Caption search.
+
+A persistent inverted index from caption words to caption files, kept in SQLite next
+to the catalog (Output/DS_Catalog/caption_index.sqlite). It is built once and then
+only re-reads captions whose size or mtime changed, so queries never open caption
+files. Queries are boolean:
+
+    red car                       both words (AND is implied)
+    "red car" OR truck            a phrase or a word
+    dog AND NOT (cat OR "black and white")
+    sun*                          any word starting with sun
+
+Matching image-caption pairs can be copied or moved into Output/DS_Search/<name>.
+
+    python -m dataset_sculptor.caption_search --input_dir /data/in --recursive --query '"red car" NOT truck'
+"""
+import argparse
+import os
+import re
+import sqlite3
+import time
+
+from termcolor import colored
+
+from dataset_sculptor import caption_io
+from dataset_sculptor import catalog
+from dataset_sculptor import file_ops
+from dataset_sculptor import instrumentation
+from dataset_sculptor import progress
+from dataset_sculptor.delete_small_images import SUPPORTED_FORMATS
+
+INDEX_FILE = "caption_index.sqlite"
+SEARCH_DIR = "DS_Search"
+READ_BATCH = 2000  # captions read concurrently and committed together during an update
+TOKEN_PATTERN = re.compile(r"[^\W_]+(?:'[^\W_]+)*")  # words, underscores separate them as in black_and_white
+QUERY_PATTERN = re.compile(r'"[^"]*"|\(|\)|[^\s()"]+')
+
+
+def tokenize(text):
+    return TOKEN_PATTERN.findall(text.lower())
+
+
+def default_path(output_dir):
+    return os.path.join(output_dir, catalog.CATALOG_DIR, INDEX_FILE) if output_dir else None
+
+
+class QueryError(ValueError):
+    pass
+
+
+def parse_query(text):
+    """
+    Parse a query into nested tuples: ('word', w), ('prefix', p), ('phrase', [words]),
+    ('not', q), ('and', [q, ...]), ('or', [q, ...]). NOT binds tighter than AND, AND than OR.
+    """
+    tokens = QUERY_PATTERN.findall(text)
+    position = [0]
+
+    def peek():
+        return tokens[position[0]] if position[0] < len(tokens) else None
+
+    def take():
+        position[0] += 1
+        return tokens[position[0] - 1]
+
+    def parse_or():
+        terms = [parse_and()]
+        while peek() == 'OR':
+            take()
+            terms.append(parse_and())
+        return terms[0] if len(terms) == 1 else ('or', terms)
+
+    def parse_and():
+        terms = [parse_not()]
+        while peek() not in (None, ')', 'OR'):
+            if peek() == 'AND':
+                take()
+            terms.append(parse_not())
+        return terms[0] if len(terms) == 1 else ('and', terms)
+
+    def parse_not():
+        if peek() == 'NOT':
+            take()
+            return ('not', parse_not())
+        if peek() and peek().startswith('-') and len(peek()) > 1:
+            return ('not', parse_term(take()[1:]))
+        return parse_term(take() if peek() is not None else None)
+
+    def parse_term(token):
+        if token is None or token in (')', 'AND', 'OR'):
+            raise QueryError(f"Incomplete query: {text}")
+        if token == '(':
+            inner = parse_or()
+            if peek() != ')':
+                raise QueryError(f"Missing ) in query: {text}")
+            take()
+            return inner
+        if token.startswith('"'):
+            words = tokenize(token.strip('"'))
+            if not words:
+                raise QueryError(f"Empty phrase in query: {text}")
+            return ('phrase', words) if len(words) > 1 else ('word', words[0])
+        if token.endswith('*') and len(token) > 1:
+            return ('prefix', token[:-1].lower())
+        words = tokenize(token)
+        if not words:
+            raise QueryError(f"Nothing to search for in {token}")
+        # tag-like input such as black_and_white or t-shirt becomes a phrase of its words
+        return ('phrase', words) if len(words) > 1 else ('word', words[0])
+
+    if not tokens:
+        raise QueryError("Empty query")
+    tree = parse_or()
+    if peek() is not None:
+        raise QueryError(f"Unexpected {peek()} in query: {text}")
+    return tree
+
+
+class CaptionIndex:
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        self.conn = sqlite3.connect(db_path, timeout=60)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.executescript('''
+            CREATE TABLE IF NOT EXISTS captions (
+                doc_id INTEGER PRIMARY KEY,
+                path TEXT UNIQUE NOT NULL,
+                image TEXT,
+                size INTEGER NOT NULL,
+                mtime_ns INTEGER NOT NULL,
+                words TEXT NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS postings (
+                token TEXT NOT NULL,
+                doc_id INTEGER NOT NULL,
+                PRIMARY KEY (token, doc_id)
+            ) WITHOUT ROWID;
+            CREATE INDEX IF NOT EXISTS postings_doc ON postings (doc_id);
+        ''')
+
+    def close(self):
+        self.conn.close()
+
+    def _walk(self, input_dir, recursive):
+        """(caption path, paired image path or None) for every caption under input_dir."""
+        for root, dirs, files in os.walk(input_dir):
+            dirs[:] = [d for d in dirs if not d.startswith('DS_')]
+            images = {os.path.splitext(name)[0]: name for name in files if name.lower().endswith(tuple(SUPPORTED_FORMATS))}
+            for name in files:
+                if name.lower().endswith('.txt'):
+                    image = images.get(os.path.splitext(name)[0])
+                    yield os.path.abspath(os.path.join(root, name)), os.path.abspath(os.path.join(root, image)) if image else None
+            if not recursive:
+                break
+
+    def _remove(self, doc_ids):
+        self.conn.executemany('DELETE FROM postings WHERE doc_id = ?', ((doc_id,) for doc_id in doc_ids))
+        self.conn.executemany('DELETE FROM captions WHERE doc_id = ?', ((doc_id,) for doc_id in doc_ids))
+
+    def _index(self, batch):
+        """Read and index [(caption path, image, size, mtime_ns, old doc_id or None)]."""
+        texts = caption_io.read_captions([entry[0] for entry in batch])
+        failed = 0
+        with self.conn:
+            self._remove([entry[4] for entry in batch if entry[4] is not None])
+            for path, image, size, mtime_ns, doc_id in batch:
+                text = texts.get(path)
+                if not isinstance(text, str):
+                    failed += 1
+                    continue
+                words = tokenize(text)
+                cursor = self.conn.execute('INSERT INTO captions (path, image, size, mtime_ns, words) VALUES (?, ?, ?, ?, ?)',
+                                           (path, image, size, mtime_ns, ' '.join(words)))
+                self.conn.executemany('INSERT OR IGNORE INTO postings VALUES (?, ?)',
+                                      ((word, cursor.lastrowid) for word in set(words)))
+        return failed
+
+    def update(self, input_dir, recursive=True):
+        """Index new and changed captions under input_dir and drop captions that are gone."""
+        known = {path: (doc_id, size, mtime_ns, image) for doc_id, path, size, mtime_ns, image in
+                 self.conn.execute('SELECT doc_id, path, size, mtime_ns, image FROM captions')}
+        prefix = os.path.join(os.path.abspath(input_dir), '')
+        seen = set()
+        counts = {'unchanged': 0, 'indexed': 0, 'removed': 0, 'failed': 0}
+        batch = []
+
+        with progress.Progress("Caption Index") as bar:
+            for path, image in self._walk(input_dir, recursive):
+                bar.advance()
+                seen.add(path)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                old = known.get(path)
+                if old and (old[1], old[2]) == (stat.st_size, stat.st_mtime_ns):
+                    counts['unchanged'] += 1
+                    if old[3] != image:
+                        self.conn.execute('UPDATE captions SET image = ? WHERE doc_id = ?', (image, old[0]))
+                    continue
+                batch.append((path, image, stat.st_size, stat.st_mtime_ns, old[0] if old else None))
+                if len(batch) >= READ_BATCH:
+                    counts['failed'] += self._index(batch)
+                    counts['indexed'] += len(batch)
+                    batch = []
+            if batch:
+                counts['failed'] += self._index(batch)
+                counts['indexed'] += len(batch)
+
+            gone = [doc_id for path, (doc_id, size, mtime_ns, image) in known.items()
+                    if path.startswith(prefix) and path not in seen
+                    and (recursive or os.path.dirname(path) == prefix.rstrip(os.sep))]
+            with self.conn:
+                self._remove(gone)
+            counts['removed'] = len(gone)
+        counts['indexed'] -= counts['failed']
+        return counts
+
+    def _docs(self, node):
+        kind = node[0]
+        if kind == 'word':
+            return {row[0] for row in self.conn.execute('SELECT doc_id FROM postings WHERE token = ?', (node[1],))}
+        if kind == 'prefix':
+            return {row[0] for row in self.conn.execute('SELECT DISTINCT doc_id FROM postings WHERE token >= ? AND token < ?',
+                                                        (node[1], node[1] + '\U0010ffff'))}
+        if kind == 'phrase':
+            candidates = set.intersection(*(self._docs(('word', word)) for word in node[1]))
+            if not candidates:
+                return candidates
+            # Postings only say all words occur, the stored word sequence says whether they are adjacent
+            phrase = f" {' '.join(node[1])} "
+            matches = set()
+            ids = list(candidates)
+            for i in range(0, len(ids), 900):
+                chunk = ids[i: i + 900]
+                rows = self.conn.execute(f"SELECT doc_id, words FROM captions WHERE doc_id IN ({','.join('?' * len(chunk))})", chunk)
+                matches.update(doc_id for doc_id, words in rows if phrase in f" {words} ")
+            return matches
+        if kind == 'not':
+            return self._all() - self._docs(node[1])
+        if kind == 'and':
+            # Positive terms first, so NOT terms only ever subtract from a small set
+            positive = [term for term in node[1] if term[0] != 'not']
+            negative = [term[1] for term in node[1] if term[0] == 'not']
+            result = set.intersection(*(self._docs(term) for term in positive)) if positive else self._all()
+            for term in negative:
+                if not result:
+                    break
+                result -= self._docs(term)
+            return result
+        if kind == 'or':
+            return set().union(*(self._docs(term) for term in node[1]))
+        raise QueryError(f"Unknown query node {kind}")
+
+    def _all(self):
+        return {row[0] for row in self.conn.execute('SELECT doc_id FROM captions')}
+
+    def search(self, query, under=None):
+        """[(caption path, image path or None)] of the captions matching query, optionally only under a folder."""
+        with instrumentation.stage('search'):
+            doc_ids = sorted(self._docs(parse_query(query)))
+            results = []
+            for i in range(0, len(doc_ids), 900):
+                chunk = doc_ids[i: i + 900]
+                results.extend(self.conn.execute(
+                    f"SELECT path, image FROM captions WHERE doc_id IN ({','.join('?' * len(chunk))})", chunk))
+        if under:
+            prefix = os.path.join(os.path.abspath(under), '')
+            results = [result for result in results if result[0].startswith(prefix)]
+        return sorted(results)
+
+    def forget(self, paths):
+        with self.conn:
+            for path in paths:
+                self.conn.execute('DELETE FROM postings WHERE doc_id IN (SELECT doc_id FROM captions WHERE path = ?)', (path,))
+                self.conn.execute('DELETE FROM captions WHERE path = ?', (path,))
+
+
+def folder_name(query):
+    return re.sub(r'[^\w]+', '_', query).strip('_')[:60] or 'results'
+
+
+class CaptionSearch:
+
+    def __init__(self, input_dir, output_dir):
+        self.input_dir = input_dir
+        self.output_dir = output_dir
+        self.query = ""
+        self.copy_or_move = "COPY"
+        self.folder = ""
+        self.recursive = False
+
+    def set_input_dir(self, input_dir):
+        if os.path.isdir(input_dir):
+            self.input_dir = input_dir
+        else:
+            print("Not valid, no changes made")
+
+    def set_output_dir(self, output_dir):
+        if os.path.isdir(output_dir):
+            self.output_dir = output_dir
+        else:
+            print("Not valid, no changes made")
+
+    def display_menu(self):
+        print(colored(f'''
+    Current Input Directory: {self.input_dir}
+    Current Output Directory: {self.output_dir}
+    ┌──────────────────────────────────────────────────────────────────────────────┐
+    |                          SEARCH CAPTIONS MODULE                              |
+    |------------------------------------------------------------------------------|
+    |                                                                              |
+    |              Settings                                                        |
+    |                                                                              |
+    |          1 - Query ({self.query or "NONE"})
+    |          2 - Copy or Move ({self.copy_or_move})
+    |          3 - Folder Name (DS_Search/{self.folder or folder_name(self.query) if self.query else "..."})
+    |          4 - Recursive ({'ON' if self.recursive else 'OFF'})
+    |          5 - Preview Matches
+    |                                                                              |
+    └──────────────────────────────────────────────────────────────────────────────┘
+    |      I - Set Input     O - Set Output     R - Run     X - Exit to Menu       |
+    └──────────────────────────────────────────────────────────────────────────────┘
+    ''', 'light_green'))
+
+        print("Module finds image-caption pairs by the words in their captions")
+        print('Queries combine words and "quoted phrases" with AND, OR, NOT and parentheses, word* matches a prefix')
+        print("Captions are indexed once in DS_Catalog, later runs only re-read changed captions")
+        print("Copy or Move places matching pairs in DS_Search/<Folder Name> in the Output Folder")
+        print("Recursive ON processes subfolders of the input directory\n")
+
+    def open_index(self):
+        index = CaptionIndex(default_path(self.output_dir))
+        counts = index.update(self.input_dir, self.recursive)
+        if counts['indexed'] or counts['removed']:
+            print(f"Indexed {counts['indexed']} captions, removed {counts['removed']}, unchanged {counts['unchanged']}")
+        return index
+
+    def find(self, index):
+        start = time.perf_counter()
+        matches = index.search(self.query, under=self.input_dir)
+        if not self.recursive:
+            matches = [match for match in matches
+                       if os.path.dirname(match[0]) == os.path.abspath(self.input_dir)]
+        print(f"{len(matches)} captions match {self.query} ({(time.perf_counter() - start) * 1000:.1f} ms)")
+        return matches
+
+    def preview(self):
+        index = self.open_index()
+        try:
+            matches = self.find(index)
+        finally:
+            index.close()
+        for caption, image in matches[:20]:
+            print(f"  {image or caption}")
+
+    def route(self):
+        """Copy or move the image-caption pairs matching the query."""
+        index = self.open_index()
+        action = 'move' if self.copy_or_move == "MOVE" else 'copy'
+        done_pairs = []
+        try:
+            matches = self.find(index)
+            destination_dir = os.path.join(self.output_dir, SEARCH_DIR, self.folder or folder_name(self.query))
+            with progress.Progress("Search Captions", total=len(matches)) as bar, file_ops.Transfers() as transfers:
+                def done(source, destination, error):
+                    if error:
+                        bar.error(f"Unable to {action} {source}: {error}", source)
+                    else:
+                        bar.file(source, 'moved' if action == 'move' else 'copied', destination=destination)
+                        done_pairs.append(file_ops.caption_for(source))
+                    bar.advance()
+
+                for caption, image in matches:
+                    # The image decides the name, its caption follows it
+                    transfers.pair(image or caption, destination_dir, action, done=done)
+            if action == 'move':
+                # Moved captions left the indexed folder
+                index.forget(done_pairs)
+        finally:
+            index.close()
+        print(f"Total pairs {'moved' if action == 'move' else 'copied'}: {len(done_pairs)}")
+
+    def run(self):
+        while True:
+            self.display_menu()
+            choice = input("Enter your selection: ")
+
+            try:
+                if choice == '1':
+                    query = input('Enter query, e.g. "red car" AND NOT truck: ').strip()
+                    parse_query(query)
+                    self.query = query
+                elif choice == '2':
+                    user_input = input("Copy [1] or Move [2]: ").strip()
+                    if user_input in ('1', '2'):
+                        self.copy_or_move = "COPY" if user_input == '1' else "MOVE"
+                    else:
+                        print("Invalid option, no changes made.")
+                elif choice == '3':
+                    self.folder = folder_name(input("Folder name inside DS_Search (empty to name it after the query): "))
+                    if self.folder == 'results':
+                        self.folder = ''
+                elif choice == '4':
+                    user_input = input("Process folders recursively? (Y/N)").lower()
+                    self.recursive = user_input in ['y', 'yes']
+                elif choice == '5':
+                    if self.query:
+                        self.preview()
+                    else:
+                        print("Set a query first.")
+                elif choice.lower() == 'i':
+                    new_input_dir = input("Change Input Directory: ")
+                    self.set_input_dir(new_input_dir)
+                elif choice.lower() == 'o':
+                    new_output_dir = input("Change Output Directory: ")
+                    self.set_output_dir(new_output_dir)
+                elif choice.lower() == 'r':
+                    if not self.query:
+                        print("Set a query first.")
+                        continue
+                    if self.copy_or_move == "COPY":
+                        self.route()
+                        continue
+                    confirm = input("WARNING: Module will move matching images and their captions\nDataset Sculptor is experimental and only intended for backed up datasets\nUse only on backed up datasets and at your own risk\nRun the module? (Y/N) ")
+                    if confirm.lower() in ['y', 'yes']:
+                        self.route()
+                elif choice.lower() == 'x':
+                    break
+                else:
+                    print("Invalid choice. Please choose a valid option or press 'x' to exit.")
+            except QueryError as e:
+                print(f"{e}, no changes made.")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Dataset Sculptor caption search')
+    parser.add_argument('--input_dir', type=str, required=True, help='Folder with the image-caption pairs')
+    parser.add_argument('--output_dir', type=str, default=None, help='Output directory (default: the input directory)')
+    parser.add_argument('--query', type=str, default=None, help='Print the image-caption pairs matching this query')
+    parser.add_argument('--recursive', action='store_true', help='Include subfolders')
+    parser.add_argument('--copy_to', type=str, default=None, help='Copy matching pairs to DS_Search/<this name>')
+    parser.add_argument('--move_to', type=str, default=None, help='Move matching pairs to DS_Search/<this name>')
+    args = parser.parse_args()
+
+    search = CaptionSearch(args.input_dir, args.output_dir or args.input_dir)
+    search.recursive = args.recursive
+    if not args.query:
+        index = search.open_index()
+        index.close()
+        return
+    try:
+        parse_query(args.query)
+    except QueryError as e:
+        parser.error(str(e))
+    search.query = args.query
+    if args.copy_to or args.move_to:
+        search.copy_or_move = "MOVE" if args.move_to else "COPY"
+        search.folder = folder_name(args.move_to or args.copy_to)
+        search.route()
+    else:
+        index = search.open_index()
+        try:
+            for caption, image in search.find(index):
+                print(image or caption)
+        finally:
+            index.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,431 @@
+"""
+Persistent dataset catalog.
+
+Facts about each image that modules keep recomputing (dimensions, format, content
+hash, greyscale score, caption text, BLIP answers) are stored in a SQLite database
+keyed by path. Every row remembers the size and mtime the file had when the facts
+were gathered, and a row whose file changed since is treated as missing, so the
+catalog never serves stale values. Rescans only look at new and changed files.
+
+Modules read through the catalog configured for the run (Output/DS_Catalog by
+default) and fall back to computing the value when there is no catalog.
+
+    python -m dataset_sculptor.catalog refresh --db catalog.sqlite --input_dir /data/in --hash --bw --thumbnails
+    python -m dataset_sculptor.catalog query --db catalog.sqlite --max_side 768 --caption "red car"
+"""
+import argparse
+import atexit
+import glob
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from termcolor import colored
+
+from dataset_sculptor import memory_guard
+
+CATALOG_DIR = "DS_Catalog"
+CATALOG_FILE = "catalog.sqlite"
+CATALOG_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.webp', '.bmp', '.gif', '.tif', '.tiff', '.tga', '.ico', '.pcx', '.ppm')
+COMMIT_EVERY = 500  # writes per transaction, one commit per file would dominate a rescan
+REFRESH_WORKERS = 8
+CAPTION_BATCH = 1000  # captions read concurrently in one go during a refresh
+
+# Columns filled from the image itself, all cleared when the file changes
+IMAGE_COLUMNS = ('width', 'height', 'format', 'mode', 'content_hash', 'bw_score')
+
+_settings = {'path': None}
+_open = {}
+
+
+def configure(path):
+    """Use the catalog at path for the rest of the run, None to run without a catalog."""
+    _settings['path'] = path
+
+
+def default_path(output_dir):
+    return os.path.join(output_dir, CATALOG_DIR, CATALOG_FILE) if output_dir else None
+
+
+def current():
+    """The configured Catalog, opened on first use, or None."""
+    path = _settings['path']
+    if not path:
+        return None
+    if path not in _open:
+        if not _open:
+            atexit.register(close_all)
+        _open[path] = Catalog(path)
+    return _open[path]
+
+
+def close_all():
+    """Commit and close every catalog opened through current(). Writes are batched, this keeps the last batch."""
+    for catalog in list(_open.values()):
+        catalog.close()
+
+
+def _stat(path):
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_size, stat.st_mtime_ns
+
+
+def _caption_path(path):
+    return os.path.splitext(path)[0] + '.txt'
+
+
+def _like_escape(text):
+    """Escape LIKE wildcards, for use with ESCAPE '\\'."""
+    return text.replace('\\', '\\\\').replace('%', r'\%').replace('_', r'\_')
+
+
+def content_hash(path):
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class Catalog:
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        # Modules hash and decode from thread pools, the lock serialises access to the connection
+        self.lock = threading.RLock()
+        self.conn = sqlite3.connect(db_path, timeout=60, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.executescript('''
+            CREATE TABLE IF NOT EXISTS images (
+                path TEXT PRIMARY KEY,
+                size INTEGER NOT NULL,
+                mtime_ns INTEGER NOT NULL,
+                width INTEGER,
+                height INTEGER,
+                format TEXT,
+                mode TEXT,
+                content_hash TEXT,
+                bw_score REAL,
+                caption TEXT,
+                caption_mtime_ns INTEGER,
+                updated REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS images_dims ON images (width, height);
+            CREATE INDEX IF NOT EXISTS images_hash ON images (content_hash);
+            CREATE TABLE IF NOT EXISTS answers (
+                path TEXT NOT NULL,
+                question TEXT NOT NULL,
+                answer TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                mtime_ns INTEGER NOT NULL,
+                PRIMARY KEY (path, question)
+            );
+        ''')
+        self.columns = [description[0] for description in self.conn.execute('SELECT * FROM images LIMIT 0').description]
+        self.pending = 0
+
+    def close(self):
+        with self.lock:
+            self.conn.commit()
+            self.conn.close()
+        _open.pop(self.db_path, None)
+
+    def _written(self):
+        self.pending += 1
+        if self.pending >= COMMIT_EVERY:
+            self.commit()
+
+    def commit(self):
+        with self.lock:
+            self.conn.commit()
+            self.pending = 0
+
+    def _fresh_row(self, path, stat):
+        """The row for path as a dict if it still describes the file on disk, else None."""
+        row = self.conn.execute('SELECT * FROM images WHERE path = ?', (path,)).fetchone()
+        if row is None:
+            return None
+        row = dict(zip(self.columns, row))
+        return row if (row['size'], row['mtime_ns']) == stat else None
+
+    def _store(self, path, stat, values):
+        """Write values for path. A file that changed since its row was written starts from a clean row."""
+        fresh = self._fresh_row(path, stat)
+        if fresh is None:
+            self.conn.execute('DELETE FROM images WHERE path = ?', (path,))
+            self.conn.execute('INSERT INTO images (path, size, mtime_ns, updated) VALUES (?, ?, ?, ?)',
+                              (path, stat[0], stat[1], time.time()))
+        if values:
+            assignments = ', '.join(f"{column} = ?" for column in values)
+            self.conn.execute(f'UPDATE images SET {assignments}, updated = ? WHERE path = ?',
+                              list(values.values()) + [time.time(), path])
+        self._written()
+
+    def cached(self, path, columns, compute):
+        """
+        The values of columns for path, from the catalog when they are there and the
+        file is unchanged, otherwise from compute(path), which returns a dict with at
+        least those columns. Whatever compute returns is stored.
+        """
+        path = os.path.abspath(path)
+        stat = _stat(path)
+        if stat is None:
+            return compute(path)
+        with self.lock:
+            row = self._fresh_row(path, stat)
+        if row is not None and all(row[column] is not None for column in columns):
+            return {column: row[column] for column in columns}
+        values = compute(path)
+        with self.lock:
+            self._store(path, stat, {column: value for column, value in values.items() if column in IMAGE_COLUMNS})
+        return values
+
+    def record(self, path, **values):
+        """Store facts about a file that a module just produced, e.g. the size of an image it resized."""
+        path = os.path.abspath(path)
+        stat = _stat(path)
+        if stat is not None:
+            with self.lock:
+                self._store(path, stat, values)
+
+    def forget(self, path):
+        with self.lock:
+            self.conn.execute('DELETE FROM images WHERE path = ?', (os.path.abspath(path),))
+            self._written()
+
+    def answer(self, path, question):
+        """A BLIP answer recorded for this unchanged file, or None."""
+        path = os.path.abspath(path)
+        stat = _stat(path)
+        with self.lock:
+            row = self.conn.execute('SELECT answer, size, mtime_ns FROM answers WHERE path = ? AND question = ?',
+                                    (path, question)).fetchone()
+        if row is None or stat is None or (row[1], row[2]) != stat:
+            return None
+        return row[0]
+
+    def record_answer(self, path, question, answer):
+        path = os.path.abspath(path)
+        stat = _stat(path)
+        if stat is None:
+            return
+        with self.lock:
+            self.conn.execute('INSERT OR REPLACE INTO answers VALUES (?, ?, ?, ?, ?)',
+                              (path, question, answer, stat[0], stat[1]))
+            self._written()
+
+    def _scan(self, path, stat, want_hash, want_bw):
+        values = {}
+        with memory_guard.open_image(path) as img:
+            values.update(width=img.size[0], height=img.size[1], format=img.format, mode=img.mode)
+        if want_bw:
+            from dataset_sculptor.move_bw_images import BW_DECODE_SIZE, bw_mse
+
+            # Same decode and score as BWImageMenu with its default settings, so it can be reused as is
+            with memory_guard.decoded(path, (BW_DECODE_SIZE, BW_DECODE_SIZE)) as img:
+                values['bw_score'] = bw_mse(img)
+        if want_hash:
+            values['content_hash'] = content_hash(path)
+        return values
+
+    def refresh(self, input_dir, recursive=True, want_hash=False, want_bw=False, workers=REFRESH_WORKERS,
+                want_thumbnails=False):
+        """Bring the catalog up to date with input_dir. Only new and changed files are opened."""
+        from dataset_sculptor import progress
+        from dataset_sculptor import thumbnails
+
+        thumbnail_cache = thumbnails.cache_for(os.path.dirname(os.path.abspath(self.db_path))) if want_thumbnails else None
+
+        pattern = '/**/*.*' if recursive else '/*.*'
+        paths = [os.path.abspath(filename) for filename in glob.glob(input_dir.rstrip('/') + pattern, recursive=recursive)
+                 if filename.lower().endswith(CATALOG_EXTENSIONS)]
+        counts = {'unchanged': 0, 'scanned': 0, 'captions': 0, 'removed': 0, 'failed': 0}
+        stale_captions = []
+
+        def scan(path):
+            stat = _stat(path)
+            with self.lock:
+                row = self._fresh_row(path, stat) if stat else None
+            needed = row is None or row['width'] is None or (want_hash and row['content_hash'] is None) \
+                or (want_bw and row['bw_score'] is None)
+            try:
+                values = self._scan(path, stat, want_hash, want_bw) if needed else None
+                if thumbnail_cache:
+                    thumbnail_cache.get(path)
+            except Exception as e:
+                return path, stat, e
+            return path, stat, values
+
+        with progress.Progress("Catalog", total=len(paths)) as bar, ThreadPoolExecutor(max_workers=workers) as pool:
+            for path, stat, values in pool.map(scan, paths):
+                bar.advance()
+                if isinstance(values, Exception):
+                    counts['failed'] += 1
+                    bar.error(f"Unable to catalog {path}: {values}", path)
+                    continue
+                with self.lock:
+                    if values is None:
+                        counts['unchanged'] += 1
+                    else:
+                        counts['scanned'] += 1
+                        self._store(path, stat, values)
+                    caption = self._stale_caption(path)
+                if caption:
+                    stale_captions.append((path,) + caption)
+                    if len(stale_captions) >= CAPTION_BATCH:
+                        counts['captions'] += self._read_captions(stale_captions)
+                        stale_captions = []
+
+            counts['captions'] += self._read_captions(stale_captions)
+
+            # Rows of files that were deleted or moved away
+            prefix = os.path.join(os.path.abspath(input_dir), '')
+            existing = set(paths)
+            with self.lock:
+                for (path,) in self.conn.execute("SELECT path FROM images WHERE path LIKE ? ESCAPE '\\'",
+                                                 (_like_escape(prefix) + '%',)).fetchall():
+                    if path not in existing and (recursive or os.path.dirname(path) == prefix.rstrip(os.sep)):
+                        self.conn.execute('DELETE FROM images WHERE path = ?', (path,))
+                        counts['removed'] += 1
+        self.commit()
+        return counts
+
+    def _stale_caption(self, path):
+        """(caption path, mtime) if the caption of path has to be read again, else None."""
+        caption = _caption_path(path)
+        stat = _stat(caption)
+        row = self.conn.execute('SELECT caption_mtime_ns FROM images WHERE path = ?', (path,)).fetchone()
+        if row is None:
+            return None
+        if stat is None:
+            if row[0] is not None:
+                self.conn.execute('UPDATE images SET caption = NULL, caption_mtime_ns = NULL WHERE path = ?', (path,))
+            return None
+        if row[0] == stat[1]:
+            return None
+        return caption, stat[1]
+
+    def _read_captions(self, stale):
+        """Read the captions of [(path, caption path, mtime)] concurrently. Returns how many were stored."""
+        from dataset_sculptor import caption_io
+
+        texts = caption_io.read_captions([caption for path, caption, mtime_ns in stale])
+        stored = 0
+        with self.lock:
+            for path, caption, mtime_ns in stale:
+                text = texts.get(caption)
+                if isinstance(text, str):
+                    self.conn.execute('UPDATE images SET caption = ?, caption_mtime_ns = ? WHERE path = ?',
+                                      (text, mtime_ns, path))
+                    stored += 1
+        return stored
+
+    def query(self, min_side=None, max_side=None, caption=None, image_format=None, greyscale_cutoff=None,
+              content_hash=None, under=None, sql=None):
+        """Paths matching every given filter. caption is a case-insensitive substring, sql a raw WHERE clause."""
+        clauses, params = [], []
+        if min_side is not None:
+            clauses.append('MIN(width, height) >= ?')
+            params.append(min_side)
+        if max_side is not None:
+            clauses.append('MAX(width, height) <= ?')
+            params.append(max_side)
+        if caption:
+            clauses.append("caption LIKE ? ESCAPE '\\'")
+            params.append('%' + _like_escape(caption) + '%')
+        if image_format:
+            clauses.append('UPPER(format) = UPPER(?)')
+            params.append(image_format)
+        if greyscale_cutoff is not None:
+            clauses.append('bw_score >= 0 AND bw_score <= ?')
+            params.append(greyscale_cutoff)
+        if content_hash:
+            clauses.append('content_hash = ?')
+            params.append(content_hash)
+        if under:
+            clauses.append("path LIKE ? ESCAPE '\\'")
+            params.append(_like_escape(os.path.join(os.path.abspath(under), '')) + '%')
+        if sql:
+            clauses.append(f"({sql})")
+        where = ' WHERE ' + ' AND '.join(clauses) if clauses else ''
+        with self.lock:
+            return [row[0] for row in self.conn.execute(f'SELECT path FROM images{where} ORDER BY path', params)]
+
+    def stats(self):
+        with self.lock:
+            images, captions, hashes, scores = self.conn.execute(
+                'SELECT COUNT(*), COUNT(caption), COUNT(content_hash), COUNT(bw_score) FROM images').fetchone()
+            answers = self.conn.execute('SELECT COUNT(*) FROM answers').fetchone()[0]
+        return {'images': images, 'captions': captions, 'content_hashes': hashes, 'bw_scores': scores,
+                'blip_answers': answers}
+
+
+def image_size(path):
+    """(width, height) of an image, from the catalog when it knows the file."""
+    def compute(path):
+        with memory_guard.open_image(path) as img:
+            return {'width': img.size[0], 'height': img.size[1], 'format': img.format, 'mode': img.mode}
+
+    catalog = current()
+    values = catalog.cached(path, ('width', 'height'), compute) if catalog else compute(path)
+    return values['width'], values['height']
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Dataset Sculptor catalog')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    refresh = subparsers.add_parser('refresh', help='Scan new and changed files into the catalog')
+    refresh.add_argument('--db', type=str, required=True, help='Catalog database file')
+    refresh.add_argument('--input_dir', type=str, required=True, help='Folder to scan')
+    refresh.add_argument('--no_recursive', action='store_true', help='Only scan the top folder')
+    refresh.add_argument('--hash', action='store_true', help='Also store content hashes (reads every file in full)')
+    refresh.add_argument('--bw', action='store_true', help='Also store greyscale scores (decodes every image)')
+    refresh.add_argument('--thumbnails', action='store_true', help='Also fill the thumbnail cache (decodes every image, reduced)')
+    refresh.add_argument('--workers', type=int, default=REFRESH_WORKERS, help='Scanning threads')
+
+    query = subparsers.add_parser('query', help='List catalogued images matching all filters')
+    query.add_argument('--db', type=str, required=True, help='Catalog database file')
+    query.add_argument('--min_side', type=int, default=None, help='Shorter side at least this many pixels')
+    query.add_argument('--max_side', type=int, default=None, help='Longer side at most this many pixels')
+    query.add_argument('--caption', type=str, default=None, help='Caption contains this text (case-insensitive)')
+    query.add_argument('--format', type=str, default=None, help='Image format, e.g. JPEG or PNG')
+    query.add_argument('--greyscale', type=float, default=None, help='Greyscale score at most this MSE cutoff')
+    query.add_argument('--under', type=str, default=None, help='Only images under this folder')
+    query.add_argument('--where', type=str, default=None, help='Extra SQL condition on the images table')
+
+    stats = subparsers.add_parser('stats', help='What the catalog holds')
+    stats.add_argument('--db', type=str, required=True, help='Catalog database file')
+
+    args = parser.parse_args()
+    catalog = Catalog(args.db)
+    try:
+        if args.command == 'refresh':
+            start = time.time()
+            counts = catalog.refresh(args.input_dir, not args.no_recursive, args.hash, args.bw, args.workers,
+                                     args.thumbnails)
+            print(f"Scanned {counts['scanned']}, unchanged {counts['unchanged']}, captions read {counts['captions']}, "
+                  f"removed {counts['removed']} in {time.time() - start:.1f}s")
+            if counts['failed']:
+                print(colored(f"Failed: {counts['failed']}", 'red'))
+        elif args.command == 'query':
+            for path in catalog.query(args.min_side, args.max_side, args.caption, args.format, args.greyscale,
+                                      under=args.under, sql=args.where):
+                print(path)
+        elif args.command == 'stats':
+            for name, value in catalog.stats().items():
+                print(f"{name}: {value}")
+    finally:
+        catalog.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,286 @@
+"""
+Exact duplicate finder.
+
+Files are compared in three stages so most of them are never read in full:
+1. group by file size, a file with a unique size has no duplicate
+2. hash the first and last 64KB of files that share a size
+3. hash the full content of files whose partial hashes still collide
+Hashing runs in a thread pool, file reads release the GIL.
+"""
+import csv
+import glob
+import hashlib
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from termcolor import colored
+
+from dataset_sculptor import file_ops
+from dataset_sculptor import instrumentation
+from dataset_sculptor import progress
+from dataset_sculptor.delete_small_images import SUPPORTED_FORMATS
+
+try:
+    import xxhash
+except ImportError:
+    xxhash = None
+
+EDGE_BYTES = 64 * 1024
+CHUNK_BYTES = 1024 * 1024
+HASH_WORKERS = 16  # I/O bound, more threads than cores keeps network drives and SSD queues busy
+DUPLICATES_DIR = "DS_Duplicates"
+
+ACTIONS = {1: 'Report only', 2: 'Move duplicates to DS_Duplicates', 3: 'Delete duplicates'}
+
+
+def _new_hash():
+    # xxhash is several times faster than any cryptographic hash, blake2b is the fastest in the standard library
+    return xxhash.xxh3_128() if xxhash else hashlib.blake2b(digest_size=16)
+
+
+def partial_hash(path):
+    """Hash of the first and last EDGE_BYTES. For small files this already covers the whole file."""
+    digest = _new_hash()
+    with open(path, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        # Files of different sizes can share both edges, the size keeps them apart
+        digest.update(str(size).encode())
+        head = f.read(EDGE_BYTES)
+        digest.update(head)
+        read = len(head)
+        if size > 2 * EDGE_BYTES:
+            f.seek(-EDGE_BYTES, os.SEEK_END)
+            tail = f.read(EDGE_BYTES)
+        else:
+            tail = f.read()
+        digest.update(tail)
+        read += len(tail)
+    instrumentation.read_bytes(read)
+    return digest.hexdigest(), read
+
+
+def full_hash(path):
+    digest = _new_hash()
+    read = 0
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(CHUNK_BYTES), b''):
+            digest.update(chunk)
+            read += len(chunk)
+    instrumentation.read_bytes(read)
+    return digest.hexdigest(), read
+
+
+class ExactDuplicates:
+
+    def __init__(self, input_dir, output_dir):
+        self.input_dir = input_dir
+        self.output_dir = output_dir
+        self.action = 1
+        self.recursive = False
+        self.bytes_read = 0
+
+    def set_input_dir(self, input_dir):
+        if os.path.isdir(input_dir):
+            self.input_dir = input_dir
+        else:
+            print("Not valid, no changes made")
+
+    def set_output_dir(self, output_dir):
+        if os.path.isdir(output_dir):
+            self.output_dir = output_dir
+        else:
+            print("Not valid, no changes made")
+
+    def display_menu(self):
+        print(colored(f'''
+    Current Input Directory: {self.input_dir}
+    Current Output Directory: {self.output_dir}
+    ┌──────────────────────────────────────────────────────────────────────────────┐
+    |                          EXACT DUPLICATE IMAGES MODULE                       |
+    |------------------------------------------------------------------------------|
+    |                                                                              |
+    |              Settings                                                        |
+    |                                                                              |
+    |          1 - Action ({ACTIONS[self.action]})
+    |          2 - Recursive ({'On' if self.recursive else 'Off'})
+    |                                                                              |
+    └──────────────────────────────────────────────────────────────────────────────┘
+    |      I - Set Input     O - Set Output     R - Run     X - Exit to Menu       |
+    └──────────────────────────────────────────────────────────────────────────────┘
+    ''', 'light_magenta'))
+
+        print("Module finds byte-identical copies of images, whatever their filename")
+        print("One image of each group is kept, preferring one that has a caption")
+        print("Move relocates duplicate image-caption pairs to DS_Duplicates, Delete removes them")
+        print("Delete keeps a duplicate's caption in DS_Duplicates when its text differs from the kept image's caption")
+        print("A report of every group is saved to DS_Duplicates")
+        print("Recursive ON processes subfolders of the input directory\n")
+
+    def list_images(self):
+        pattern = '/**/*.*' if self.recursive else '/*.*'
+        return [filename for filename in glob.glob(self.input_dir.rstrip('/') + pattern, recursive=self.recursive)
+                if filename.lower().endswith(tuple(SUPPORTED_FORMATS))
+                and DUPLICATES_DIR not in os.path.relpath(filename, self.input_dir).split(os.sep)]
+
+    def _refine(self, groups, hash_file, bar, pool):
+        """Split every group by hash_file(path). Groups left with a single file are dropped."""
+        paths = [path for group in groups for path in group]
+
+        def run(path):
+            try:
+                return path, hash_file(path)
+            except OSError as e:
+                return path, e
+
+        by_hash = {}
+        for path, result in pool.map(run, paths):
+            bar.advance()
+            if isinstance(result, Exception):
+                bar.error(f"Unable to read {path}: {result}", path)
+                continue
+            digest, read = result
+            self.bytes_read += read
+            by_hash.setdefault(digest, []).append(path)
+        return [group for group in by_hash.values() if len(group) > 1]
+
+    def find_groups(self, filenames):
+        """Lists of paths with identical content."""
+        sizes = {}
+        with progress.Progress("Exact Duplicates: sizes", total=len(filenames)) as bar:
+            for path in filenames:
+                try:
+                    size = os.path.getsize(path)
+                except OSError as e:
+                    bar.error(f"Unable to read {path}: {e}", path)
+                    continue
+                sizes.setdefault(size, []).append(path)
+                bar.advance()
+        candidates = [group for group in sizes.values() if len(group) > 1]
+        size_of = {path: size for size, group in sizes.items() for path in group}
+
+        with ThreadPoolExecutor(max_workers=HASH_WORKERS) as pool:
+            with progress.Progress("Exact Duplicates: partial hashes", total=sum(len(g) for g in candidates)) as bar:
+                with instrumentation.stage('partial_hash'):
+                    partial = self._refine(candidates, partial_hash, bar, pool)
+            # Files no bigger than both edges were read completely, the partial hash is final
+            final = [group for group in partial if size_of[group[0]] <= 2 * EDGE_BYTES]
+            remaining = [group for group in partial if size_of[group[0]] > 2 * EDGE_BYTES]
+
+            with progress.Progress("Exact Duplicates: full hashes", total=sum(len(g) for g in remaining)) as bar:
+                with instrumentation.stage('full_hash'):
+                    final.extend(self._refine(remaining, full_hash, bar, pool))
+        return final
+
+    def keeper(self, group):
+        # Keep a copy that has a caption, then the shortest path, so copies in nested folders are the ones removed
+        return min(group, key=lambda path: (not os.path.isfile(os.path.splitext(path)[0] + '.txt'), len(path), path))
+
+    @staticmethod
+    def caption_text(path):
+        caption = file_ops.caption_for(path)
+        if not os.path.isfile(caption):
+            return None
+        with open(caption, 'r', encoding='utf-8', errors='replace') as f:
+            return f.read().strip()
+
+    def remove_pair(self, path, kept, group_dir, delete, bar):
+        """Move the duplicate and its caption to group_dir, or delete them. Returns the image's new path."""
+        caption = file_ops.caption_for(path)
+        if caption == file_ops.caption_for(kept):
+            # a.jpg and a.jpeg share a.txt, it is the kept image's caption and stays
+            if delete:
+                with instrumentation.stage('move'):
+                    os.remove(path)
+                bar.file(path, 'deleted', reason='caption shared with the kept copy')
+                return ''
+            file_ops.ensure_dir(group_dir)
+            destination = file_ops.move(path, file_ops.unique_pair_path(os.path.join(group_dir, os.path.basename(path))))
+            bar.file(path, 'moved', destination=destination, reason='caption shared with the kept copy')
+            return destination
+        if not delete:
+            destination = file_ops.pair(path, group_dir, 'move')
+            bar.file(path, 'moved', destination=destination)
+            return destination
+        caption_text = self.caption_text(path)
+        with instrumentation.stage('move'):
+            os.remove(path)
+            bar.file(path, 'deleted')
+        if caption_text is None:
+            return ''
+        if caption_text == self.caption_text(kept):
+            with instrumentation.stage('move'):
+                os.remove(caption)
+        else:
+            # The pixels are the same but the caption isn't, it is kept for review instead of lost
+            file_ops.ensure_dir(group_dir)
+            destination = file_ops.move(caption, file_ops.unique_path(os.path.join(group_dir, os.path.basename(caption))))
+            bar.file(caption, 'moved', destination=destination, reason='caption differs from the kept copy')
+        return ''
+
+    def find_duplicates(self):
+        filenames = self.list_images()
+        self.bytes_read = 0
+        groups = self.find_groups(filenames)
+        total_bytes = sum(os.path.getsize(path) for path in filenames if os.path.isfile(path))
+
+        report_dir = os.path.join(self.output_dir, DUPLICATES_DIR)
+        os.makedirs(report_dir, exist_ok=True)
+        report_path = os.path.join(report_dir, "exact_duplicates.csv")
+        duplicates = 0
+        with progress.Progress("Exact Duplicates: actions", total=sum(len(g) for g in groups)) as bar, \
+                open(report_path, 'w', newline='', encoding='utf-8') as f:
+            writer = csv.writer(f)
+            writer.writerow(['group', 'role', 'path', 'bytes', 'new_path'])
+            for number, group in enumerate(groups, 1):
+                kept = self.keeper(group)
+                for path in [kept] + sorted(path for path in group if path != kept):
+                    role = 'kept' if path == kept else 'duplicate'
+                    size = os.path.getsize(path)
+                    new_path = path
+                    if role == 'duplicate' and self.action in (2, 3):
+                        new_path = self.remove_pair(path, kept, os.path.join(report_dir, f"exact_{number:05d}"),
+                                                    self.action == 3, bar)
+                    duplicates += role == 'duplicate'
+                    writer.writerow([number, role, path, size, new_path])
+                    bar.advance()
+
+        print(f"Total images checked: {len(filenames)}")
+        print(f"Total duplicate groups: {len(groups)}")
+        print(f"Total duplicates: {duplicates}")
+        if total_bytes:
+            print(f"Read {self.bytes_read / (1024 * 1024):.1f} MB of {total_bytes / (1024 * 1024):.1f} MB "
+                  f"({100.0 * self.bytes_read / total_bytes:.1f}%)")
+        print(f"Report saved to: {report_path}")
+        return groups
+
+    def run(self):
+        while True:
+            self.display_menu()
+            choice = input("Enter your selection: ")
+
+            if choice == '1':
+                action = input("Report only [1], Move duplicates [2] or Delete duplicates [3]: ").strip()
+                if action.isdigit() and int(action) in ACTIONS:
+                    self.action = int(action)
+                else:
+                    print("Invalid option, no changes made.")
+            elif choice == '2':
+                user_input = input("Process folders recursively? (Y/N)").lower()
+                self.recursive = user_input in ['y', 'yes']
+            elif choice.lower() == 'i':
+                new_input_dir = input("Change Input Directory: ")
+                self.set_input_dir(new_input_dir)
+            elif choice.lower() == 'o':
+                new_output_dir = input("Change Output Directory: ")
+                self.set_output_dir(new_output_dir)
+            elif choice.lower() == 'r':
+                if self.action == 1:
+                    self.find_duplicates()
+                    continue
+                confirm = input("WARNING: Module will move or delete duplicate images and their captions\nDataset Sculptor is experimental and only intended for backed up datasets\nUse only on backed up datasets and at your own risk\nRun the module? (Y/N) ")
+                if confirm.lower() in ['y', 'yes']:
+                    self.find_duplicates()
+            elif choice.lower() == 'x':
+                break
+            else:
+                print("Invalid choice. Please choose a valid option or press 'x' to exit.")
@@ -0,0 +1,258 @@
+"""
+Shared file moves and copies.
+
+Modules used to call shutil.move / shutil.copy and os.makedirs for every file, which
+copies every byte even when the output folder is on the same volume. Here:
+
+- moves on the same device are a single os.rename
+- copies on the same device follow the copy mode: 'reflink' (default) clones the file
+  (FICLONE, or an in-kernel copy_file_range) and falls back to a normal copy where the
+  filesystem can't, 'hardlink' links the file, 'copy' always copies the data
+- captions are always real copies, modules append to copied captions in place
+- directories that were already created are remembered
+- moves across devices and data copies run on a thread pool when they go through Transfers
+
+    with file_ops.Transfers() as transfers:
+        for path in paths:
+            transfers.pair(path, destination_dir, 'copy', done=on_done)
+"""
+import collections
+import errno
+import os
+import shutil
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from dataset_sculptor import instrumentation
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+COPY_MODES = ('reflink', 'hardlink', 'copy')
+WORKERS = 8  # parallel cross-device transfers, they are bound by the disks rather than the CPU
+FICLONE = 0x40049409  # linux/fs.h _IOW(0x94, 9, int)
+
+_settings = {'copy_mode': 'reflink', 'workers': WORKERS}
+_made_dirs = set()
+_devices = {}
+_lock = threading.Lock()
+
+
+def configure(copy_mode=None, workers=None):
+    if copy_mode:
+        if copy_mode not in COPY_MODES:
+            raise ValueError(f"Unknown copy mode {copy_mode}, expected one of {', '.join(COPY_MODES)}")
+        _settings['copy_mode'] = copy_mode
+    if workers:
+        _settings['workers'] = workers
+
+
+def ensure_dir(path):
+    """os.makedirs(path, exist_ok=True), once per directory per run."""
+    if path in _made_dirs:
+        return
+    os.makedirs(path, exist_ok=True)
+    with _lock:
+        _made_dirs.add(path)
+
+
+def forget_dirs(root):
+    """Forget the directories created under root, after root was removed."""
+    prefix = os.path.join(root, '')
+    with _lock:
+        _made_dirs.difference_update([path for path in _made_dirs if path == root or path.startswith(prefix)])
+
+
+def _device(directory):
+    device = _devices.get(directory)
+    if device is None:
+        device = os.stat(directory).st_dev
+        with _lock:
+            _devices[directory] = device
+    return device
+
+
+def same_device(src, dst):
+    """Whether src and the folder dst goes into are on the same filesystem."""
+    try:
+        return _device(os.path.dirname(os.path.abspath(src))) == _device(os.path.dirname(os.path.abspath(dst)))
+    except OSError:
+        return False
+
+
+def unique_path(path, taken=()):
+    """path, or path with _1, _2, ... before the extension if that name exists or is in taken."""
+    base, extension = os.path.splitext(path)
+    counter = 1
+    while os.path.exists(path) or path in taken:
+        path = f"{base}_{counter}{extension}"
+        counter += 1
+    return path
+
+
+def caption_for(path):
+    return os.path.splitext(path)[0] + '.txt'
+
+
+def unique_pair_path(path, taken=()):
+    """unique_path for an image and its caption together, neither name may exist or be in taken."""
+    base, extension = os.path.splitext(path)
+    counter = 1
+    while any(os.path.exists(name) or name in taken for name in (path, caption_for(path))):
+        path = f"{base}_{counter}{extension}"
+        counter += 1
+    return path
+
+
+def _clone(src, dst):
+    """Copy src to dst without reading it through Python. False if the filesystem supports neither way."""
+    if not sys.platform.startswith('linux'):
+        return False
+    with open(src, 'rb') as fsrc, open(dst, 'wb') as fdst:
+        try:
+            # Shares the data blocks, copy-on-write (Btrfs, XFS, bcachefs, ...)
+            fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+            instrumentation.count('reflinked')
+        except OSError:
+            try:
+                # Copied in the kernel, also server side on NFS 4.2 and SMB3
+                remaining = os.fstat(fsrc.fileno()).st_size
+                while remaining > 0:
+                    copied = os.copy_file_range(fsrc.fileno(), fdst.fileno(), remaining)
+                    if copied == 0:
+                        break
+                    remaining -= copied
+                instrumentation.count('kernel_copied')
+            except (OSError, AttributeError):
+                fdst.close()
+                os.remove(dst)
+                return False
+    shutil.copystat(src, dst)
+    return True
+
+
+def fast_path(src, dst, action):
+    """Whether src goes to dst as a rename or a link, too quick to be worth a worker thread."""
+    return (action == 'move' or _settings['copy_mode'] == 'hardlink') and same_device(src, dst)
+
+
+def move(src, dst):
+    """Move src to dst, a rename when both are on the same filesystem."""
+    with instrumentation.stage('move'):
+        try:
+            os.rename(src, dst)
+            instrumentation.count('renamed')
+        except OSError as e:
+            if e.errno != errno.EXDEV:
+                raise
+            shutil.move(src, dst)
+            instrumentation.count('copied')
+    return dst
+
+
+def copy(src, dst, mode=None):
+    """Copy src to dst with the configured copy mode, falling back to a normal copy where it can't be used."""
+    mode = mode or _settings['copy_mode']
+    with instrumentation.stage('move'):
+        # Captions are appended to in place after a copy, a hardlink would change the original too
+        if mode != 'copy' and not src.lower().endswith('.txt') and same_device(src, dst):
+            if mode == 'hardlink':
+                try:
+                    os.link(src, dst)
+                    instrumentation.count('hardlinked')
+                    return dst
+                except OSError:
+                    pass
+            elif fcntl and _clone(src, dst):
+                return dst
+        shutil.copy2(src, dst)
+        instrumentation.count('copied')
+    return dst
+
+
+def transfer(src, dst, action):
+    """move(src, dst) when action is 'move', copy(src, dst) otherwise."""
+    return move(src, dst) if action == 'move' else copy(src, dst)
+
+
+def pair(path, destination_dir, action='move', taken=()):
+    """
+    Move or copy an image and its caption into destination_dir under a free name, the
+    caption following the name the image got. Returns the image's new path.
+    """
+    ensure_dir(destination_dir)
+    destination = unique_pair_path(os.path.join(destination_dir, os.path.basename(path)), taken)
+    transfer(path, destination, action)
+    if caption_for(path) != path and os.path.isfile(caption_for(path)):
+        transfer(caption_for(path), caption_for(destination), action)
+    return destination
+
+
+class Transfers:
+    """
+    Runs pairs of transfers, the ones that need a full data copy on a thread pool. done
+    callbacks run on the thread that calls pair() or close(), in submission order, so
+    they can update progress bars directly: done(path, destination, error).
+    """
+
+    def __init__(self, workers=None):
+        self.workers = workers or _settings['workers']
+        self.executor = None
+        self.pending = collections.deque()
+        self.taken = set()  # images and captions of transfers still running, not to be handed out again
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def pair(self, path, destination_dir, action='move', done=None):
+        """Move or copy an image and its caption into destination_dir, see pair()."""
+        ensure_dir(destination_dir)
+        if fast_path(path, os.path.join(destination_dir, os.path.basename(path)), action):
+            self._finish(path, lambda: pair(path, destination_dir, action, self.taken), done)
+            return
+        destination = unique_pair_path(os.path.join(destination_dir, os.path.basename(path)), self.taken)
+        self.taken.update((destination, caption_for(destination)))
+        if self.executor is None:
+            self.executor = ThreadPoolExecutor(max_workers=self.workers)
+        future = self.executor.submit(self._transfer_pair, path, destination, action)
+        self.pending.append((path, destination, future, done))
+        # Bounded, a million queued copies would hold a million futures
+        while len(self.pending) > self.workers * 4:
+            self._collect(self.pending.popleft())
+        while self.pending and self.pending[0][2].done():
+            self._collect(self.pending.popleft())
+
+    @staticmethod
+    def _transfer_pair(path, destination, action):
+        transfer(path, destination, action)
+        if caption_for(path) != path and os.path.isfile(caption_for(path)):
+            transfer(caption_for(path), caption_for(destination), action)
+        return destination
+
+    def _finish(self, path, run, done):
+        try:
+            destination, error = run(), None
+        except OSError as e:
+            destination, error = None, e
+        if done:
+            done(path, destination, error)
+        elif error:
+            raise error
+
+    def _collect(self, entry):
+        path, destination, future, done = entry
+        self._finish(path, future.result, done)
+        self.taken.difference_update((destination, caption_for(destination)))
+
+    def close(self):
+        while self.pending:
+            self._collect(self.pending.popleft())
+        if self.executor:
+            self.executor.shutdown()
+            self.executor = None
@@ -0,0 +1,313 @@
+"""
+Per-stage instrumentation shared by all modules.
+
+Modules wrap their work in named stages (open, decode, process, encode, write,
+move, infer, exiftool) and report the bytes they read and write. While enabled,
+every stage keeps a call count and a latency histogram, and a background thread
+samples resident memory. At the end of the run a summary table is printed and
+the numbers can be written to JSON, optionally next to a cProfile dump.
+
+Instrumentation is off unless enabled, e.g. with
+
+    python dataset_sculptor.py --profile --profile-json run.json --cprofile run.prof
+
+and the disabled path costs one attribute check per call.
+"""
+import atexit
+import contextlib
+import io
+import json
+import os
+import sys
+import threading
+import time
+
+# Latency histogram buckets: upper bounds in seconds, doubling from 50us to ~100s
+BUCKETS = tuple(0.00005 * 2 ** i for i in range(22))
+MEMORY_SAMPLE_INTERVAL = 0.2
+
+
+def current_rss_mb():
+    """Resident memory of this process right now in MB, or None where it can't be measured."""
+    if os.path.isfile('/proc/self/statm'):
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / (1024 * 1024)
+    try:
+        import psutil
+    except ImportError:
+        return None
+    return psutil.Process().memory_info().rss / (1024 * 1024)
+
+
+def peak_rss_mb():
+    """Peak resident memory of this process in MB, or None where it can't be measured."""
+    # On Linux ru_maxrss survives exec, so a spawned child would report its parent's peak. VmHWM does not.
+    if os.path.isfile('/proc/self/status'):
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024
+    try:
+        import resource
+    except ImportError:
+        resource = None
+    if resource:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # Kilobytes on Linux, bytes on macOS
+        return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+    try:
+        import psutil
+    except ImportError:
+        return None
+    memory = psutil.Process().memory_info()
+    return getattr(memory, 'peak_wset', memory.rss) / (1024 * 1024)
+
+
+class StageStats:
+
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.histogram = [0] * (len(BUCKETS) + 1)
+
+    def add(self, seconds, error=False):
+        self.calls += 1
+        self.errors += error
+        self.total += seconds
+        self.max = max(self.max, seconds)
+        for i, bound in enumerate(BUCKETS):
+            if seconds <= bound:
+                self.histogram[i] += 1
+                break
+        else:
+            self.histogram[-1] += 1
+
+    def percentile(self, fraction):
+        """Upper bound of the bucket holding the given fraction of calls."""
+        wanted = fraction * self.calls
+        seen = 0
+        for i, count in enumerate(self.histogram):
+            seen += count
+            if count and seen >= wanted:
+                return min(BUCKETS[i], self.max) if i < len(BUCKETS) else self.max
+        return 0.0
+
+    def as_dict(self):
+        return {
+            'calls': self.calls,
+            'errors': self.errors,
+            'total_seconds': self.total,
+            'mean_seconds': self.total / self.calls if self.calls else 0.0,
+            'p50_seconds': self.percentile(0.5),
+            'p95_seconds': self.percentile(0.95),
+            'max_seconds': self.max,
+            'histogram': {f"<={bound:g}s": count for bound, count in zip(BUCKETS, self.histogram) if count},
+            'histogram_overflow': self.histogram[-1],
+        }
+
+
+class Instrumentation:
+
+    def __init__(self):
+        self.enabled = False
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.stages = {}
+        self.counters = {}
+        self.bytes_read = 0
+        self.bytes_written = 0
+        self.sampled_peak_mb = None
+        self.sampled_peak_stage = None
+        self.started = time.perf_counter()
+        self.active = {}  # thread id -> innermost stage name, for attributing memory samples
+
+    def enable(self, sample_memory=True):
+        if self.enabled:
+            return
+        self.reset()
+        self.enabled = True
+        if sample_memory:
+            threading.Thread(target=self._sample_memory, daemon=True).start()
+
+    def disable(self):
+        self.enabled = False
+
+    def _sample_memory(self):
+        while self.enabled:
+            rss = current_rss_mb()
+            if rss is None:
+                return
+            if self.sampled_peak_mb is None or rss > self.sampled_peak_mb:
+                self.sampled_peak_mb = rss
+                self.sampled_peak_stage = next(iter(self.active.values()), None)
+            time.sleep(MEMORY_SAMPLE_INTERVAL)
+
+    @contextlib.contextmanager
+    def _timed(self, name):
+        thread_id = threading.get_ident()
+        outer = self.active.get(thread_id)
+        self.active[thread_id] = name
+        start = time.perf_counter()
+        error = False
+        try:
+            yield
+        except BaseException:
+            error = True
+            raise
+        finally:
+            elapsed = time.perf_counter() - start
+            if outer is None:
+                self.active.pop(thread_id, None)
+            else:
+                self.active[thread_id] = outer
+            with self.lock:
+                self.stages.setdefault(name, StageStats()).add(elapsed, error)
+
+    def stage(self, name):
+        """Context manager timing one call of a stage."""
+        if not self.enabled:
+            return contextlib.nullcontext()
+        return self._timed(name)
+
+    def count(self, name, amount=1):
+        if self.enabled:
+            with self.lock:
+                self.counters[name] = self.counters.get(name, 0) + amount
+
+    def read_bytes(self, amount):
+        if self.enabled:
+            with self.lock:
+                self.bytes_read += amount
+
+    def wrote_bytes(self, amount):
+        if self.enabled:
+            with self.lock:
+                self.bytes_written += amount
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                'wall_seconds': time.perf_counter() - self.started,
+                'stages': {name: stats.as_dict() for name, stats in self.stages.items()},
+                'counters': dict(self.counters),
+                'bytes_read': self.bytes_read,
+                'bytes_written': self.bytes_written,
+                'peak_rss_mb': peak_rss_mb(),
+                'sampled_peak_rss_mb': self.sampled_peak_mb,
+                'sampled_peak_stage': self.sampled_peak_stage,
+            }
+
+    def print_summary(self):
+        report = self.snapshot()
+        print(f"\n{'Stage':<12}{'Calls':>9}{'Errors':>8}{'Total s':>11}{'Mean ms':>10}{'p50 ms':>10}{'p95 ms':>10}{'Max ms':>10}")
+        for name, stats in sorted(report['stages'].items(), key=lambda item: -item[1]['total_seconds']):
+            print(f"{name:<12}{stats['calls']:>9}{stats['errors']:>8}{stats['total_seconds']:>11.2f}"
+                  f"{stats['mean_seconds'] * 1000:>10.1f}{stats['p50_seconds'] * 1000:>10.1f}"
+                  f"{stats['p95_seconds'] * 1000:>10.1f}{stats['max_seconds'] * 1000:>10.1f}")
+        for name, value in sorted(report['counters'].items()):
+            print(f"{name}: {value}")
+        print(f"Read {report['bytes_read'] / (1024 * 1024):.1f} MB, wrote {report['bytes_written'] / (1024 * 1024):.1f} MB "
+              f"in {report['wall_seconds']:.1f}s")
+        if report['peak_rss_mb']:
+            during = f" (sampled during {report['sampled_peak_stage']})" if report['sampled_peak_stage'] else ""
+            print(f"Peak memory: {report['peak_rss_mb']:.0f} MB{during}")
+
+    def write_json(self, path):
+        with open(path, 'w') as f:
+            json.dump(self.snapshot(), f, indent=2)
+        print(f"Profile written to {path}")
+
+
+metrics = Instrumentation()
+
+stage = metrics.stage
+count = metrics.count
+read_bytes = metrics.read_bytes
+wrote_bytes = metrics.wrote_bytes
+
+
+def open_image(path):
+    """Image.open as an 'open' stage. Only the header is read, call decode() before touching pixels."""
+    from PIL import Image
+
+    with metrics.stage('open'):
+        img = Image.open(path)
+    if metrics.enabled:
+        metrics.read_bytes(os.path.getsize(path))
+    return img
+
+
+def open_image_bytes(data):
+    """open_image() for an image held in memory, e.g. read from an archive."""
+    from PIL import Image
+
+    with metrics.stage('open'):
+        img = Image.open(io.BytesIO(data))
+    metrics.read_bytes(len(data))
+    return img
+
+
+def decode(img):
+    with metrics.stage('decode'):
+        img.load()
+    return img
+
+
+def encode_image(img, extension, **params):
+    """img encoded in the format of extension, as an 'encode' stage. Returns the bytes."""
+    from PIL import Image
+
+    Image.init()
+    buffer = io.BytesIO()
+    with metrics.stage('encode'):
+        img.save(buffer, format=Image.registered_extensions().get(extension.lower()), **params)
+    return buffer.getvalue()
+
+
+def save_image(img, path, **params):
+    """img.save(path) split into an 'encode' and a 'write' stage while instrumentation is on."""
+    if not metrics.enabled:
+        img.save(path, **params)
+        return
+    from PIL import Image
+
+    Image.init()
+    image_format = Image.registered_extensions().get(os.path.splitext(path)[1].lower())
+    buffer = io.BytesIO()
+    with metrics.stage('encode'):
+        img.save(buffer, format=image_format, **params)
+    with metrics.stage('write'):
+        with open(path, 'wb') as f:
+            f.write(buffer.getbuffer())
+    metrics.wrote_bytes(buffer.tell())
+
+
+def start(summary=True, json_path=None, cprofile_path=None):
+    """Enable instrumentation for the rest of the process and report when it exits."""
+    metrics.enable()
+    profiler = None
+    if cprofile_path:
+        import cProfile
+
+        profiler = cProfile.Profile()
+        profiler.enable()
+
+    def report():
+        metrics.disable()
+        if profiler:
+            import pstats
+
+            profiler.disable()
+            profiler.dump_stats(cprofile_path)
+            print(f"cProfile written to {cprofile_path}")
+            pstats.Stats(profiler).sort_stats('cumulative').print_stats(20)
+        if summary:
+            metrics.print_summary()
+        if json_path:
+            metrics.write_json(json_path)
+
+    atexit.register(report)
@@ -0,0 +1,281 @@
+"""
+Corrupt and truncated image scanner.
+
+A broken file otherwise shows up halfway through a run, often after a BLIP model
+took minutes to load. The scan reads only the first and last bytes of each file:
+the format's signature, and its end marker (JPEG end of image, PNG IEND chunk, GIF
+trailer) or the length the header promises (WebP, BMP). Only files that fail that
+check, or formats without one (TIFF, ICO, PCX, PPM), are decoded in full, so a
+healthy dataset is scanned at the speed of reading two small blocks per file.
+Files run on a thread pool. Files that don't decode are moved to DS_Quarantine with
+their captions, and every problem goes to DS_Quarantine/integrity_scan.csv. Images
+too large to decode in full within the memory limits are reported but not moved,
+they aren't known to be corrupt and modules may still decode them reduced.
+
+The BLIP modules run quarantine_corrupt() on their file list before loading the model.
+
+    python -m dataset_sculptor.integrity_scan --input_dir /data/in --recursive --quarantine
+"""
+import argparse
+import csv
+import glob
+import os
+import struct
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from termcolor import colored
+
+from dataset_sculptor import instrumentation
+from dataset_sculptor import memory_guard
+from dataset_sculptor import progress
+from dataset_sculptor.delete_small_images import SUPPORTED_FORMATS
+
+REPORT_FILE = "integrity_scan.csv"
+HEAD_BYTES = 32
+TAIL_BYTES = 1024  # end markers are looked for this far from the end, some writers pad after them
+SCAN_WORKERS = 16
+SCAN_BATCH = 1024
+SCAN_EXTENSIONS = tuple(SUPPORTED_FORMATS) + ('.tif', '.tga')
+
+JPEG_SIGNATURE = b'\xff\xd8\xff'
+JPEG_END = b'\xff\xd9'
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+PNG_END = b'IEND\xaeB`\x82'
+
+
+def quick_check(path):
+    """None if the file's signature and end marker look complete, else why it has to be decoded to know."""
+    with instrumentation.stage('open'):
+        with open(path, 'rb') as f:
+            head = f.read(HEAD_BYTES)
+            size = f.seek(0, os.SEEK_END)
+            f.seek(max(0, size - TAIL_BYTES))
+            tail = f.read()
+    instrumentation.read_bytes(len(head) + len(tail))
+    if not head:
+        return "empty file"
+    if head.startswith(JPEG_SIGNATURE):
+        # Entropy-coded data escapes 0xFF, so FF D9 in the tail can only be the marker
+        return None if JPEG_END in tail else "JPEG end of image marker missing"
+    if head.startswith(PNG_SIGNATURE):
+        return None if PNG_END in tail else "PNG IEND chunk missing"
+    if head[:6] in (b'GIF87a', b'GIF89a'):
+        return None if tail.rstrip(b'\x00').endswith(b';') else "GIF trailer missing"
+    if head[:4] == b'RIFF' and head[8:12] == b'WEBP':
+        expected = struct.unpack('<I', head[4:8])[0] + 8
+        return None if size >= expected else f"WebP truncated ({size} of {expected} bytes)"
+    if head[:2] == b'BM' and len(head) >= 6:
+        expected = struct.unpack('<I', head[2:6])[0]
+        return None if size >= expected else f"BMP truncated ({size} of {expected} bytes)"
+    return "no end marker to check"
+
+
+def full_decode(path):
+    """
+    None if every pixel of the image decodes, else the decode error. Refusals by the
+    memory limits, memory_guard.UNMANAGEABLE, are raised, they say nothing about the file.
+    """
+    try:
+        with memory_guard.decoded(path):
+            pass
+    except (OSError, SyntaxError, ValueError) as e:
+        return str(e) or type(e).__name__
+    return None
+
+
+def check(path, deep=False):
+    """
+    (problem or None, whether the file is corrupt, whether it was decoded in full).
+    A problem that isn't corrupt is an image too large to decode. deep decodes every file.
+    """
+    try:
+        suspicion = quick_check(path)
+    except OSError as e:
+        return str(e), True, False
+    if suspicion is None and not deep:
+        return None, False, False
+    try:
+        problem = full_decode(path)
+    except memory_guard.UNMANAGEABLE as e:
+        return f"too large to decode in full: {str(e) or type(e).__name__}", False, True
+    return problem, problem is not None, True
+
+
+def scan(paths, deep=False, workers=SCAN_WORKERS):
+    """Yield (path, problem or None, corrupt, decoded in full) for every path, in order."""
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for start in range(0, len(paths), SCAN_BATCH):
+            batch = paths[start:start + SCAN_BATCH]
+            for path, (problem, corrupt, decoded) in zip(batch, pool.map(lambda path: check(path, deep), batch)):
+                yield path, problem, corrupt, decoded
+
+
+def quarantine_corrupt(paths, output_dir, deep=False):
+    """
+    Move the images among paths that don't decode to DS_Quarantine with their captions.
+    Returns the paths that are left, for a module to run on.
+    """
+    healthy = []
+    quarantined = 0
+    with progress.Progress("Integrity Scan", total=len(paths), log_name='integrity_scan') as bar:
+        for path, problem, corrupt, decoded in scan(paths, deep):
+            bar.advance()
+            if not corrupt:
+                if problem:
+                    # Left to the module, which may decode it reduced or quarantine it itself
+                    bar.error(f"Image {path} {problem}", path)
+                healthy.append(path)
+                continue
+            quarantined += 1
+            try:
+                memory_guard.quarantine(path, output_dir, problem)
+            except OSError as e:
+                bar.error(f"Unable to quarantine {path}: {e}", path)
+    if quarantined:
+        print(colored(f"{quarantined} corrupt images moved to {memory_guard.QUARANTINE_DIR} before the run", 'yellow'))
+    return healthy
+
+
+class IntegrityScan:
+
+    def __init__(self, input_dir, output_dir):
+        self.input_dir = input_dir
+        self.output_dir = output_dir
+        self.deep = False
+        self.quarantine = True
+        self.recursive = False
+
+    def set_input_dir(self, input_dir):
+        if os.path.isdir(input_dir):
+            self.input_dir = input_dir
+        else:
+            print("Not valid, no changes made")
+
+    def set_output_dir(self, output_dir):
+        if os.path.isdir(output_dir):
+            self.output_dir = output_dir
+        else:
+            print("Not valid, no changes made")
+
+    def display_menu(self):
+        print(colored(f'''
+    Current Input Directory: {self.input_dir}
+    Current Output Directory: {self.output_dir}
+    ┌──────────────────────────────────────────────────────────────────────────────┐
+    |                          IMAGE INTEGRITY SCAN MODULE                         |
+    |------------------------------------------------------------------------------|
+    |                                                                              |
+    |              Settings                                                        |
+    |                                                                              |
+    |          1 - Decode Every Image ({'ON' if self.deep else 'OFF, only suspicious ones'})
+    |          2 - Quarantine Corrupt Images ({'ON' if self.quarantine else 'OFF, report only'})
+    |          3 - Recursive ({'ON' if self.recursive else 'OFF'})
+    |                                                                              |
+    └──────────────────────────────────────────────────────────────────────────────┘
+    |      I - Set Input     O - Set Output     R - Run     X - Exit to Menu       |
+    └──────────────────────────────────────────────────────────────────────────────┘
+    ''', 'light_yellow'))
+
+        print("Module finds empty, truncated and corrupt images before they fail a run")
+        print("Signatures and end markers are checked first, only files failing that check are decoded in full")
+        print("Decode Every Image ON also catches damage in the middle of a file, at the cost of full decodes")
+        print(f"Quarantine moves corrupt images and their captions to {memory_guard.QUARANTINE_DIR} in the Output Folder")
+        print(f"A report of every problem is saved to {memory_guard.QUARANTINE_DIR}/{REPORT_FILE}")
+        print("Recursive ON processes subfolders of the input directory\n")
+
+    def list_images(self):
+        pattern = '/**/*.*' if self.recursive else '/*.*'
+        return [filename for filename in glob.glob(self.input_dir.rstrip('/') + pattern, recursive=self.recursive)
+                if filename.lower().endswith(SCAN_EXTENSIONS)
+                and memory_guard.QUARANTINE_DIR not in os.path.relpath(filename, self.input_dir).split(os.sep)]
+
+    def scan_images(self):
+        filenames = self.list_images()
+        report_dir = os.path.join(self.output_dir, memory_guard.QUARANTINE_DIR)
+        os.makedirs(report_dir, exist_ok=True)
+        report_path = os.path.join(report_dir, REPORT_FILE)
+        corrupt_count = 0
+        too_large = 0
+        decoded_count = 0
+        start = time.time()
+
+        with progress.Progress("Integrity Scan", total=len(filenames), log_name='integrity_scan') as bar, \
+                open(report_path, 'w', newline='', encoding='utf-8') as report:
+            writer = csv.writer(report)
+            writer.writerow(['path', 'problem', 'destination'])
+            for path, problem, corrupt, decoded in scan(filenames, self.deep):
+                bar.advance()
+                decoded_count += decoded
+                if problem is None:
+                    continue
+                if not corrupt:
+                    too_large += 1
+                    bar.error(f"Image {path} {problem}", path)
+                    writer.writerow([path, problem, ''])
+                    continue
+                corrupt_count += 1
+                destination = ''
+                if self.quarantine:
+                    try:
+                        destination = memory_guard.quarantine(path, self.output_dir, problem)
+                    except OSError as e:
+                        bar.error(f"Unable to quarantine {path}: {e}", path)
+                else:
+                    bar.error(f"Corrupt image {path}: {problem}", path)
+                writer.writerow([path, problem, destination])
+
+        print(f"Total images checked: {len(filenames)} in {time.time() - start:.1f}s, {decoded_count} decoded in full")
+        print(f"Total corrupt images: {corrupt_count}" + (f", moved to {report_dir}" if corrupt_count and self.quarantine else ''))
+        if too_large:
+            print(f"Images too large to decode in full within the memory limits: {too_large}, left in place")
+        print(f"Report saved to: {report_path}")
+        return corrupt_count
+
+    def run(self):
+        while True:
+            self.display_menu()
+            choice = input("Enter your selection: ")
+
+            if choice == '1':
+                self.deep = input("Decode every image in full? (Y/N)").lower() in ['y', 'yes']
+            elif choice == '2':
+                self.quarantine = input(f"Move corrupt images to {memory_guard.QUARANTINE_DIR}? (Y/N)").lower() in ['y', 'yes']
+            elif choice == '3':
+                user_input = input("Process folders recursively? (Y/N)").lower()
+                self.recursive = user_input in ['y', 'yes']
+            elif choice.lower() == 'i':
+                new_input_dir = input("Change Input Directory: ")
+                self.set_input_dir(new_input_dir)
+            elif choice.lower() == 'o':
+                new_output_dir = input("Change Output Directory: ")
+                self.set_output_dir(new_output_dir)
+            elif choice.lower() == 'r':
+                self.scan_images()
+            elif choice.lower() == 'x':
+                break
+            else:
+                print("Invalid choice. Please choose a valid option or press 'x' to exit.")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Dataset Sculptor image integrity scan')
+    parser.add_argument('--input_dir', type=str, required=True, help='Folder with the images')
+    parser.add_argument('--output_dir', type=str, default=None, help=f'Report and quarantined images go to {memory_guard.QUARANTINE_DIR} in this folder (default: the input directory)')
+    parser.add_argument('--deep', action='store_true', help='Decode every image in full, not only suspicious ones')
+    parser.add_argument('--quarantine', action='store_true', help=f'Move corrupt images and their captions to {memory_guard.QUARANTINE_DIR}')
+    parser.add_argument('--recursive', action='store_true', help='Include subfolders')
+    parser.add_argument('--quiet', action='store_true', help='No progress line, only summaries and errors')
+    parser.add_argument('--log_dir', type=str, default=None, help='Per-file log folder')
+    args = parser.parse_args()
+
+    scanner = IntegrityScan(args.input_dir, args.output_dir or args.input_dir)
+    scanner.deep = args.deep
+    scanner.quarantine = args.quarantine
+    scanner.recursive = args.recursive
+    progress.configure(quiet=args.quiet, log_dir=args.log_dir)
+    scanner.scan_images()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,406 @@
+"""
+Shared job queue for spreading one module's work over several processes or machines.
+
+The image list of a run is stored in a SQLite database. Workers claim batches of
+files under a lease, keep the lease alive with heartbeats while they work and
+mark each file done or failed. A worker that dies stops heartbeating, its lease
+runs out and its files go back to the queue, so no file is lost and no two live
+workers ever hold the same file.
+
+Workers on several machines can share one queue when the database sits on a shared
+filesystem with working file locks. Paths are stored relative to the input directory,
+so each machine can pass its own mount point with --root.
+
+    python -m dataset_sculptor.job_queue create --db jobs.sqlite --module resize --input_dir /data/in --output_dir /data/out --set max_image_length=1024
+    python -m dataset_sculptor.job_queue work --db jobs.sqlite --workers 8
+    python -m dataset_sculptor.job_queue status --db jobs.sqlite
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import socket
+import sqlite3
+import threading
+import time
+
+from termcolor import colored
+
+DEFAULT_QUEUE = "default"
+DEFAULT_BATCH_SIZE = 32
+DEFAULT_LEASE_SECONDS = 120
+MAX_ATTEMPTS = 3
+POLL_SECONDS = 5
+
+BLIP_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.webp', '.tif', '.tga', '.tiff', '.bmp', '.gif')
+
+
+def _resize_handler(input_dir, output_dir, options):
+    from dataset_sculptor.reduce_img import ReduceImage
+
+    resizer = ReduceImage()
+    resizer.input_dir = input_dir
+    resizer.output_dir = output_dir
+    resizer.max_image_length = int(options.get('max_image_length', resizer.max_image_length))
+    resizer.preserve_originals = bool(options.get('preserve_originals', resizer.preserve_originals))
+    return resizer.resize_image, None
+
+
+def _bw_handler(input_dir, output_dir, options):
+    from dataset_sculptor.move_bw_images import BWImageMenu
+
+    settings = {
+        "INPUT_DIR": input_dir,
+        "OUTPUT_DIR": output_dir,
+        "MSE_CUTOFF": 22,
+        "LABEL_FILENAME": False,
+        "APPEND_CAPTION": None,
+        "MOVE_OR_COPY": None,
+        "RECURSIVE": True,
+    }
+    settings.update({key.upper(): value for key, value in options.items()})
+    bw_menu = BWImageMenu(settings)
+    return (lambda path: bw_menu.process_file(os.path.dirname(path), os.path.basename(path))), None
+
+
+def _blip_handler(module, default_options, process):
+    def make_handler(input_dir, output_dir, options):
+        from dataset_sculptor import blip_daemon
+
+        module_options = dict(default_options, output_dir=output_dir)
+        module_options.update(options)
+        ask, client = blip_daemon.load_ask(module.MODEL_NAME, module.query_blip)
+
+        def handle(path):
+            image = module.load_image(path)
+            if image is None:
+                raise ValueError("Failed to read image")
+            process(path, image, ask, module_options)
+
+        return handle, (client.close if client else None)
+    return make_handler
+
+
+def _advanced_quality_handler(input_dir, output_dir, options):
+    from dataset_sculptor import advanced_quality
+
+    answer_counts = {}
+    defaults = {'rename': False, 'update_caption': False, 'move_files': False, 'update_text': ""}
+    process = lambda path, image, ask, opts: advanced_quality.process_image(path, image, ask, opts, answer_counts)
+    return _blip_handler(advanced_quality, defaults, process)(input_dir, output_dir, options)
+
+
+def _label_bw_handler(input_dir, output_dir, options):
+    from dataset_sculptor import label_bw
+
+    stats = label_bw.new_stats()
+    defaults = {'rename': False, 'update_caption': False, 'move_files': False, 'update_text': "",
+                'cascade': False, 'cascade_audit': 0, 'cascade_bw_max': label_bw.CASCADE_BW_MAX,
+                'cascade_color_min': label_bw.CASCADE_COLOR_MIN}
+    process = lambda path, image, ask, opts: label_bw.process_image(path, image, ask, opts, stats)
+    return _blip_handler(label_bw, defaults, process)(input_dir, output_dir, options)
+
+
+def _tag_questions_handler(input_dir, output_dir, options):
+    from dataset_sculptor import tag_questions
+
+    answer_counts = {}
+    defaults = {'rename': False, 'rename_position': 'end', 'rename_label': '', 'update_caption': False,
+                'update_caption_position': 'after', 'newline_caption': False, 'move_files': False,
+                'blip_question1': '', 'blip_question2': None}
+    process = lambda path, image, ask, opts: tag_questions.process_image(path, image, ask, opts, answer_counts)
+    return _blip_handler(tag_questions, defaults, process)(input_dir, output_dir, options)
+
+
+# Module name -> (file extensions it works on, handler factory).
+# A handler factory takes (input_dir, output_dir, options) and returns (handle(path), close or None).
+MODULES = {
+    'resize': (('.png', '.jpg', '.jpeg', '.bmp', '.tif', '.tiff'), _resize_handler),
+    'bw': (('.jpg', '.jpeg', '.png', '.bmp', '.gif', '.tiff', '.tif'), _bw_handler),
+    'advanced_quality': (BLIP_EXTENSIONS, _advanced_quality_handler),
+    'label_bw': (BLIP_EXTENSIONS, _label_bw_handler),
+    'tag_questions': (BLIP_EXTENSIONS, _tag_questions_handler),
+}
+
+
+class JobQueue:
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        # Autocommit mode, transactions are opened explicitly where they matter
+        self.conn = sqlite3.connect(db_path, timeout=60, isolation_level=None)
+        self.conn.executescript('''
+            CREATE TABLE IF NOT EXISTS queues (
+                name TEXT PRIMARY KEY,
+                module TEXT NOT NULL,
+                input_dir TEXT NOT NULL,
+                output_dir TEXT NOT NULL,
+                options TEXT NOT NULL,
+                created REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS jobs (
+                queue TEXT NOT NULL,
+                path TEXT NOT NULL,
+                state TEXT NOT NULL DEFAULT 'pending',
+                worker TEXT,
+                lease_until REAL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                error TEXT,
+                PRIMARY KEY (queue, path)
+            );
+            CREATE INDEX IF NOT EXISTS jobs_state ON jobs (queue, state);
+            CREATE TABLE IF NOT EXISTS workers (
+                worker TEXT PRIMARY KEY,
+                queue TEXT NOT NULL,
+                heartbeat REAL NOT NULL,
+                processed INTEGER NOT NULL DEFAULT 0
+            );
+        ''')
+
+    def close(self):
+        self.conn.close()
+
+    def create(self, name, module, input_dir, output_dir, options, paths):
+        """Register a queue and enqueue paths (relative to input_dir). Paths already queued are left alone."""
+        with self.conn:
+            self.conn.execute('BEGIN IMMEDIATE')
+            self.conn.execute('INSERT OR REPLACE INTO queues VALUES (?, ?, ?, ?, ?, ?)',
+                              (name, module, input_dir, output_dir, json.dumps(options), time.time()))
+            self.conn.executemany('INSERT OR IGNORE INTO jobs (queue, path) VALUES (?, ?)',
+                                  ((name, path) for path in paths))
+
+    def settings(self, name):
+        row = self.conn.execute('SELECT module, input_dir, output_dir, options FROM queues WHERE name = ?',
+                                (name,)).fetchone()
+        if row is None:
+            raise KeyError(f"No queue named {name} in {self.db_path}")
+        return {'module': row[0], 'input_dir': row[1], 'output_dir': row[2], 'options': json.loads(row[3])}
+
+    def claim(self, name, worker, batch_size=DEFAULT_BATCH_SIZE, lease_seconds=DEFAULT_LEASE_SECONDS):
+        """Lease up to batch_size pending files (or files whose lease ran out) to this worker."""
+        now = time.time()
+        with self.conn:
+            # BEGIN IMMEDIATE takes the write lock up front, so two workers can never select the same rows
+            self.conn.execute('BEGIN IMMEDIATE')
+            # Files that keep killing their worker are not handed out forever
+            self.conn.execute('''UPDATE jobs SET state = 'failed', error = 'lease expired too many times'
+                                 WHERE queue = ? AND state = 'claimed' AND lease_until < ? AND attempts >= ?''',
+                              (name, now, MAX_ATTEMPTS))
+            paths = [row[0] for row in self.conn.execute(
+                '''SELECT path FROM jobs WHERE queue = ? AND (state = 'pending' OR (state = 'claimed' AND lease_until < ?))
+                   ORDER BY rowid LIMIT ?''', (name, now, batch_size))]
+            self.conn.executemany('''UPDATE jobs SET state = 'claimed', worker = ?, lease_until = ?, attempts = attempts + 1
+                                     WHERE queue = ? AND path = ?''',
+                                  ((worker, now + lease_seconds, name, path) for path in paths))
+        return paths
+
+    def heartbeat(self, name, worker, lease_seconds=DEFAULT_LEASE_SECONDS, processed=0):
+        now = time.time()
+        with self.conn:
+            self.conn.execute('BEGIN IMMEDIATE')
+            self.conn.execute("UPDATE jobs SET lease_until = ? WHERE queue = ? AND worker = ? AND state = 'claimed'",
+                              (now + lease_seconds, name, worker))
+            self.conn.execute('INSERT OR REPLACE INTO workers VALUES (?, ?, ?, ?)', (worker, name, now, processed))
+
+    def complete(self, name, worker, path):
+        """Mark a file done. Returns False if the lease was lost and another worker may have taken it over."""
+        cursor = self.conn.execute('''UPDATE jobs SET state = 'done', lease_until = NULL, error = NULL
+                                      WHERE queue = ? AND path = ? AND worker = ? AND state = 'claimed' ''',
+                                   (name, path, worker))
+        return cursor.rowcount == 1
+
+    def fail(self, name, worker, path, error):
+        """Record a failure. The file goes back to the queue until it has failed MAX_ATTEMPTS times."""
+        self.conn.execute('''UPDATE jobs SET state = CASE WHEN attempts >= ? THEN 'failed' ELSE 'pending' END,
+                                             lease_until = NULL, error = ?
+                             WHERE queue = ? AND path = ? AND worker = ? AND state = 'claimed' ''',
+                          (MAX_ATTEMPTS, error, name, path, worker))
+
+    def retry_failed(self, name):
+        cursor = self.conn.execute("UPDATE jobs SET state = 'pending', attempts = 0 WHERE queue = ? AND state = 'failed'",
+                                   (name,))
+        return cursor.rowcount
+
+    def counts(self, name):
+        counts = {'pending': 0, 'claimed': 0, 'done': 0, 'failed': 0}
+        for state, count in self.conn.execute('SELECT state, COUNT(*) FROM jobs WHERE queue = ? GROUP BY state', (name,)):
+            counts[state] = count
+        return counts
+
+    def workers(self, name):
+        return self.conn.execute('SELECT worker, heartbeat, processed FROM workers WHERE queue = ? ORDER BY worker',
+                                 (name,)).fetchall()
+
+    def failures(self, name, limit=20):
+        return self.conn.execute("SELECT path, error FROM jobs WHERE queue = ? AND state = 'failed' LIMIT ?",
+                                 (name, limit)).fetchall()
+
+
+def list_files(input_dir, extensions, recursive=True):
+    """Paths of matching files relative to input_dir, in a stable order."""
+    paths = []
+    for root, dirs, files in os.walk(input_dir):
+        dirs.sort()
+        for filename in sorted(files):
+            if filename.lower().endswith(extensions):
+                paths.append(os.path.relpath(os.path.join(root, filename), input_dir))
+        if not recursive:
+            break
+    return paths
+
+
+def create_queue(db_path, module, input_dir, output_dir, options=None, name=DEFAULT_QUEUE, recursive=True):
+    if module not in MODULES:
+        raise ValueError(f"Unknown module {module}. Choose from: {', '.join(MODULES)}")
+    extensions, _ = MODULES[module]
+    paths = list_files(input_dir, extensions, recursive)
+    jobs = JobQueue(db_path)
+    try:
+        jobs.create(name, module, input_dir, output_dir, options or {}, paths)
+        print(f"Queued {len(paths)} files for {module} in queue '{name}' ({db_path})")
+    finally:
+        jobs.close()
+    return len(paths)
+
+
+def _heartbeat_loop(db_path, name, worker, lease_seconds, state, stop):
+    # Own connection, sqlite3 connections must not be shared between threads
+    jobs = JobQueue(db_path)
+    try:
+        while not stop.wait(lease_seconds / 3):
+            jobs.heartbeat(name, worker, lease_seconds, state['processed'])
+    finally:
+        jobs.close()
+
+
+def run_worker(db_path, name=DEFAULT_QUEUE, batch_size=DEFAULT_BATCH_SIZE, lease_seconds=DEFAULT_LEASE_SECONDS,
+               root=None, worker=None):
+    """Claim and process batches until the queue is drained. Returns the number of files processed successfully."""
+    worker = worker or f"{socket.gethostname()}-{os.getpid()}"
+    jobs = JobQueue(db_path)
+    settings = jobs.settings(name)
+    input_dir = root or settings['input_dir']
+    _, make_handler = MODULES[settings['module']]
+    handle, close = make_handler(input_dir, settings['output_dir'], settings['options'])
+
+    state = {'processed': 0}
+    stop = threading.Event()
+    jobs.heartbeat(name, worker, lease_seconds)
+    heartbeat = threading.Thread(target=_heartbeat_loop, args=(db_path, name, worker, lease_seconds, state, stop), daemon=True)
+    heartbeat.start()
+
+    try:
+        while True:
+            batch = jobs.claim(name, worker, batch_size, lease_seconds)
+            if not batch:
+                counts = jobs.counts(name)
+                if counts['pending'] == 0 and counts['claimed'] == 0:
+                    break
+                # Other workers still hold leases. Wait in case one of them dies and its files come back.
+                time.sleep(POLL_SECONDS)
+                continue
+
+            for path in batch:
+                try:
+                    handle(os.path.join(input_dir, path))
+                except Exception as e:
+                    print(colored(f"[{worker}] Failed to process {path}. Error: {e}", "red"))
+                    jobs.fail(name, worker, path, str(e))
+                    continue
+                # Failed attempts go back to the queue, only finished files count as processed
+                state['processed'] += 1
+                if not jobs.complete(name, worker, path):
+                    print(colored(f"[{worker}] Lost the lease on {path} before finishing it", "red"))
+    finally:
+        stop.set()
+        heartbeat.join()
+        jobs.heartbeat(name, worker, 0, state['processed'])
+        jobs.close()
+        if close:
+            close()
+
+    print(f"[{worker}] Processed {state['processed']} files.")
+    return state['processed']
+
+
+def run_workers(db_path, name=DEFAULT_QUEUE, workers=1, batch_size=DEFAULT_BATCH_SIZE,
+                lease_seconds=DEFAULT_LEASE_SECONDS, root=None):
+    """Run several worker processes on this machine and wait for all of them."""
+    if workers <= 1:
+        return run_worker(db_path, name, batch_size, lease_seconds, root)
+
+    processes = [multiprocessing.Process(target=run_worker, args=(db_path, name, batch_size, lease_seconds, root))
+                 for _ in range(workers)]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+
+
+def print_status(db_path, name=DEFAULT_QUEUE):
+    jobs = JobQueue(db_path)
+    try:
+        settings = jobs.settings(name)
+        counts = jobs.counts(name)
+        total = sum(counts.values())
+        print(f"Queue '{name}': {settings['module']} on {settings['input_dir']}")
+        print(f"Done: {counts['done']}/{total}  Pending: {counts['pending']}  In progress: {counts['claimed']}  Failed: {counts['failed']}")
+        now = time.time()
+        for worker, heartbeat, processed in jobs.workers(name):
+            print(f"  {worker}: {processed} files, last heartbeat {now - heartbeat:.0f}s ago")
+        for path, error in jobs.failures(name):
+            print(colored(f"  Failed: {path}: {error}", "red"))
+    finally:
+        jobs.close()
+
+
+def _parse_option(text):
+    key, _, value = text.partition('=')
+    try:
+        return key, json.loads(value)
+    except ValueError:
+        return key, value
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Dataset Sculptor shared job queue')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    create = subparsers.add_parser('create', help='Queue the images of an input directory for a module')
+    create.add_argument('--module', required=True, choices=sorted(MODULES))
+    create.add_argument('--input_dir', required=True)
+    create.add_argument('--output_dir', required=True)
+    create.add_argument('--set', action='append', default=[], metavar='KEY=VALUE',
+                        help='Module option, e.g. max_image_length=1024 or rename=true')
+    create.add_argument('--no_recursive', action='store_true', help='Only queue the top level of the input directory')
+
+    work = subparsers.add_parser('work', help='Process queued files')
+    work.add_argument('--workers', type=int, default=1, help='Worker processes to start on this machine')
+    work.add_argument('--batch_size', type=int, default=DEFAULT_BATCH_SIZE)
+    work.add_argument('--lease', type=int, default=DEFAULT_LEASE_SECONDS, help='Lease length in seconds')
+    work.add_argument('--root', default=None, help='Input directory as mounted on this machine')
+
+    subparsers.add_parser('status', help='Show progress')
+    subparsers.add_parser('retry', help='Put failed files back in the queue')
+
+    for subparser in subparsers.choices.values():
+        subparser.add_argument('--db', required=True, help='Queue database path')
+        subparser.add_argument('--queue', default=DEFAULT_QUEUE, help='Queue name')
+
+    args = parser.parse_args()
+
+    if args.command == 'create':
+        options = dict(_parse_option(option) for option in args.set)
+        create_queue(args.db, args.module, args.input_dir, args.output_dir, options, args.queue, not args.no_recursive)
+    elif args.command == 'work':
+        run_workers(args.db, args.queue, args.workers, args.batch_size, args.lease, args.root)
+    elif args.command == 'status':
+        print_status(args.db, args.queue)
+    elif args.command == 'retry':
+        jobs = JobQueue(args.db)
+        print(f"Requeued {jobs.retry_failed(args.queue)} failed files.")
+        jobs.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,220 +1,428 @@
-import glob
-import os
-import cv2
-from termcolor import colored
-from torchvision.transforms.functional import InterpolationMode
-from transformers import AutoProcessor, BlipForQuestionAnswering
-import shutil
-
-MODEL_NAME = "Salesforce/blip-vqa-base"
-
-def query_blip(blip_model, processor, image, question, max_new_tokens=30):
-    inputs = processor(images=image, text=question, return_tensors="pt")
-    outputs = blip_model.generate(**inputs, max_new_tokens=max_new_tokens)
-    return processor.decode(outputs[0], skip_special_tokens=True)
-
-def move_to_quality_dir(file_path, output_dir):
-    x_quality_dir = os.path.join(output_dir, "DS_Greyscale")
-
-    destination_path = os.path.join(x_quality_dir, os.path.basename(file_path))
-    if not os.path.exists(x_quality_dir):
-        os.makedirs(x_quality_dir)
-
-    shutil.move(file_path, destination_path)
-
-    print(f"Moved file to: {destination_path}")
-
-    return destination_path
-
-def rename_and_update_file(base_path, options):
-    base_file_name, file_extension = os.path.splitext(os.path.basename(base_path))
-    new_file_name = f"{base_file_name}_BW{file_extension}"
-
-    new_path = os.path.join(os.path.dirname(base_path), new_file_name)
-
-    if options['rename']:
-        os.rename(base_path, new_path)
-        print(f"Renamed image file: {base_path} -> {new_path}")
-
-    txt_file_name = os.path.splitext(base_path)[0] + ".txt"
-    if os.path.isfile(txt_file_name) and options['update_caption']:
-        new_txt_file_name = f"{base_file_name}_BW.txt"
-        new_txt_path = os.path.join(os.path.dirname(txt_file_name), new_txt_file_name)
-
-        with open(txt_file_name, 'r+') as f:
-            existing_caption = f.read().rstrip('\n')
-            # To append to the back of caption, change the line below to: content = f"{existing_caption} {options['update_text']}"
-            content = f"{options['update_text']} {existing_caption}"
-            f.seek(0)
-            f.write(content)
-            f.truncate()
-        print(f"Updated content in: {txt_file_name}")
-
-        os.rename(txt_file_name, new_txt_path)
-        print(f"Renamed caption file: {txt_file_name} -> {new_txt_path}")
-
-    if options['move_files']:
-        new_path = move_to_quality_dir(new_path, options['output_dir'])
-        if os.path.isfile(new_txt_path):
-            new_txt_path = move_to_quality_dir(new_txt_path, options['output_dir'])
-
-    return new_path
-
-def label_bad_quality_images(input_dir, output_dir, options):
-    print("Starting...")
-
-    blip_model = BlipForQuestionAnswering.from_pretrained(MODEL_NAME)
-    print("Model loaded.")
-
-    processor = AutoProcessor.from_pretrained(MODEL_NAME)
-    print("Processor loaded.")
-
-    ext = ('.jpg', '.jpeg', '.png', '.webp', '.tif', '.tga', '.tiff', '.bmp', '.gif',
-           '.JPG', '.JPEG', '.PNG', '.WEBP', '.TIF', '.TGA', '.TIFF', '.BMP', '.GIF')
-    files_processed = 0
-
-    # Define a dictionary to track the counts of different responses
-    answer_counts = {}
-
-    for idx, img_file_name in enumerate(glob.glob(os.path.join(input_dir, "**", "*.*"), recursive=True)):
-        if img_file_name.endswith(ext):
-            print(f"Processing image: {img_file_name}")
-
-            try:
-                image = cv2.imread(img_file_name)
-                if image is None:
-                    print(f"Failed to read image: {img_file_name}")
-                    continue
-
-                if image.shape[2] == 1:
-                    image = cv2.cvtColor(image, cv2.COLOR_GRAY2RGB)
-                elif image.shape[2] == 4:
-                    image = cv2.cvtColor(image, cv2.COLOR_RGBA2RGB)
-
-                answer = query_blip(blip_model, processor, image, "Is the image in color or black and white?")
-                print(f"BLIP's answer: {answer}")
-
-                # Update the counts of different responses
-                if answer.lower() in answer_counts:
-                    answer_counts[answer.lower()] += 1
-                else:
-                    answer_counts[answer.lower()] = 1
-
-                if "black and white" in answer.lower():
-                    answer_quality = query_blip(blip_model, processor, image, "Can you describe the quality of the photo?")
-                    print(f"BLIP's answer: {answer_quality}")
-                    options['update_text'] = f"A {answer_quality} image of"
-                    img_file_name = rename_and_update_file(img_file_name, options)
-
-                files_processed += 1
-
-            except Exception as e:
-                print(f"Failed to process image: {img_file_name}. Error: {e}")
-                continue
-
-    print(f"Processed {files_processed} files.")
-    print(f"Answer counts: {answer_counts}")  # Print the counts of different answers
-
-def run_advanced_greyscale(input_dir, output_dir):
-    options = {
-        'rename': False,
-        'update_caption': False,
-        'move_files': False,
-        'output_dir': output_dir,
-        'update_text': ""
-    }
-
-    while True:
-        print(colored(f'''
-        
-                      
-                 ___      __   ___  __           ___      ___           
-                |__  \_/ |__) |__  |__) |  |\/| |__  |\ |  |   /\  |    
-                |___ / \ |    |___ |  \ |  |  | |___ | \|  |  /~~\ |___ 
-        ''', 'cyan'))                                                
-        print(colored(f'''
-        Current Input Directory: {input_dir}
-        Current Output Directory: {output_dir}
-    ┌──────────────────────────────────────────────────────────────────────────────┐
-    |                    ADVANCED GREYSCALE DETECTION MODULE                       |
-    |------------------------------------------------------------------------------|
-    |                                                                              |
-    |              Settings                                                        | 
-    |                                                                              |
-    |          1 - Label Filenames with _BW ({'ON' if options['rename'] else 'OFF'})
-    |          2 - Blip quality description to caption ({'ON' if options['update_caption'] else 'OFF'})                                             
-    |          3 - Move Low Quality to Output/DS_LowQuality ({'ON' if options['move_files'] else 'OFF'})                                                 
-    |                                                                              |
-    └──────────────────────────────────────────────────────────────────────────────┘
-    |          I - Set Input         R - Run         X - Exit to Menu              |
-    └──────────────────────────────────────────────────────────────────────────────┘
-    ▓▓▓▓▓▓▓▓▓▓██████████▓▓▓▓▓▓▓▓▓▓██████████▓▓▓▓▓▓▓▓▓▓██████████▓▓▓▓▓▓▓▓▓▓██████████
-
-    Module uses machine vision to analyze images to find black and white images
-    Options label filenames, add quality descriptions to the caption specific to the image, 
-    or move files to Output Directory DS_Greyscale
-
-    EXPERIMENTAL -- Basic BW tool still has better results on broader datasets
-    BlipQuestions can be tweaked in .py files to experiment
-
-    ''', 'light_grey', 'on_grey'))
-
-        choice = input("\nEnter your selection: ").strip().upper()
-
-        if choice == '1':
-            user_response = input("Would you like to add a label to the filenames of black and white images? (Y/N) ").strip().upper()
-            if user_response == 'Y':
-                options['rename'] = True
-            elif user_response == 'N':
-                options['rename'] = False
-            else:
-                print(colored("Invalid input. Please select Y or N.", "red"))
-
-        elif choice == '2':
-            user_response = input("Would you like to add a description of the quality to the caption? (Y/N) ").strip().upper()
-            if user_response == 'Y':
-                options['update_caption'] = True
-            elif user_response == 'N':
-                options['update_caption'] = False
-            else:
-                print(colored("Invalid input. Please select Y or N.", "red"))
-
-        elif choice == '3':
-            user_response = input("Move the images to Output Directory? (Y/N) ").strip().upper()
-            if user_response == 'Y':
-                options['move_files'] = True
-            elif user_response == 'N':
-                options['move_files'] = False
-            else:
-                print(colored("Invalid input. Please select Y or N.", "red"))
-
-        elif choice == 'I':
-            input_dir = input("Enter new Input Directory path: ").strip()
-            if not os.path.exists(input_dir):
-                print(colored("The provided input directory doesn't exist. Please try again.", "red"))
-
-        elif choice == 'R':
-            warning_message = """
-            WARNING: Module will alter files based on quality
-            Dataset Sculptor is experimental and only intended for backed up datasets
-            Use at your own risk
-            Run the module? (Y/N) 
-            """
-            user_response = input(warning_message).strip().upper()
-            if user_response in ['Y', 'YES']:
-                try:
-                    label_bad_quality_images(input_dir, output_dir, options)
-                except Exception as e:
-                    print(colored(f"An error occurred while processing: {e}", "red"))
-            else:
-                print("Module execution aborted.")
-
-
-        elif choice == 'X':
-            print("Exiting to main menu.")
-            break
-
-        else:
-            print(colored("Invalid selection. Please try again.", "red"))
-
-
+import os
+import cv2
+import numpy as np
+from termcolor import colored
+from dataset_sculptor import archive_io
+from dataset_sculptor import blip_daemon
+from dataset_sculptor import file_ops
+from dataset_sculptor import instrumentation
+from dataset_sculptor import integrity_scan
+from dataset_sculptor import memory_guard
+from dataset_sculptor import progress
+from dataset_sculptor import run_journal
+from dataset_sculptor.run_journal import ask_once, move_once, update_caption_once
+
+MODEL_NAME = "Salesforce/blip-vqa-base"
+COLOR_QUESTION = "Is the image in color or black and white?"
+DESCRIBE_QUALITY_QUESTION = "Can you describe the quality of the photo?"
+
+# Cascade mode thresholds on the greyscale score (see greyscale_score).
+# Images scoring at or below CASCADE_BW_MAX are black and white, at or above
+# CASCADE_COLOR_MIN are color, and only the band in between is sent to BLIP.
+CASCADE_BW_MAX = 0.0005
+CASCADE_COLOR_MIN = 0.01
+CASCADE_THUMB_SIZE = 40
+
+def query_blip(blip_model, processor, image, question, max_new_tokens=30):
+    inputs = processor(images=image, text=question, return_tensors="pt")
+    outputs = blip_model.generate(**inputs, max_new_tokens=max_new_tokens)
+    return processor.decode(outputs[0], skip_special_tokens=True)
+
+def greyscale_score(image, thumb_size=CASCADE_THUMB_SIZE):
+    """
+    Vectorized version of the mean squared error used by BWImageMenu.detect_bw_image:
+    how far each pixel's channels stray from their mean, after removing the
+    image-wide colour cast so sepia and tinted scans still score as greyscale.
+    """
+    if image.ndim == 2 or image.shape[2] == 1:
+        return 0.0
+    thumb = cv2.resize(image[:, :, :3], (thumb_size, thumb_size), interpolation=cv2.INTER_AREA).astype(np.float32) / 255.0
+    bias = thumb.reshape(-1, 3).mean(axis=0)
+    bias -= bias.mean()
+    deviation = thumb - thumb.mean(axis=2, keepdims=True) - bias
+    return float((deviation * deviation).sum(axis=2).mean())
+
+def cascade_decision(score, options):
+    """Returns True (black and white), False (color) or None when BLIP has to decide."""
+    if score <= options['cascade_bw_max']:
+        return True
+    if score >= options['cascade_color_min']:
+        return False
+    return None
+
+def move_to_quality_dir(file_path, output_dir):
+    x_quality_dir = os.path.join(output_dir, "DS_Greyscale")
+
+    destination_path = os.path.join(x_quality_dir, os.path.basename(file_path))
+    file_ops.ensure_dir(x_quality_dir)
+    file_ops.move(file_path, destination_path)
+
+    progress.file_event(file_path, 'moved', destination=destination_path)
+
+    return destination_path
+
+def rename_and_update_file(base_path, options, journal=None, key=None):
+    # With a journal, every step runs at most once per image so a resumed run
+    # never renames _BW twice or prefixes the caption twice
+    base_file_name, file_extension = os.path.splitext(os.path.basename(base_path))
+    if "_BW" not in base_file_name:
+        new_file_name = f"{base_file_name}_BW{file_extension}"
+    else:
+        new_file_name = f"{base_file_name}{file_extension}"
+
+    new_path = base_path
+
+    if options['rename']:
+        new_path = move_once(journal, key, 'rename_image', base_path, os.path.join(os.path.dirname(base_path), new_file_name))
+        progress.file_event(base_path, 'renamed', destination=new_path)
+
+    txt_file_name = os.path.splitext(base_path)[0] + ".txt"
+    new_txt_path = None
+    if os.path.isfile(txt_file_name) or (journal and journal.started(key, 'update_caption', 'rename_caption', 'move_caption')):
+        new_txt_path = txt_file_name
+
+        if options['update_caption']:
+            def prefix_caption(existing_caption):
+                existing_caption = existing_caption.rstrip('\n')
+                # To append to the back of caption, change the line below to: return f"{existing_caption} {options['update_text']}"
+                return f"{options['update_text']} {existing_caption}"
+
+            if update_caption_once(journal, key, 'update_caption', txt_file_name, prefix_caption):
+                progress.file_event(txt_file_name, 'caption_updated', text=options['update_text'])
+
+        if options['rename']:
+            new_txt_path = move_once(journal, key, 'rename_caption', txt_file_name, os.path.splitext(new_path)[0] + ".txt")
+            progress.file_event(txt_file_name, 'renamed', destination=new_txt_path)
+
+    if options['move_files']:
+        greyscale_dir = os.path.join(options['output_dir'], "DS_Greyscale")
+        move = lambda src, dst: move_to_quality_dir(src, options['output_dir'])
+        new_path = move_once(journal, key, 'move_image', new_path, os.path.join(greyscale_dir, os.path.basename(new_path)), move)
+        if new_txt_path:
+            new_txt_path = move_once(journal, key, 'move_caption', new_txt_path, os.path.join(greyscale_dir, os.path.basename(new_txt_path)), move)
+
+    return new_path
+
+def new_stats():
+    # answer_counts tracks the counts of different responses, the rest is cascade mode
+    # bookkeeping: cheap decisions, BLIP calls avoided and audit agreement
+    return {
+        'answer_counts': {},
+        'cascade_counts': {'black and white': 0, 'color': 0, 'blip': 0},
+        'skipped_inferences': 0,
+        'audited': 0,
+        'agreed': 0
+    }
+
+def load_image(img_file_name):
+    with instrumentation.stage('decode'):
+        image = cv2.imread(img_file_name)
+    if image is None:
+        return None
+
+    if image.shape[2] == 1:
+        image = cv2.cvtColor(image, cv2.COLOR_GRAY2RGB)
+    elif image.shape[2] == 4:
+        image = cv2.cvtColor(image, cv2.COLOR_RGBA2RGB)
+    return image
+
+def load_image_bytes(data):
+    """load_image() for an image held in memory, e.g. read from an archive."""
+    with memory_guard.decoded_data(data) as img:
+        with instrumentation.stage('process'):
+            # Same channel order as cv2.imread, so answers match a run on the extracted folder
+            return cv2.cvtColor(np.asarray(img.convert('RGB')), cv2.COLOR_RGB2BGR)
+
+def process_image(img_file_name, image, ask, options, stats, journal=None, key=None):
+    # An interrupted image that was already moved comes back without pixels, only once
+    # the journal holds its quality answer, which is only asked of black and white images
+    is_bw = True if image is None else None
+    if is_bw is None and options['cascade']:
+        score = greyscale_score(image)
+        is_bw = cascade_decision(score, options)
+        cascade_counts = stats['cascade_counts']
+        if is_bw is not None:
+            decided = 'black and white' if is_bw else 'color'
+            progress.file_event(img_file_name, 'cascade_decision', decision=decided, score=score)
+            cascade_counts[decided] += 1
+            stats['skipped_inferences'] += 1
+            # Spot check a share of the cheap decisions against BLIP to measure agreement
+            decided_total = cascade_counts['black and white'] + cascade_counts['color']
+            if options['cascade_audit'] and decided_total % options['cascade_audit'] == 0:
+                audit_answer = ask(image, COLOR_QUESTION)
+                stats['skipped_inferences'] -= 1
+                stats['audited'] += 1
+                if ("black and white" in audit_answer.lower()) == is_bw:
+                    stats['agreed'] += 1
+                else:
+                    progress.file_event(img_file_name, 'cascade_disagreed', decision=decided, answer=audit_answer)
+        else:
+            cascade_counts['blip'] += 1
+
+    if is_bw is None:
+        answer = ask_once(journal, key, ask, image, COLOR_QUESTION, img_file_name)
+        progress.file_event(img_file_name, 'answer', question=COLOR_QUESTION, answer=answer)
+
+        # Update the counts of different responses
+        answer_counts = stats['answer_counts']
+        if answer.lower() in answer_counts:
+            answer_counts[answer.lower()] += 1
+        else:
+            answer_counts[answer.lower()] = 1
+
+        is_bw = "black and white" in answer.lower()
+
+    if is_bw:
+        answer_quality = ask_once(journal, key, ask, image, DESCRIBE_QUALITY_QUESTION, img_file_name)
+        progress.file_event(img_file_name, 'answer', question=DESCRIBE_QUALITY_QUESTION, answer=answer_quality)
+        options['update_text'] = f"A {answer_quality} image of"
+        img_file_name = rename_and_update_file(key or img_file_name, options, journal, key)
+
+    if journal:
+        journal.finish(key)
+    return img_file_name
+
+def print_summary(files_processed, stats, options):
+    print(f"Processed {files_processed} files.")
+    print(f"Answer counts: {stats['answer_counts']}")  # Print the counts of different answers
+
+    if options['cascade']:
+        print(f"Cascade decisions: {stats['cascade_counts']}")
+        print(f"BLIP inferences skipped: {stats['skipped_inferences']}")
+        if stats['audited']:
+            agreement = 100.0 * stats['agreed'] / stats['audited']
+            print(f"Cascade agreement with BLIP: {stats['agreed']}/{stats['audited']} ({agreement:.1f}%)")
+
+def label_archive(archive, output_dir, options):
+    """
+    label_bad_quality_images() for a zip or tar archive. Pairs are read without
+    extracting the archive and the actions are applied to a copy of it, saved in
+    output_dir as <archive name>_label_bw with the archive's extension. There
+    is no journal, an interrupted run starts over.
+    """
+    stats = new_stats()
+    output_path = None
+    if options['rename'] or options['update_caption'] or options['move_files']:
+        output_path = archive_io.output_path(archive, output_dir, "label_bw")
+
+    # Share the model with a running BLIP daemon instead of loading another copy
+    ask, client = blip_daemon.load_ask(MODEL_NAME, query_blip)
+
+    def handle(img_file_name, scratch_output_dir, pair):
+        image = load_image_bytes(pair.image)
+        process_image(img_file_name, image, ask, dict(options, output_dir=scratch_output_dir), stats)
+
+    with progress.Progress("Advanced Greyscale") as bar:
+        files_processed, failures = archive_io.run_on_files(archive, output_path, handle, bar)
+
+    print_summary(files_processed, stats, options)
+    if failures:
+        print(f"Failed {failures} files, kept unchanged.")
+    if output_path:
+        print(f"Output archive: {output_path}")
+
+    if client:
+        client.close()
+
+def label_bad_quality_images(input_dir, output_dir, options):
+    print("Starting...")
+    if archive_io.is_archive(input_dir):
+        label_archive(input_dir, output_dir, options)
+        return
+
+    journal = run_journal.RunJournal(output_dir, "label_bw", input_dir, resume=options.get('resume', False))
+
+    ext = ('.jpg', '.jpeg', '.png', '.webp', '.tif', '.tga', '.tiff', '.bmp', '.gif',
+           '.JPG', '.JPEG', '.PNG', '.WEBP', '.TIF', '.TGA', '.TIFF', '.BMP', '.GIF')
+    files_processed = 0
+    files_skipped = 0
+    visited = set()
+    stats = new_stats()
+
+    image_files = []
+    for root, dirs, files in os.walk(input_dir):
+        # Output folders such as DS_Quarantine can sit inside the input folder
+        dirs[:] = sorted(d for d in dirs if not d.startswith('DS_'))
+        image_files.extend(os.path.join(root, name) for name in sorted(files) if name.endswith(ext))
+    # Corrupt files would only fail once the model is loaded, they are quarantined first
+    image_files = integrity_scan.quarantine_corrupt(image_files, output_dir)
+
+    # Share the model with a running BLIP daemon instead of loading another copy
+    ask, client = blip_daemon.load_ask(MODEL_NAME, query_blip)
+
+    with progress.Progress("Advanced Greyscale", total=len(image_files)) as bar:
+        for img_file_name in image_files:
+            bar.advance()
+            if journal.is_done(img_file_name):
+                files_skipped += 1
+                continue
+
+            key = journal.key_for(img_file_name)
+            visited.add(key)
+
+            try:
+                image = load_image(img_file_name)
+                if image is None:
+                    bar.error(f"Failed to read image: {img_file_name}", img_file_name)
+                    continue
+
+                journal.begin(key)
+                process_image(img_file_name, image, ask, options, stats, journal, key)
+                files_processed += 1
+
+            except Exception as e:
+                bar.error(f"Failed to process image: {img_file_name}. Error: {e}", img_file_name)
+                continue
+
+        # Images interrupted after they were already renamed or moved out of the input directory.
+        # Their answers are in the journal, so only the remaining file actions are applied.
+        for key in journal.unfinished_keys():
+            if key not in visited and journal.answer(key, DESCRIBE_QUALITY_QUESTION) is not None:
+                bar.file(key, 'finishing_interrupted')
+                try:
+                    process_image(key, None, ask, options, stats, journal, key)
+                    files_processed += 1
+                except Exception as e:
+                    bar.error(f"Failed to process image: {key}. Error: {e}", key)
+
+    journal.close()
+
+    print_summary(files_processed, stats, options)
+    if files_skipped:
+        print(f"Skipped {files_skipped} files finished in a previous run.")
+
+    if client:
+        client.close()
+
+def run_advanced_greyscale(input_dir, output_dir):
+    options = {
+        'rename': False,
+        'update_caption': False,
+        'move_files': False,
+        'output_dir': output_dir,
+        'update_text': "",
+        'cascade': False,
+        'cascade_audit': 0,
+        'cascade_bw_max': CASCADE_BW_MAX,
+        'cascade_color_min': CASCADE_COLOR_MIN
+    }
+
+    while True:
+        print(colored(f'''
+        
+                      
+                 ___      __   ___  __           ___      ___           
+                |__  \_/ |__) |__  |__) |  |\/| |__  |\ |  |   /\  |    
+                |___ / \ |    |___ |  \ |  |  | |___ | \|  |  /~~\ |___ 
+        ''', 'cyan'))                                                
+        print(colored(f'''
+        Current Input Directory: {input_dir}
+        Current Output Directory: {output_dir}
+    ┌──────────────────────────────────────────────────────────────────────────────┐
+    |                    ADVANCED GREYSCALE DETECTION MODULE                       |
+    |------------------------------------------------------------------------------|
+    |                                                                              |
+    |              Settings                                                        | 
+    |                                                                              |
+    |          1 - Label Filenames with _BW ({'ON' if options['rename'] else 'OFF'})
+    |          2 - Blip quality description to caption ({'ON' if options['update_caption'] else 'OFF'})                                             
+    |          3 - Move Low Quality to Output/DS_LowQuality ({'ON' if options['move_files'] else 'OFF'})                                                 
+    |          4 - Cascade: fast greyscale prefilter before BLIP ({'ON' if options['cascade'] else 'OFF'})
+    |          5 - Cascade audit: check every Nth fast decision with BLIP ({options['cascade_audit'] or 'OFF'})
+    |                                                                              |
+    └──────────────────────────────────────────────────────────────────────────────┘
+    |          I - Set Input         R - Run         X - Exit to Menu              |
+    └──────────────────────────────────────────────────────────────────────────────┘
+    ▓▓▓▓▓▓▓▓▓▓██████████▓▓▓▓▓▓▓▓▓▓██████████▓▓▓▓▓▓▓▓▓▓██████████▓▓▓▓▓▓▓▓▓▓██████████
+
+    Module uses machine vision to analyze images to find black and white images
+    Options label filenames, add quality descriptions to the caption specific to the image, 
+    or move files to Output Directory DS_Greyscale
+
+    Cascade decides clearly greyscale or clearly colorful images without BLIP
+    and only asks BLIP about the ambiguous ones
+
+    EXPERIMENTAL -- Basic BW tool still has better results on broader datasets
+    BlipQuestions can be tweaked in .py files to experiment
+
+    ''', 'light_grey', 'on_grey'))
+
+        choice = input("\nEnter your selection: ").strip().upper()
+
+        if choice == '1':
+            user_response = input("Would you like to add a label to the filenames of black and white images? (Y/N) ").strip().upper()
+            if user_response == 'Y':
+                options['rename'] = True
+            elif user_response == 'N':
+                options['rename'] = False
+            else:
+                print(colored("Invalid input. Please select Y or N.", "red"))
+
+        elif choice == '2':
+            user_response = input("Would you like to add a description of the quality to the caption? (Y/N) ").strip().upper()
+            if user_response == 'Y':
+                options['update_caption'] = True
+            elif user_response == 'N':
+                options['update_caption'] = False
+            else:
+                print(colored("Invalid input. Please select Y or N.", "red"))
+
+        elif choice == '3':
+            user_response = input("Move the images to Output Directory? (Y/N) ").strip().upper()
+            if user_response == 'Y':
+                options['move_files'] = True
+            elif user_response == 'N':
+                options['move_files'] = False
+            else:
+                print(colored("Invalid input. Please select Y or N.", "red"))
+
+        elif choice == '4':
+            user_response = input("Decide clear greyscale and color images without BLIP? (Y/N) ").strip().upper()
+            if user_response == 'Y':
+                options['cascade'] = True
+            elif user_response == 'N':
+                options['cascade'] = False
+            else:
+                print(colored("Invalid input. Please select Y or N.", "red"))
+
+        elif choice == '5':
+            user_response = input("Check every Nth cascade decision with BLIP (0 to turn off): ").strip()
+            if user_response.isdigit():
+                options['cascade_audit'] = int(user_response)
+            else:
+                print(colored("Invalid input. Please enter a number.", "red"))
+
+        elif choice == 'I':
+            input_dir = input("Enter new Input Directory path: ").strip()
+            if not os.path.exists(input_dir):
+                print(colored("The provided input directory doesn't exist. Please try again.", "red"))
+
+        elif choice == 'R':
+            warning_message = """
+            WARNING: Module will alter files based on quality
+            Dataset Sculptor is experimental and only intended for backed up datasets
+            Use at your own risk
+            Run the module? (Y/N) 
+            """
+            user_response = input(warning_message).strip().upper()
+            if user_response in ['Y', 'YES']:
+                options['resume'] = False
+                if run_journal.has_unfinished_run(output_dir, "label_bw", input_dir):
+                    resume_response = input("An interrupted run was found for this Input Directory. Resume it? (Y/N) ").strip().upper()
+                    options['resume'] = resume_response in ['Y', 'YES']
+                try:
+                    label_bad_quality_images(input_dir, output_dir, options)
+                except Exception as e:
+                    print(colored(f"An error occurred while processing: {e}", "red"))
+            else:
+                print("Module execution aborted.")
+
+
+        elif choice == 'X':
+            print("Exiting to main menu.")
+            break
+
+        else:
+            print(colored("Invalid selection. Please try again.", "red"))
+
+
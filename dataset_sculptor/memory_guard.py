@@ -0,0 +1,207 @@
+"""
+Bounded-memory image decoding.
+
+A single 30,000px scan decodes to several GB, and a decompression bomb to far more.
+Modules decode through decoded() instead of calling img.load() themselves:
+
+- images over the pixel budget are decoded at a reduced scale when the caller only
+  needs a smaller result. JPEGs are scaled down while decoding; other formats are
+  decoded in full first and reduced right after, so only the full-size buffer's
+  lifetime is cut short, not its peak
+- every decode reserves its pixel memory from a shared budget, concurrent decodes
+  wait while the budget is used up, an image larger than the whole budget runs alone
+- files over the hard pixel limit are refused before any pixel is read. Pillow's own
+  decompression bomb limit is lifted only while open_image() and decode() run,
+  the rest of the process keeps Pillow's defaults
+
+Files that can't be handled are moved to Output/DS_Quarantine with their caption by
+quarantine() instead of stopping the run.
+
+    with memory_guard.decoded(path, min_size=(2048, 2048)) as img:
+        ...
+
+Code that needs its own draft or lazy decoding opens with open_image() and decodes
+with decoding() or decode() inside a budget.reserve().
+"""
+import contextlib
+import math
+import os
+import threading
+
+from PIL import Image
+
+from dataset_sculptor import file_ops
+from dataset_sculptor import instrumentation
+from dataset_sculptor import progress
+
+PIXEL_BUDGET = 64_000_000  # images with more pixels are decoded reduced when the caller allows it
+MEMORY_BUDGET_MB = 4096  # decoded pixel memory shared by all concurrent decodes
+MAX_PIXELS = 1_000_000_000  # larger images are refused as decompression bombs
+QUARANTINE_DIR = "DS_Quarantine"
+
+# Pillow keeps most modes in 4 bytes per pixel
+BYTES_PER_PIXEL = {'1': 1, 'L': 1, 'P': 1, 'I;16': 2, 'I;16B': 2, 'I;16L': 2}
+
+# Errors after which a file is quarantined rather than retried
+UNMANAGEABLE = (Image.DecompressionBombError, MemoryError)
+
+
+class MemoryBudget:
+    """Counting semaphore over bytes of decoded pixels."""
+
+    def __init__(self, limit_bytes):
+        self.limit = limit_bytes
+        self.used = 0
+        self.condition = threading.Condition()
+
+    @contextlib.contextmanager
+    def reserve(self, amount):
+        with self.condition:
+            # Something too big for the whole budget still runs, once nothing else is decoding
+            while self.used and self.used + amount > self.limit:
+                self.condition.wait()
+            self.used += amount
+        try:
+            yield
+        finally:
+            with self.condition:
+                self.used -= amount
+                self.condition.notify_all()
+
+
+_settings = {'pixel_budget': PIXEL_BUDGET, 'max_pixels': MAX_PIXELS}
+budget = MemoryBudget(MEMORY_BUDGET_MB * 1024 * 1024)
+
+
+def configure(pixel_budget=None, memory_budget_mb=None, max_pixels=None):
+    if pixel_budget:
+        _settings['pixel_budget'] = pixel_budget
+    if memory_budget_mb:
+        budget.limit = memory_budget_mb * 1024 * 1024
+    if max_pixels:
+        _settings['max_pixels'] = max_pixels
+
+
+_lifted = {'count': 0, 'saved': None}
+_lifted_lock = threading.Lock()
+
+
+@contextlib.contextmanager
+def pixel_limit():
+    """
+    Pillow's decompression bomb check lifted while the block runs, check_pixels()
+    applies MAX_PIXELS instead. Pillow's limit is a module global, so it stays lifted
+    while any thread is inside a block and is restored when the last one leaves.
+    """
+    with _lifted_lock:
+        if not _lifted['count']:
+            _lifted['saved'] = Image.MAX_IMAGE_PIXELS
+            Image.MAX_IMAGE_PIXELS = None
+        _lifted['count'] += 1
+    try:
+        yield
+    finally:
+        with _lifted_lock:
+            _lifted['count'] -= 1
+            if not _lifted['count']:
+                Image.MAX_IMAGE_PIXELS = _lifted['saved']
+
+
+def decoded_bytes(img):
+    return img.size[0] * img.size[1] * BYTES_PER_PIXEL.get(img.mode, 4)
+
+
+def reduction_factor(size, min_size):
+    """Largest integer factor that keeps size at least min_size on both sides."""
+    return max(1, min(size[0] // max(1, min_size[0]), size[1] // max(1, min_size[1])))
+
+
+def check_pixels(size):
+    """Refuse an image of size (width, height) over the hard pixel limit before any pixel is read."""
+    if size[0] * size[1] > _settings['max_pixels']:
+        raise Image.DecompressionBombError(
+            f"Image size ({size[0] * size[1]} pixels) exceeds limit of {_settings['max_pixels']} pixels")
+
+
+def _checked(open_):
+    with pixel_limit():
+        img = open_()
+    try:
+        check_pixels(img.size)
+    except Image.DecompressionBombError:
+        img.close()
+        raise
+    return img
+
+
+def open_image(path):
+    """instrumentation.open_image() with MAX_PIXELS in place of Pillow's limit. Only the header is read."""
+    return _checked(lambda: instrumentation.open_image(path))
+
+
+def open_image_bytes(data):
+    """open_image() for an image held in memory, e.g. read from an archive."""
+    return _checked(lambda: instrumentation.open_image_bytes(data))
+
+
+def decode(img):
+    """instrumentation.decode() for an image from open_image(), GIF and ICO frames are size checked again."""
+    with pixel_limit():
+        return instrumentation.decode(img)
+
+
+@contextlib.contextmanager
+def decoding(img, min_size=None, release=False):
+    """
+    Decode an image from open_image() within the budgets. min_size is the smallest
+    (width, height) the caller needs: images over the pixel budget come back reduced,
+    but never below it. Without min_size they are decoded at full size. Only JPEGs
+    decode straight to the smaller size, other formats are reduced after a full
+    decode. The budget is held until the block exits. release closes img as soon as
+    a reduced copy is made, freeing the full-size pixels, for callers that won't
+    touch img again.
+    """
+    width, height = img.size
+    factor = reduction_factor(img.size, min_size) if min_size and width * height > _settings['pixel_budget'] else 1
+    if factor > 1:
+        # JPEG scales by up to 1/8 while decoding, other formats ignore the draft
+        img.draft(img.mode, (math.ceil(width / factor), math.ceil(height / factor)))
+        instrumentation.count('reduced_decodes')
+    with budget.reserve(decoded_bytes(img)):
+        decode(img)
+        remaining = reduction_factor(img.size, min_size) if factor > 1 else 1
+        if remaining <= 1:
+            yield img
+            return
+        with instrumentation.stage('process'):
+            reduced = img.reduce(remaining)
+        if release:
+            img.close()
+        try:
+            yield reduced
+        finally:
+            reduced.close()
+
+
+@contextlib.contextmanager
+def decoded(path, min_size=None):
+    """Open and decode path within the budgets, see decoding(). The image is closed on exit."""
+    with open_image(path) as img:
+        with decoding(img, min_size, release=True) as result:
+            yield result
+
+
+@contextlib.contextmanager
+def decoded_data(data, min_size=None):
+    """decoded() for an image held in memory, e.g. read from an archive."""
+    with open_image_bytes(data) as img:
+        with decoding(img, min_size, release=True) as result:
+            yield result
+
+
+def quarantine(path, output_dir, reason):
+    """Move an image and its caption to DS_Quarantine so the rest of the run can go on. Returns the new path."""
+    quarantine_dir = os.path.join(output_dir or os.path.dirname(path), QUARANTINE_DIR)
+    destination = file_ops.pair(path, quarantine_dir, 'move')
+    progress.error(f"Quarantined {path}: {reason}", path, destination=destination)
+    return destination
@@ -1,128 +1,243 @@
-import os
-import glob
-import shutil
-from termcolor import colored
-
-class MoveString:
-    """A class to move or copy files based on a filename string."""
-    
-    def __init__(self):
-        self.input_dir = ""
-        self.output_dir = ""
-        self.search_string = ""
-        self.copy_or_move = "MOVE"
-        self.recursive = False
-
-    def set_input_dir(self, input_dir):
-        """Set the input directory and output directory based on it."""
-        if os.path.isdir(input_dir):
-            self.input_dir = input_dir
-            self.output_dir = os.path.join(input_dir, "Output")
-        else:
-            print("Not valid, no changes made")
-
-    def set_output_dir(self, output_dir):
-        """Set the output directory."""
-        if os.path.isdir(output_dir):
-            self.output_dir = output_dir
-        else:
-            print("Not valid, no changes made for output directory")
-
-    def display_menu(self):
-        """Display the settings menu for the user."""
-        print(colored(f'''
-    Current Input Directory: {self.input_dir}
-    Current Output Directory: {self.output_dir}
-    ┌──────────────────────────────────────────────────────────────────────────────┐
-    |                     MOVE BASED ON FILENAME STRING MODULE                     |
-    |------------------------------------------------------------------------------|
-    |                                                                              |
-    |              Settings                                                        | 
-    |                                                                              |
-    |          1 - Move String ({self.search_string or "NONE"})
-    |          2 - Copy or Move ({self.copy_or_move})                                             
-    |          3 - Recursive ({'ON' if self.recursive else 'OFF'})                                                 
-    |                                                                              |
-    └──────────────────────────────────────────────────────────────────────────────┘
-    |          I - Set Input         R - Run         X - Exit to Menu              |
-    └──────────────────────────────────────────────────────────────────────────────┘
-    ''', 'light_cyan'))
-
-        print("Module allows user to copy or move a file based on a string in the filename to a DS_String folder in the Output Folder")
-        print("Minimum is 3 characters to avoid false positives")
-        print("Move will relocate originals, Copy will leave originals in place and make a new copy in DS_String")
-        print("Recursive ON processes subfolders of the input directory\n")
-
-    def move_or_copy_files(self):
-        """Move or copy files based on the given settings."""
-        moved_or_copied_files = 0
-        path_pattern = self.input_dir.rstrip('/') + ('/**/*.*' if self.recursive else '/*.*')
-
-        for filename in glob.iglob(path_pattern, recursive=self.recursive):
-            if self.search_string in filename:
-                print(f"{'Moving' if self.copy_or_move == 'MOVE' else 'Copying'}: {filename}")
-                destination_dir = os.path.join(self.output_dir.rstrip('/'), "DS_String")
-                os.makedirs(destination_dir, exist_ok=True)
-                shutil.move(filename, destination_dir) if self.copy_or_move == "MOVE" else shutil.copy(filename, destination_dir)
-                moved_or_copied_files += 1
-
-        print(f'Total files {self.copy_or_move.lower()}d: {moved_or_copied_files}')
-
-    def handle_menu_choice(self, choice):
-        """Handle user choice from the menu."""
-        if choice == '1':
-            self.set_search_string()
-        elif choice == '2':
-            self.set_copy_or_move()
-        elif choice == '3':
-            self.set_recursive()
-        elif choice.lower() == 'i':
-            self.change_input_dir()
-        elif choice.lower() == 'r':
-            self.confirm_and_run()
-        elif choice.lower() == 'x':
-            return False
-        else:
-            print("Invalid choice. Please choose a valid option or press 'x' to exit.")
-        return True
-
-    def set_search_string(self):
-        """Prompt user for search string and validate it."""
-        self.search_string = input("Enter Filename String to Search: ")
-        if len(self.search_string) < 3:
-            print("String too short. Please provide a string of at least 3 characters.")
-            self.search_string = ""
-
-    def set_copy_or_move(self):
-        """Prompt user for copying or moving choice."""
-        user_input = input("Would you like to Copy [1] or Move [2] the images?: ")
-        self.copy_or_move = "COPY" if user_input in ['1', 'copy'] else "MOVE"
-
-    def set_recursive(self):
-        """Prompt user for recursive choice."""
-        user_input = input("Process folders recursively? (Y/N): ").lower()
-        self.recursive = user_input in ['y', 'yes']
-
-    def change_input_dir(self):
-        """Prompt user to change input directory."""
-        new_input_dir = input("Change Input Directory: ")
-        self.set_input_dir(new_input_dir)
-
-    def confirm_and_run(self):
-        """Confirm with the user and run the move/copy operation."""
-        confirm = input("WARNING: Module will move or copy files with supplied string\nDataset Cleaner is experimental and only intended for backed up datasets\nUse only on backed up datasets and use at your own risk\nRun the module? (Y/N) ")
-        if confirm.lower() in ['y', 'yes']:
-            self.move_or_copy_files()
-
-    def run(self):
-        """Main loop to run the module."""
-        while True:
-            self.display_menu()
-            choice = input("Enter your selection: ")
-            if not self.handle_menu_choice(choice):
-                break
-
-# To run the MoveString module
-# if __name__ == '__main__':
-#     mover = MoveString()
-#     mover.run()
+import os
+import re
+import csv
+from termcolor import colored
+from dataset_sculptor import file_ops
+from dataset_sculptor import progress
+
+MIN_PATTERN_LENGTH = 3
+
+
+def compile_routes(patterns):
+    """
+    Compile filename substrings into one regular expression. Every pattern is its own
+    group inside a lookahead, so a single finditer visits each position of a name once
+    and reports the first pattern (lowest group) matching there, in C rather than one
+    `in` test per pattern.
+    """
+    return re.compile('(?=(?:' + '|'.join(f'({re.escape(pattern)})' for pattern in patterns) + '))')
+
+
+def match_route(matcher, names):
+    """Index of the first pattern in the table found in any of names, or None."""
+    best = None
+    for name in names:
+        for match in matcher.finditer(name):
+            index = match.lastindex - 1
+            if best is None or index < best:
+                best = index
+                if best == 0:
+                    return best
+    return best
+
+
+def load_routes(path):
+    """Read a routing table, one 'pattern,folder' per line. The folder defaults to the pattern, # starts a comment."""
+    routes = []
+    with open(path, 'r', encoding='utf-8', newline='') as f:
+        for row in csv.reader(f):
+            if not row or not row[0].strip() or row[0].lstrip().startswith('#'):
+                continue
+            pattern = row[0].strip()
+            folder = row[1].strip() if len(row) > 1 and row[1].strip() else pattern
+            routes.append((pattern, folder_name(folder)))
+    return routes
+
+
+def folder_name(text):
+    return re.sub(r'[^\w\-. ]+', '_', text).strip(' ._') or 'routed'
+
+
+class MoveString:
+    """A class to move or copy files based on filename strings, each routed to its own folder."""
+    
+    def __init__(self):
+        self.input_dir = ""
+        self.output_dir = ""
+        self.search_string = ""
+        self.routes = []  # (pattern, folder inside DS_String), the first matching pattern wins
+        self.copy_or_move = "MOVE"
+        self.recursive = False
+
+    def set_input_dir(self, input_dir):
+        """Set the input directory and output directory based on it."""
+        if os.path.isdir(input_dir):
+            self.input_dir = input_dir
+            self.output_dir = os.path.join(input_dir, "Output")
+        else:
+            print("Not valid, no changes made")
+
+    def set_output_dir(self, output_dir):
+        """Set the output directory."""
+        if os.path.isdir(output_dir):
+            self.output_dir = output_dir
+        else:
+            print("Not valid, no changes made for output directory")
+
+    def display_menu(self):
+        """Display the settings menu for the user."""
+        print(colored(f'''
+    Current Input Directory: {self.input_dir}
+    Current Output Directory: {self.output_dir}
+    ┌──────────────────────────────────────────────────────────────────────────────┐
+    |                     MOVE BASED ON FILENAME STRING MODULE                     |
+    |------------------------------------------------------------------------------|
+    |                                                                              |
+    |              Settings                                                        | 
+    |                                                                              |
+    |          1 - Move String ({self.search_string or "NONE"})
+    |          2 - Copy or Move ({self.copy_or_move})                                             
+    |          3 - Recursive ({'ON' if self.recursive else 'OFF'})                                                 
+    |          4 - Routing Table ({len(self.routes)} patterns)
+    |                                                                              |
+    └──────────────────────────────────────────────────────────────────────────────┘
+    |          I - Set Input         R - Run         X - Exit to Menu              |
+    └──────────────────────────────────────────────────────────────────────────────┘
+    ''', 'light_cyan'))
+
+        print("Module allows user to copy or move a file based on a string in the filename to a DS_String folder in the Output Folder")
+        print("The Routing Table sends each string to its own DS_String/<folder>, all strings are matched in a single pass")
+        print("Captions always go with their images, whichever file of the pair contains the string")
+        print("Minimum is 3 characters to avoid false positives")
+        print("Move will relocate originals, Copy will leave originals in place and make a new copy in DS_String")
+        print("Recursive ON processes subfolders of the input directory\n")
+
+    def active_routes(self):
+        """The routing table, with the single Move String first going straight to DS_String."""
+        return ([(self.search_string, '')] if self.search_string else []) + self.routes
+
+    def file_groups(self):
+        """Yield the files of each image-caption pair (same folder and name) as one list."""
+        output_dir = os.path.abspath(self.output_dir) if self.output_dir else None
+        for root, dirs, files in os.walk(self.input_dir):
+            # Never route what an earlier run already routed
+            dirs[:] = sorted(d for d in dirs if not d.startswith('DS_') and os.path.abspath(os.path.join(root, d)) != output_dir)
+            groups = {}
+            for name in sorted(files):
+                groups.setdefault(os.path.splitext(name)[0], []).append(name)
+            for names in groups.values():
+                yield root, names
+            if not self.recursive:
+                break
+
+    def move_or_copy_files(self):
+        """Route every image-caption pair to the folder of its first matching string, in one scan."""
+        routes = self.active_routes()
+        matcher = compile_routes([pattern for pattern, folder in routes])
+        counts = [0] * len(routes)
+        action = 'move' if self.copy_or_move == "MOVE" else 'copy'
+
+        with progress.Progress("Move String") as bar, file_ops.Transfers() as transfers:
+            def counted(index, files):
+                def done(source, destination, error):
+                    if error:
+                        bar.error(f"Unable to {action} {source}: {error}", source)
+                        return
+                    bar.file(source, 'moved' if action == 'move' else 'copied', destination=destination)
+                    counts[index] += files
+                return done
+
+            for root, names in self.file_groups():
+                bar.advance(len(names))
+                index = match_route(matcher, names)
+                if index is None:
+                    continue
+                destination_dir = os.path.join(self.output_dir.rstrip('/'), "DS_String", routes[index][1])
+                # Each file takes its caption along under the name it gets, so the pair stays a pair
+                leads = [name for name in names if not name.lower().endswith('.txt')] or names
+                for i, name in enumerate(leads):
+                    files = 2 if i == 0 and len(leads) < len(names) else 1
+                    transfers.pair(os.path.join(root, name), destination_dir, action, done=counted(index, files))
+
+        for (pattern, folder), count in zip(routes, counts):
+            print(f"  {pattern} -> {os.path.join('DS_String', folder)}: {count}")
+        print(f'Total files {self.copy_or_move.lower()}d: {sum(counts)}')
+
+    def handle_menu_choice(self, choice):
+        """Handle user choice from the menu."""
+        if choice == '1':
+            self.set_search_string()
+        elif choice == '2':
+            self.set_copy_or_move()
+        elif choice == '3':
+            self.set_recursive()
+        elif choice == '4':
+            self.edit_routes()
+        elif choice.lower() == 'i':
+            self.change_input_dir()
+        elif choice.lower() == 'r':
+            self.confirm_and_run()
+        elif choice.lower() == 'x':
+            return False
+        else:
+            print("Invalid choice. Please choose a valid option or press 'x' to exit.")
+        return True
+
+    def set_search_string(self):
+        """Prompt user for search string and validate it."""
+        self.search_string = input("Enter Filename String to Search: ")
+        if len(self.search_string) < MIN_PATTERN_LENGTH:
+            print("String too short. Please provide a string of at least 3 characters.")
+            self.search_string = ""
+
+    def set_copy_or_move(self):
+        """Prompt user for copying or moving choice."""
+        user_input = input("Would you like to Copy [1] or Move [2] the images?: ")
+        self.copy_or_move = "COPY" if user_input in ['1', 'copy'] else "MOVE"
+
+    def set_recursive(self):
+        """Prompt user for recursive choice."""
+        user_input = input("Process folders recursively? (Y/N): ").lower()
+        self.recursive = user_input in ['y', 'yes']
+
+    def edit_routes(self):
+        """Prompt user to add routes, load a routing table file or clear the table."""
+        for pattern, folder in self.routes:
+            print(f"  {pattern} -> DS_String/{folder}")
+        user_input = input("Add a string [1], Load a routing table file (one 'string,folder' per line) [2] or Clear [3]: ")
+        if user_input == '1':
+            routes = [(input("Enter Filename String: "), input("Folder inside DS_String (empty to use the string): "))]
+        elif user_input == '2':
+            try:
+                routes = load_routes(input("Routing table file: ").strip())
+            except (OSError, csv.Error) as e:
+                print(f"Unable to read routing table: {e}")
+                return
+        elif user_input == '3':
+            self.routes = []
+            return
+        else:
+            print("Invalid option, no changes made.")
+            return
+        too_short = [pattern for pattern, folder in routes if len(pattern) < MIN_PATTERN_LENGTH]
+        if too_short:
+            print(f"Strings too short, no changes made: {', '.join(too_short)}")
+            return
+        self.routes += [(pattern, folder_name(folder or pattern)) for pattern, folder in routes]
+
+    def change_input_dir(self):
+        """Prompt user to change input directory."""
+        new_input_dir = input("Change Input Directory: ")
+        self.set_input_dir(new_input_dir)
+
+    def confirm_and_run(self):
+        """Confirm with the user and run the move/copy operation."""
+        if not self.active_routes():
+            print("Set a Move String or Routing Table first.")
+            return
+        confirm = input("WARNING: Module will move or copy files with supplied string\nDataset Cleaner is experimental and only intended for backed up datasets\nUse only on backed up datasets and use at your own risk\nRun the module? (Y/N) ")
+        if confirm.lower() in ['y', 'yes']:
+            self.move_or_copy_files()
+
+    def run(self):
+        """Main loop to run the module."""
+        while True:
+            self.display_menu()
+            choice = input("Enter your selection: ")
+            if not self.handle_menu_choice(choice):
+                break
+
+# To run the MoveString module
+# if __name__ == '__main__':
+#     mover = MoveString()
+#     mover.run()
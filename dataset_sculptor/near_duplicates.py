@@ -0,0 +1,344 @@
+"""
+Near-duplicate image finder.
+
+Every image gets a 64 bit perceptual hash (dHash or pHash) computed with NumPy over
+batches of small greyscale thumbnails. JPEGs are decoded at reduced scale, so the
+full image is never decoded, and with a catalog the thumbnails come from the shared
+thumbnail cache, so a repeat run decodes nothing. Hashes go into a BK-tree, which only visits the parts
+of the tree within the Hamming radius of a query. Images within the radius of each
+other form a cluster. The largest image of a cluster is kept, and the others within
+the radius of it are reported, tagged with a _DUP label or moved to DS_Duplicates
+together with their captions. Members only chained to it through other images
+(A near B near C) are reported as related and left in place.
+"""
+import csv
+import glob
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from PIL import Image
+from termcolor import colored
+
+from dataset_sculptor import file_ops
+from dataset_sculptor import instrumentation
+from dataset_sculptor import memory_guard
+from dataset_sculptor import progress
+from dataset_sculptor import thumbnails
+
+HASH_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.webp', '.bmp', '.gif', '.tif', '.tiff')
+HASH_TYPES = ('dhash', 'phash')
+PHASH_SIZE = 32  # pHash keeps the 8x8 lowest frequencies of a 32x32 DCT
+DEFAULT_DISTANCE = {'dhash': 6, 'phash': 10}
+HASH_BATCH = 256
+HASH_WORKERS = min(8, os.cpu_count() or 1)
+DUPLICATES_DIR = "DS_Duplicates"
+
+ACTIONS = {1: 'Report only', 2: 'Tag duplicates with _DUP', 3: 'Move duplicates, keep best in place',
+           4: 'Move whole clusters for review'}
+
+
+def load_thumbnail(path, hash_type):
+    """Greyscale thumbnail for hashing plus the full image size and file size."""
+    thumb_size = (9, 8) if hash_type == 'dhash' else (PHASH_SIZE, PHASH_SIZE)
+    thumbnail_cache = thumbnails.current()
+    if thumbnail_cache:
+        thumb, info = thumbnail_cache.get(path)
+        with instrumentation.stage('process'):
+            return thumbnails.grey(thumb, thumb_size), (info['width'], info['height']), info['bytes']
+    with memory_guard.open_image(path) as img:
+        size = img.size
+        # JPEGs decode straight to a reduced scale no smaller than the thumbnail, huge
+        # images of other formats are reduced right after a full decode
+        img.draft('L', thumb_size)
+        with memory_guard.decoding(img, thumb_size, release=True) as decoded:
+            with instrumentation.stage('process'):
+                thumb = decoded.convert('L').resize(thumb_size, Image.BILINEAR, reducing_gap=2.0)
+    return np.asarray(thumb, dtype=np.float32), size, os.path.getsize(path)
+
+
+def _pack(bits):
+    """(N, 64) booleans to a list of 64 bit Python ints."""
+    return np.packbits(bits, axis=1).view('>u8').ravel().tolist()
+
+
+def dhash_batch(thumbs):
+    """dHash of (N, 8, 9) thumbnails: is each pixel brighter than its left neighbour."""
+    bits = thumbs[:, :, 1:] > thumbs[:, :, :-1]
+    return _pack(bits.reshape(len(thumbs), -1))
+
+
+def _dct_matrix(n):
+    k = np.arange(n)[:, None]
+    i = np.arange(n)[None, :]
+    matrix = np.cos(np.pi * (2 * i + 1) * k / (2 * n)) * np.sqrt(2.0 / n)
+    matrix[0] /= np.sqrt(2.0)
+    return matrix.astype(np.float32)
+
+
+DCT_MATRIX = _dct_matrix(PHASH_SIZE)
+
+
+def phash_batch(thumbs):
+    """pHash of (N, 32, 32) thumbnails: low DCT frequencies above their median."""
+    coefficients = DCT_MATRIX @ thumbs @ DCT_MATRIX.T
+    low = coefficients[:, :8, :8].reshape(len(thumbs), -1)
+    # The DC term only says how bright the image is, leave it out of the median
+    median = np.median(low[:, 1:], axis=1, keepdims=True)
+    return _pack(low > median)
+
+
+def hamming(a, b):
+    return bin(a ^ b).count('1')
+
+
+class BKTree:
+    """Metric tree over 64 bit hashes. Nodes are [hash, items, {distance: child}]."""
+
+    def __init__(self):
+        self.root = None
+
+    def add(self, value, item):
+        if self.root is None:
+            self.root = [value, [item], {}]
+            return
+        node = self.root
+        while True:
+            distance = hamming(value, node[0])
+            if distance == 0:
+                node[1].append(item)
+                return
+            child = node[2].get(distance)
+            if child is None:
+                node[2][distance] = [value, [item], {}]
+                return
+            node = child
+
+    def query(self, value, radius):
+        """All (item, distance) within radius of value."""
+        found = []
+        stack = [self.root] if self.root else []
+        while stack:
+            node = stack.pop()
+            distance = hamming(value, node[0])
+            if distance <= radius:
+                found.extend((item, distance) for item in node[1])
+            # Triangle inequality: only subtrees at distance d +- radius can hold matches
+            for child_distance, child in node[2].items():
+                if distance - radius <= child_distance <= distance + radius:
+                    stack.append(child)
+        return found
+
+
+class NearDuplicates:
+
+    def __init__(self, input_dir, output_dir):
+        self.input_dir = input_dir
+        self.output_dir = output_dir
+        self.hash_type = 'phash'
+        self.max_distance = DEFAULT_DISTANCE['phash']
+        self.action = 1
+        self.recursive = False
+
+    def set_input_dir(self, input_dir):
+        if os.path.isdir(input_dir):
+            self.input_dir = input_dir
+        else:
+            print("Not valid, no changes made")
+
+    def set_output_dir(self, output_dir):
+        if os.path.isdir(output_dir):
+            self.output_dir = output_dir
+        else:
+            print("Not valid, no changes made")
+
+    def display_menu(self):
+        print(colored(f'''
+    Current Input Directory: {self.input_dir}
+    Current Output Directory: {self.output_dir}
+    ┌──────────────────────────────────────────────────────────────────────────────┐
+    |                         NEAR-DUPLICATE IMAGES MODULE                         |
+    |------------------------------------------------------------------------------|
+    |                                                                              |
+    |              Settings                                                        |
+    |                                                                              |
+    |          1 - Hash ({self.hash_type})
+    |          2 - Maximum Hamming Distance ({self.max_distance} of 64 bits)
+    |          3 - Action ({ACTIONS[self.action]})
+    |          4 - Recursive ({'On' if self.recursive else 'Off'})
+    |                                                                              |
+    └──────────────────────────────────────────────────────────────────────────────┘
+    |      I - Set Input     O - Set Output     R - Run     X - Exit to Menu       |
+    └──────────────────────────────────────────────────────────────────────────────┘
+    ''', 'light_magenta'))
+
+        print("Module finds resized, recompressed and lightly edited copies of the same image")
+        print("pHash is more robust to edits, dHash is faster and stricter")
+        print("A higher distance finds more duplicates, with more false positive potential")
+        print("The largest image of each cluster is kept, a report is always saved to DS_Duplicates")
+        print("Only images within the distance of the kept image are tagged or moved, others in its cluster are reported")
+        print("Tag adds a _DUP label to the duplicate and its caption, Move relocates image-caption pairs to DS_Duplicates")
+        print("Recursive ON processes subfolders of the input directory\n")
+
+    def list_images(self):
+        pattern = '/**/*.*' if self.recursive else '/*.*'
+        return [filename for filename in glob.glob(self.input_dir.rstrip('/') + pattern, recursive=self.recursive)
+                if filename.lower().endswith(HASH_EXTENSIONS)
+                and DUPLICATES_DIR not in os.path.relpath(filename, self.input_dir).split(os.sep)]
+
+    def hash_images(self, filenames, bar):
+        """Returns (paths, hashes, sizes, file sizes) for every image that could be read."""
+        hash_batch = dhash_batch if self.hash_type == 'dhash' else phash_batch
+        paths, hashes, sizes, file_sizes = [], [], [], []
+
+        def load(path):
+            try:
+                return path, load_thumbnail(path, self.hash_type)
+            except Exception as e:
+                return path, e
+
+        with ThreadPoolExecutor(max_workers=HASH_WORKERS) as pool:
+            for start in range(0, len(filenames), HASH_BATCH):
+                thumbs = []
+                for path, result in pool.map(load, filenames[start:start + HASH_BATCH]):
+                    bar.advance()
+                    if isinstance(result, Exception):
+                        bar.error(f"Unable to hash image {path}: {result}", path)
+                        continue
+                    thumbs.append(result[0])
+                    paths.append(path)
+                    sizes.append(result[1])
+                    file_sizes.append(result[2])
+                if thumbs:
+                    with instrumentation.stage('process'):
+                        hashes.extend(hash_batch(np.stack(thumbs)))
+        return paths, hashes, sizes, file_sizes
+
+    def find_clusters(self, hashes):
+        """
+        Group indexes of hashes within max_distance of each other. Returns clusters of 2 or
+        more. Clusters are chained, two members can be further apart than max_distance.
+        """
+        parent = list(range(len(hashes)))
+
+        def find(i):
+            while parent[i] != i:
+                parent[i] = parent[parent[i]]
+                i = parent[i]
+            return i
+
+        tree = BKTree()
+        for i, value in enumerate(hashes):
+            for j, distance in tree.query(value, self.max_distance):
+                root_i, root_j = find(i), find(j)
+                if root_i != root_j:
+                    parent[root_i] = root_j
+            tree.add(value, i)
+
+        groups = {}
+        for i in range(len(hashes)):
+            groups.setdefault(find(i), []).append(i)
+        return [members for members in groups.values() if len(members) > 1]
+
+    def move_pair(self, path, destination_dir, bar, action):
+        destination = file_ops.pair(path, destination_dir, 'move')
+        bar.file(path, action, destination=destination)
+        return destination
+
+    def tag_pair(self, path, bar):
+        base, extension = os.path.splitext(path)
+        if base.endswith('_DUP'):
+            return path
+        destination = file_ops.unique_pair_path(f"{base}_DUP{extension}")
+        with instrumentation.stage('move'):
+            os.rename(path, destination)
+            if os.path.isfile(base + '.txt'):
+                os.rename(base + '.txt', os.path.splitext(destination)[0] + '.txt')
+        bar.file(path, 'tagged', destination=destination)
+        return destination
+
+    def find_duplicates(self):
+        filenames = self.list_images()
+        with progress.Progress("Near-Duplicates", total=len(filenames)) as bar:
+            paths, hashes, sizes, file_sizes = self.hash_images(filenames, bar)
+            with instrumentation.stage('index'):
+                clusters = self.find_clusters(hashes)
+
+            report_dir = os.path.join(self.output_dir, DUPLICATES_DIR)
+            os.makedirs(report_dir, exist_ok=True)
+            report_path = os.path.join(report_dir, f"near_duplicates_{self.hash_type}.csv")
+            duplicates = 0
+            with open(report_path, 'w', newline='', encoding='utf-8') as f:
+                writer = csv.writer(f)
+                writer.writerow(['cluster', 'role', 'path', 'distance_to_kept', 'width', 'height', 'bytes', 'new_path'])
+                for number, members in enumerate(clusters, 1):
+                    # Keep the most pixels, then the largest file as the least compressed copy
+                    members.sort(key=lambda i: (sizes[i][0] * sizes[i][1], file_sizes[i]), reverse=True)
+                    kept = members[0]
+                    cluster_dir = os.path.join(report_dir, f"cluster_{number:05d}")
+                    for i in members:
+                        distance = hamming(hashes[i], hashes[kept])
+                        # Only near copies of the kept image are acted on, not the whole chain
+                        role = 'kept' if i == kept else 'duplicate' if distance <= self.max_distance else 'related'
+                        new_path = paths[i]
+                        if self.action == 2 and role == 'duplicate':
+                            new_path = self.tag_pair(paths[i], bar)
+                        elif self.action == 3 and role == 'duplicate':
+                            new_path = self.move_pair(paths[i], cluster_dir, bar, 'moved')
+                        elif self.action == 4 and role != 'related':
+                            new_path = self.move_pair(paths[i], cluster_dir, bar, 'moved')
+                        duplicates += role == 'duplicate'
+                        writer.writerow([number, role, paths[i], distance,
+                                         sizes[i][0], sizes[i][1], file_sizes[i], new_path])
+
+        print(f"Total images hashed: {len(paths)}")
+        print(f"Total duplicate clusters: {len(clusters)}")
+        print(f"Total duplicates: {duplicates}")
+        print(f"Report saved to: {report_path}")
+        return clusters
+
+    def run(self):
+        while True:
+            self.display_menu()
+            choice = input("Enter your selection: ")
+
+            if choice == '1':
+                hash_type = input("Hash to use (dhash/phash): ").strip().lower()
+                if hash_type in HASH_TYPES:
+                    # The distance scale differs per hash, so start from its default again
+                    self.hash_type = hash_type
+                    self.max_distance = DEFAULT_DISTANCE[hash_type]
+                else:
+                    print("Not a valid hash. No changes made.")
+            elif choice == '2':
+                distance = input("Maximum Hamming distance (0-32): ").strip()
+                if distance.isdigit() and int(distance) <= 32:
+                    self.max_distance = int(distance)
+                else:
+                    print("Invalid input. Please enter a number from 0 to 32.")
+            elif choice == '3':
+                action = input("Report only [1], Tag [2], Move duplicates [3] or Move whole clusters [4]: ").strip()
+                if action.isdigit() and int(action) in ACTIONS:
+                    self.action = int(action)
+                else:
+                    print("Invalid option, no changes made.")
+            elif choice == '4':
+                user_input = input("Process folders recursively? (Y/N)").lower()
+                self.recursive = user_input in ['y', 'yes']
+            elif choice.lower() == 'i':
+                new_input_dir = input("Change Input Directory: ")
+                self.set_input_dir(new_input_dir)
+            elif choice.lower() == 'o':
+                new_output_dir = input("Change Output Directory: ")
+                self.set_output_dir(new_output_dir)
+            elif choice.lower() == 'r':
+                if self.action == 1:
+                    self.find_duplicates()
+                    continue
+                confirm = input("WARNING: Module will rename or move duplicate images and their captions\nDataset Sculptor is experimental and only intended for backed up datasets\nUse only on backed up datasets and at your own risk\nRun the module? (Y/N) ")
+                if confirm.lower() in ['y', 'yes']:
+                    self.find_duplicates()
+            elif choice.lower() == 'x':
+                break
+            else:
+                print("Invalid choice. Please choose a valid option or press 'x' to exit.")
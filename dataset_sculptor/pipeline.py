@@ -0,0 +1,483 @@
+"""
+Non-interactive pipeline mode.
+
+Chains existing operations as stages that all run in a single pass over the dataset.
+Each image is opened once and the in-memory image is handed from stage to stage,
+then written once at the end, instead of every module decoding and re-encoding
+every image in its own pass.
+
+The pipeline is driven by a JSON config file:
+
+    {
+        "input_dir": "C:/Training_DS/Input",
+        "output_dir": "C:/Training_DS/Output",
+        "recursive": true,
+        "stages": [
+            {"stage": "delete_small", "min_image_length": 512, "delete_orphan_captions": true},
+            {"stage": "reduce", "max_image_length": 2048},
+            {"stage": "convert", "target_filetype": ".png"},
+            {"stage": "bw_tag", "mse_cutoff": 22, "label_filename": true, "append_caption": 1, "move_or_copy": 2},
+            {"stage": "bucket", "base_resolution": 1024, "resize": true, "place": true}
+        ]
+    }
+
+Run it with:
+
+    python dataset_sculptor.py --pipeline config.json
+
+input_dir can also be a .zip or .tar (.tar.gz, .tar.bz2, .tar.xz) archive. Its pairs are
+read in one sequential pass without extracting anything, and the pairs that are kept
+go to a new archive of the same type, output_archive or by default
+<output_dir>/<name>_sculpted.<extension>. Folders the stages send pairs to, such as
+DS_Monochrome, become folders inside it. With "write_archive": false the stages only
+report.
+"""
+import argparse
+import collections
+import contextlib
+import csv
+import json
+import os
+
+from PIL import Image
+from termcolor import colored
+
+from dataset_sculptor import archive_io
+from dataset_sculptor import file_ops
+from dataset_sculptor import instrumentation
+from dataset_sculptor import memory_guard
+from dataset_sculptor import progress
+from dataset_sculptor.aspect_buckets import AspectBuckets, BucketSet, BUCKETS_DIR, MANIFEST_FILE, fit_to_bucket, parse_buckets
+from dataset_sculptor.delete_small_images import DeleteSmallImages
+from dataset_sculptor.image_converter import ImageConverter, SUPPORTED_FILETYPES, prepare_for_filetype
+from dataset_sculptor.move_bw_images import BWImageMenu, CAPTION_LABELS
+from dataset_sculptor.reduce_img import ReduceImage
+
+PIPELINE_EXTENSIONS = tuple('.' + filetype.lower() for filetype in SUPPORTED_FILETYPES)
+
+
+class PipelineItem:
+    """One image travelling through the stages, with everything they decided so far."""
+
+    def __init__(self, path, img):
+        self.path = path
+        self.source = img  # the opened file, closed before the original is removed or moved
+        self.img = img
+        self.caption_path = os.path.splitext(path)[0] + ".txt"
+        self.target_dir = os.path.dirname(path)
+        self.target_base, self.target_ext = os.path.splitext(os.path.basename(path))
+        self.modified = False  # pixels or format changed, the image has to be encoded again
+        self.deleted = False
+        self.copy = False  # write the result to target_dir and leave the original in place
+        self.caption_append = None
+
+    def target_path(self, extension=None):
+        return os.path.join(self.target_dir, self.target_base + (extension or self.target_ext))
+
+
+class DeleteSmallStage:
+    name = 'delete_small'
+    needs_pixels = False
+
+    def __init__(self, config, pipeline):
+        self.module = DeleteSmallImages()
+        self.module.min_image_length = config.get('min_image_length', self.module.min_image_length)
+        self.module.delete_orphan_captions = config.get('delete_orphan_captions', self.module.delete_orphan_captions)
+        self.deleted = 0
+
+    def process(self, item):
+        # Only needs the header, the pixels are never decoded for small images
+        width, height = item.img.size
+        if min(width, height) < self.module.min_image_length:
+            item.deleted = True
+            self.deleted += 1
+
+    def summary(self):
+        return f"Total images deleted: {self.deleted}"
+
+
+class ReduceStage:
+    name = 'reduce'
+    needs_pixels = True
+
+    def __init__(self, config, pipeline):
+        self.module = ReduceImage()
+        self.module.max_image_length = config.get('max_image_length', self.module.max_image_length)
+        self.resized = 0
+
+    def process(self, item):
+        width, height = item.img.size
+        if max(width, height) > self.module.max_image_length:
+            item.img = item.img.resize(self.module.reduced_size(width, height), Image.LANCZOS)
+            item.modified = True
+            self.resized += 1
+
+    def summary(self):
+        return f"Total images resized: {self.resized}"
+
+
+class ConvertStage:
+    name = 'convert'
+    needs_pixels = True
+
+    def __init__(self, config, pipeline):
+        self.module = ImageConverter(pipeline.input_dir, pipeline.output_dir)
+        self.module.target_filetype = config.get('target_filetype', self.module.target_filetype).lower()
+        if self.module.target_filetype[1:] not in SUPPORTED_FILETYPES:
+            raise ValueError(f"Unsupported target filetype: {self.module.target_filetype}")
+        self.converted = 0
+
+    def process(self, item):
+        if item.target_ext.lower() != self.module.target_filetype:
+            item.target_ext = self.module.target_filetype
+            item.img = prepare_for_filetype(item.img, self.module.target_filetype)
+            item.modified = True
+            self.converted += 1
+
+    def summary(self):
+        return f"Total images converted: {self.converted}"
+
+
+class BWTagStage:
+    name = 'bw_tag'
+    needs_pixels = True
+
+    def __init__(self, config, pipeline):
+        self.module = BWImageMenu({
+            "INPUT_DIR": pipeline.input_dir,
+            "OUTPUT_DIR": pipeline.output_dir,
+            "MSE_CUTOFF": config.get('mse_cutoff', 22),
+            "LABEL_FILENAME": config.get('label_filename', False),
+            "APPEND_CAPTION": config.get('append_caption'),
+            "MOVE_OR_COPY": config.get('move_or_copy'),
+            "RECURSIVE": pipeline.recursive,
+        })
+        self.output_dir = pipeline.output_dir
+        self.affected = 0
+
+    def process(self, item):
+        if not self.module.is_bw_image(item.img, MSE_cutoff=self.module.mse_cutoff):
+            return
+        if self.module.should_label_filename and not item.target_base.endswith('_BW'):
+            item.target_base += '_BW'
+        if self.module.append_caption:
+            item.caption_append = CAPTION_LABELS[self.module.append_caption]
+        if self.module.copy_or_move in (1, 2):
+            item.target_dir = os.path.join(self.output_dir, 'DS_Monochrome')
+            item.copy = self.module.copy_or_move == 1
+        self.affected += 1
+
+    def summary(self):
+        return f"Total black and white images: {self.affected}"
+
+
+class BucketStage:
+    """Best placed last, the manifest records the output path the earlier stages decided on."""
+    name = 'bucket'
+
+    def __init__(self, config, pipeline):
+        self.module = AspectBuckets(pipeline.input_dir, pipeline.output_dir)
+        self.module.base_resolution = config.get('base_resolution', self.module.base_resolution)
+        if config.get('buckets'):
+            buckets = config['buckets']
+            self.module.custom_buckets = parse_buckets(buckets if isinstance(buckets, str) else ','.join(buckets))
+        self.module.resize = config.get('resize', self.module.resize)
+        self.place = config.get('place', False)
+        self.needs_pixels = self.module.resize and self.place
+        self.bucket_set = BucketSet(self.module.buckets())
+        self.output_dir = pipeline.output_dir
+        self.counts = collections.Counter()
+
+        report_dir = os.path.join(self.output_dir, BUCKETS_DIR)
+        os.makedirs(report_dir, exist_ok=True)
+        self.manifest_path = os.path.join(report_dir, MANIFEST_FILE)
+        self.manifest = open(self.manifest_path, 'w', newline='', encoding='utf-8')
+        self.writer = csv.writer(self.manifest)
+        self.writer.writerow(['path', 'width', 'height', 'bucket_width', 'bucket_height', 'output'])
+
+    def process(self, item):
+        width, height = item.img.size
+        bucket = self.bucket_set.nearest(width, height)
+        output = ''
+        if self.place:
+            if self.module.resize and (width, height) != bucket:
+                item.img = fit_to_bucket(item.img, bucket)
+                item.modified = True
+            item.target_dir = os.path.join(self.output_dir, BUCKETS_DIR, f"{bucket[0]}x{bucket[1]}")
+            output = item.target_path()
+        self.writer.writerow([item.path, width, height, bucket[0], bucket[1], output])
+        self.counts[bucket] += 1
+
+    def summary(self):
+        self.manifest.close()
+        return f"Total images bucketed: {sum(self.counts.values())} into {len(self.counts)} buckets, manifest: {self.manifest_path}"
+
+
+STAGES = {stage.name: stage for stage in (DeleteSmallStage, ReduceStage, ConvertStage, BWTagStage, BucketStage)}
+
+
+class Pipeline:
+
+    def __init__(self, config):
+        self.config = config
+        self.input_dir = config['input_dir']
+        self.archive = self.input_dir if archive_io.is_archive(self.input_dir) else None
+        self.output_dir = config.get('output_dir') or (os.path.dirname(os.path.abspath(self.archive)) if self.archive else self.input_dir)
+        self.recursive = config.get('recursive', False)
+        self.stages = []
+        for stage_config in config['stages']:
+            if stage_config.get('stage') not in STAGES:
+                raise ValueError(f"Unknown stage {stage_config.get('stage')}. Choose from: {', '.join(STAGES)}")
+            self.stages.append(STAGES[stage_config['stage']](stage_config, self))
+        self.processed = 0
+        self.failures = 0
+
+    def iter_files(self):
+        for root, dirs, files in os.walk(self.input_dir):
+            # Never walk into folders the pipeline itself writes to
+            dirs[:] = [d for d in dirs if not d.startswith('DS_')]
+            for filename in files:
+                yield os.path.join(root, filename)
+            if not self.recursive:
+                break
+
+    def run_stages(self, item, decodes):
+        """
+        Pass item through the stages. Its pixels are decoded within the memory budgets
+        when the first stage needs them, held until decodes exits. When that stage is
+        a reduce stage, huge images are decoded at a reduced scale it still covers.
+        """
+        decoded = False
+        for stage in self.stages:
+            if stage.needs_pixels and not decoded:
+                size = item.img.size
+                min_size = stage.module.reduced_size(*size) if isinstance(stage, ReduceStage) else None
+                item.img = decodes.enter_context(memory_guard.decoding(item.img, min_size, release=True))
+                if item.img.size != size:
+                    # The file's pixels are no longer what is held, it has to be encoded again
+                    item.modified = True
+                decoded = True
+            with instrumentation.stage(stage.name):
+                stage.process(item)
+            if item.deleted:
+                break
+
+    def finish(self, item, bar):
+        """Apply everything the stages decided with as few writes as possible."""
+        if item.deleted:
+            item.source.close()
+            with instrumentation.stage('move'):
+                os.remove(item.path)
+            bar.file(item.path, 'deleted')
+            return
+
+        target = item.target_path()
+        if target != item.path:
+            file_ops.ensure_dir(os.path.dirname(target))
+
+        if item.modified:
+            # The only encode of the run
+            instrumentation.save_image(item.img, target)
+            in_place = target
+            if item.copy:
+                # Copying keeps the processed image in place too, as running the modules one by one would
+                in_place = os.path.splitext(item.path)[0] + item.target_ext
+                if in_place != target:
+                    instrumentation.save_image(item.img, in_place)
+            item.source.close()
+            if in_place != item.path:
+                with instrumentation.stage('move'):
+                    os.remove(item.path)
+        else:
+            item.source.close()
+            if target != item.path:
+                file_ops.transfer(item.path, target, 'copy' if item.copy else 'move')
+
+        if os.path.isfile(item.caption_path):
+            caption_target = item.target_path('.txt')
+            if caption_target != item.caption_path:
+                file_ops.transfer(item.caption_path, caption_target, 'copy' if item.copy else 'move')
+            if item.caption_append:
+                with open(caption_target, "a") as file:
+                    file.write(f", {item.caption_append}")
+
+        if target != item.path or item.modified:
+            bar.file(item.path, 'copied' if item.copy else 'written', output=target, modified=item.modified)
+
+    def delete_orphan_captions(self, captions, image_stems, bar):
+        deleted = 0
+        for caption in captions:
+            if os.path.splitext(caption)[0] not in image_stems and os.path.isfile(caption):
+                with instrumentation.stage('move'):
+                    os.remove(caption)
+                bar.file(caption, 'deleted_orphan_caption')
+                deleted += 1
+        bar.message(f'Total captions deleted: {deleted}')
+
+    def archive_name(self, item, extension=None):
+        """Member name in the output archive, folders under output_dir the stages chose become folders in the archive."""
+        target_dir = item.target_dir
+        if os.path.isabs(target_dir):
+            target_dir = os.path.relpath(target_dir, self.output_dir)
+        return os.path.normpath(os.path.join(target_dir, item.target_base + (extension or item.target_ext)))
+
+    def finish_archive(self, item, pair, writer, bar, released):
+        """finish() for an item read from an archive, the kept pair goes to writer."""
+        if item.deleted:
+            bar.file(item.path, 'deleted')
+            return
+        data = instrumentation.encode_image(item.img, item.target_ext) if item.modified else pair.image
+        target = writer.unique_name(self.archive_name(item)) if writer else self.archive_name(item)
+        outputs = [(target, pair.caption and (pair.caption + (f", {item.caption_append}" if item.caption_append else '')))]
+        if item.copy:
+            # Copying keeps the pair at its own place too, as in a folder
+            original = writer.unique_name(os.path.splitext(item.path)[0] + item.target_ext) if writer else item.path
+            outputs.append((original, pair.caption))
+        if writer:
+            for name, caption in outputs:
+                writer.add(name, data)
+                if caption is not None:
+                    writer.add(os.path.splitext(name)[0] + '.txt', caption)
+        if pair.caption is None:
+            # The caption may still come later in the archive, it goes where the image went
+            released[pair.stem] = (os.path.splitext(target)[0] + '.txt', item.caption_append)
+        bar.file(item.path, 'copied' if item.copy else 'written', output=target, modified=item.modified)
+
+    def run_archive(self):
+        """run() over the pairs of an archive, writing the kept pairs to a new archive."""
+        output_path = None
+        if self.config.get('write_archive', True):
+            output_path = self.config.get('output_archive') or os.path.join(
+                self.output_dir, archive_io.archive_stem(self.archive) + '_sculpted' + archive_io.archive_extension(self.archive))
+            os.makedirs(os.path.dirname(os.path.abspath(output_path)), exist_ok=True)
+        delete_small = next((stage for stage in self.stages if isinstance(stage, DeleteSmallStage)), None)
+        delete_orphans = delete_small and delete_small.module.delete_orphan_captions
+        released = {}
+        orphans = 0
+
+        with progress.Progress("Pipeline", log_name='pipeline') as bar, \
+                (archive_io.ArchiveWriter(output_path) if output_path else contextlib.nullcontext()) as writer:
+            for pair in archive_io.read_pairs(self.archive):
+                bar.advance()
+                if pair.image_name is None:
+                    if pair.late:
+                        name, append = released.pop(pair.stem, (None, None))
+                        if name and writer:
+                            writer.add(name, pair.caption + (f", {append}" if append else ''))
+                    elif delete_orphans:
+                        bar.file(pair.caption_name, 'deleted_orphan_caption')
+                        orphans += 1
+                    elif writer:
+                        writer.add(writer.unique_name(pair.caption_name), pair.caption)
+                    continue
+
+                img = None
+                try:
+                    img = memory_guard.open_image_bytes(pair.image)
+                    item = PipelineItem(pair.image_name, img)
+                    with contextlib.ExitStack() as decodes:
+                        self.run_stages(item, decodes)
+                        self.finish_archive(item, pair, writer, bar, released)
+                    self.processed += 1
+                except Exception as e:
+                    self.failures += 1
+                    bar.error(f"Error processing file {pair.image_name}: {e}", pair.image_name)
+                    # Like a folder run leaves a failed file where it is, the pair is kept unchanged
+                    if writer:
+                        name = writer.unique_name(pair.image_name)
+                        writer.add(name, pair.image)
+                        if pair.caption is not None:
+                            writer.add(os.path.splitext(name)[0] + '.txt', pair.caption)
+                        else:
+                            released[pair.stem] = (os.path.splitext(name)[0] + '.txt', None)
+                finally:
+                    if img:
+                        img.close()
+            if delete_orphans:
+                bar.message(f'Total captions deleted: {orphans}')
+
+        if output_path:
+            print(f'Output archive: {output_path}')
+        self.print_summary()
+
+    def print_summary(self):
+        print(f'Total images processed: {self.processed}')
+        for stage in self.stages:
+            print(stage.summary())
+        if self.failures:
+            print(colored(f'Total failures: {self.failures}', 'red'))
+
+    def run(self):
+        if self.archive:
+            self.run_archive()
+            return
+        captions = []
+        image_stems = set()
+        paths = list(self.iter_files())
+        with progress.Progress("Pipeline", total=len(paths)) as bar:
+            for path in paths:
+                bar.advance()
+                lower = path.lower()
+                if lower.endswith('.txt'):
+                    captions.append(path)
+                    continue
+                if not lower.endswith(PIPELINE_EXTENSIONS):
+                    image_stems.add(os.path.splitext(path)[0])
+                    continue
+
+                img = None
+                try:
+                    img = memory_guard.open_image(path)
+                    item = PipelineItem(path, img)
+                    with contextlib.ExitStack() as decodes:
+                        self.run_stages(item, decodes)
+                        self.finish(item, bar)
+                    if not item.deleted:
+                        image_stems.add(os.path.splitext(item.target_path())[0])
+                    self.processed += 1
+                except Exception as e:
+                    self.failures += 1
+                    image_stems.add(os.path.splitext(path)[0])
+                    bar.error(f"Error processing file {path}: {e}", path)
+                finally:
+                    if img:
+                        img.close()
+
+            delete_small = next((stage for stage in self.stages if isinstance(stage, DeleteSmallStage)), None)
+            if delete_small and delete_small.module.delete_orphan_captions:
+                self.delete_orphan_captions(captions, image_stems, bar)
+
+        self.print_summary()
+
+
+def load_config(path, input_dir=None, output_dir=None):
+    with open(path, 'r', encoding='utf-8') as f:
+        config = json.load(f)
+    # Command line directories override the config file
+    if input_dir:
+        config['input_dir'] = input_dir
+    if output_dir:
+        config['output_dir'] = output_dir
+    if not config.get('input_dir'):
+        raise ValueError("The pipeline config needs an input_dir")
+    return config
+
+
+def run_pipeline(config_path, input_dir=None, output_dir=None):
+    pipeline = Pipeline(load_config(config_path, input_dir, output_dir))
+    pipeline.run()
+    return pipeline
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Dataset Sculptor pipeline')
+    parser.add_argument('config', type=str, help='Pipeline config file (JSON)')
+    parser.add_argument('--input_dir', type=str, default=None, help='Overrides input_dir from the config')
+    parser.add_argument('--output_dir', type=str, default=None, help='Overrides output_dir from the config')
+    args = parser.parse_args()
+
+    run_pipeline(args.config, args.input_dir, args.output_dir)
+
+
+if __name__ == "__main__":
+    main()
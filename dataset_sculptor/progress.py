@@ -0,0 +1,181 @@
+"""
+Progress reporting and per-file logging shared by all modules.
+
+Instead of printing lines for every file, a module opens a Progress for its run,
+reports each file it finishes with advance() and each thing it did to a file with
+file(). The terminal gets one progress line with throughput and ETA, refreshed at
+most a few times per second, while the per-file records go to a JSON lines log in
+Output/DS_Logs, written in batches. Errors are printed right away.
+
+    with progress.Progress("Reduce", total=len(files)) as bar:
+        for filename in files:
+            ...
+            bar.file(filename, 'resized', size=[width, height])
+            bar.advance()
+"""
+import json
+import os
+import sys
+import time
+
+from termcolor import colored
+
+LOG_DIR = "DS_Logs"
+REFRESH_INTERVAL = 0.2  # seconds between progress line redraws on a terminal
+PLAIN_INTERVAL = 10.0  # seconds between progress lines when output is redirected
+LOG_BATCH = 1000  # records buffered before the log is written
+LOG_FLUSH_INTERVAL = 5.0
+
+_settings = {'quiet': False, 'log_dir': None}
+_active = []
+
+
+def configure(quiet=None, log_dir=None):
+    """Quiet mode hides the progress line. log_dir is where the per-file logs go, None to keep no log."""
+    if quiet is not None:
+        _settings['quiet'] = quiet
+    _settings['log_dir'] = log_dir
+
+
+def default_log_dir(output_dir):
+    return os.path.join(output_dir, LOG_DIR) if output_dir else None
+
+
+def _format_duration(seconds):
+    seconds = int(seconds)
+    hours, seconds = divmod(seconds, 3600)
+    minutes, seconds = divmod(seconds, 60)
+    return f"{hours}:{minutes:02d}:{seconds:02d}" if hours else f"{minutes}:{seconds:02d}"
+
+
+class Progress:
+
+    def __init__(self, label, total=None, log_name=None, stream=None):
+        self.label = label
+        self.total = total
+        self.done = 0
+        self.errors = 0
+        self.stream = stream or sys.stdout
+        self.quiet = _settings['quiet']
+        self.tty = hasattr(self.stream, 'isatty') and self.stream.isatty()
+        self.started = time.perf_counter()
+        self.last_refresh = 0.0
+        self.line_width = 0
+
+        self.records = []
+        self.last_flush = self.started
+        self.log_path = None
+        if _settings['log_dir']:
+            os.makedirs(_settings['log_dir'], exist_ok=True)
+            name = log_name or label.lower().replace(' ', '_')
+            self.log_path = os.path.join(_settings['log_dir'], f"{name}_{time.strftime('%Y%m%d_%H%M%S')}.jsonl")
+        _active.append(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        self.close()
+
+    def set_total(self, total):
+        self.total = total
+
+    def file(self, path, event, **info):
+        """Record what happened to one file. Goes to the log only, never to the terminal."""
+        if self.log_path is None:
+            return
+        record = {'time': round(time.time(), 3), 'event': event, 'path': path}
+        record.update(info)
+        self.records.append(record)
+        if len(self.records) >= LOG_BATCH or time.perf_counter() - self.last_flush >= LOG_FLUSH_INTERVAL:
+            self.flush()
+
+    def flush(self):
+        if self.records and self.log_path:
+            with open(self.log_path, 'a', encoding='utf-8') as f:
+                f.write(''.join(json.dumps(record) + "\n" for record in self.records))
+        self.records = []
+        self.last_flush = time.perf_counter()
+
+    def advance(self, amount=1):
+        self.done += amount
+        now = time.perf_counter()
+        if now - self.last_refresh >= (REFRESH_INTERVAL if self.tty else PLAIN_INTERVAL):
+            self.refresh(now)
+
+    def line(self, now=None):
+        elapsed = (now or time.perf_counter()) - self.started
+        rate = self.done / elapsed if elapsed > 0 else 0.0
+        if self.total:
+            text = f"{self.label}: {self.done:,}/{self.total:,} ({100.0 * self.done / self.total:.1f}%) | {rate:.1f} files/s"
+            if rate > 0 and self.done < self.total:
+                text += f" | ETA {_format_duration((self.total - self.done) / rate)}"
+        else:
+            text = f"{self.label}: {self.done:,} files | {rate:.1f} files/s"
+        if self.errors:
+            text += f" | {self.errors} errors"
+        return text
+
+    def refresh(self, now=None):
+        self.last_refresh = now or time.perf_counter()
+        if self.quiet:
+            return
+        text = self.line(now)
+        if self.tty:
+            self.stream.write("\r" + text.ljust(self.line_width))
+            self.line_width = len(text)
+        else:
+            self.stream.write(text + "\n")
+        self.stream.flush()
+
+    def clear(self):
+        if self.line_width:
+            self.stream.write("\r" + " " * self.line_width + "\r")
+            self.line_width = 0
+
+    def message(self, text):
+        """Print a line above the progress line, e.g. a setting or a summary."""
+        self.clear()
+        print(text, file=self.stream)
+
+    def error(self, text, path=None, **info):
+        """Count and show an error right away, quiet mode or not, and log it."""
+        self.errors += 1
+        self.clear()
+        print(colored(text, 'red'), file=self.stream)
+        self.file(path, 'error', message=text, **info)
+        self.flush()
+        self.last_refresh = 0.0
+
+    def close(self):
+        if self in _active:
+            _active.remove(self)
+        self.flush()
+        if not self.quiet:
+            self.clear()
+            elapsed = time.perf_counter() - self.started
+            print(f"{self.line()} | {_format_duration(elapsed)}", file=self.stream)
+        if self.log_path and os.path.isfile(self.log_path):
+            print(f"Per-file log: {self.log_path}", file=self.stream)
+
+
+def current():
+    """The innermost running Progress, or None."""
+    return _active[-1] if _active else None
+
+
+def file_event(path, event, **info):
+    """file() on the running Progress, for helpers that don't get one passed in."""
+    bar = current()
+    if bar:
+        bar.file(path, event, **info)
+    elif not _settings['quiet']:
+        print(f"{event}: {path}")
+
+
+def error(text, path=None, **info):
+    bar = current()
+    if bar:
+        bar.error(text, path, **info)
+    else:
+        print(colored(text, 'red'))
@@ -0,0 +1,420 @@
+"""
+Fast image quality metrics.
+
+A classical alternative to Advanced Quality Analysis for the common cases: instead
+of asking BLIP about every image, each image is decoded at a reduced scale (JPEGs
+decode only their luma at 1/2, 1/4 or 1/8 scale) and scored with NumPy:
+
+- sharpness: variance of the Laplacian, low for blurry images
+- clipping: percentage of pixels crushed to black or blown to white
+- noise: standard deviation of the noise (Immerkaer's estimator)
+- blockiness: how much stronger edges are on the JPEG 8x8 grid than between it,
+  1.0 for none, only measured while the grid survives the reduced decode
+- contrast: standard deviation of the luminance
+
+After the reduced decode every image is resized to the same analysis scale, its
+shorter side ANALYSIS_SIDE pixels, so scores compare across resolutions; smaller
+images are scored as they are. Images are split into chunks across a process pool. Every score goes to
+DS_LowQuality/quality_metrics.csv, and images failing a threshold can be labelled
+with _XQ or moved to DS_LowQuality with their captions, like Advanced Quality does.
+
+    python -m dataset_sculptor.quality_metrics --input_dir /data/in --recursive --min_sharpness 80 --move
+"""
+import argparse
+import csv
+import glob
+import os
+import shutil
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from PIL import Image
+from termcolor import colored
+
+from dataset_sculptor import file_ops
+from dataset_sculptor import instrumentation
+from dataset_sculptor import memory_guard
+from dataset_sculptor import progress
+from dataset_sculptor.delete_small_images import SUPPORTED_FORMATS
+
+QUALITY_DIR = "DS_LowQuality"
+REPORT_FILE = "quality_metrics.csv"
+LABEL = "_XQ"
+ANALYSIS_SIDE = 512  # shorter side images are scored at
+CHUNK_SIZE = 64  # images per worker task
+QUALITY_WORKERS = os.cpu_count() or 4
+CLIP_LOW = 2  # luminance at or below counts as crushed to black
+CLIP_HIGH = 253  # and at or above as blown to white
+JPEG_BLOCK = 8
+SCALE_CHECK_SIDES = (1000, 1023, 1024, 2000)  # either side of the draft and reduce steps
+SCALE_TOLERANCE = 0.1  # largest relative spread of a score across SCALE_CHECK_SIDES
+
+METRICS = ('sharpness', 'clipped_dark', 'clipped_bright', 'noise', 'blockiness', 'contrast')
+# Threshold name -> (metric, fails when the score is below (True) or above (False), flag)
+THRESHOLDS = {
+    'min_sharpness': ('sharpness', True, 'blurry'),
+    'max_clipped': ('clipped', False, 'clipped'),
+    'max_noise': ('noise', False, 'noisy'),
+    'max_blockiness': ('blockiness', False, 'blocky'),
+    'min_contrast': ('contrast', True, 'flat'),
+}
+DEFAULT_THRESHOLDS = {'min_sharpness': 100.0, 'max_clipped': 20.0, 'max_noise': 10.0, 'max_blockiness': 1.3,
+                      'min_contrast': 20.0}
+
+NOISE_SCALE = np.sqrt(np.pi / 2) / 6
+
+
+def load_grey(path, side=ANALYSIS_SIDE):
+    """
+    Luminance of path as float32 with the shorter side resized to exactly side, or as
+    it is for smaller images. Returns (luminance, grid, full size, decode reduction
+    factor, format), grid being a JPEG's luminance as decoded, before the resize, with
+    its 8x8 grid still in place, None for other formats.
+    """
+    with memory_guard.open_image(path) as img:
+        size = img.size
+        image_format = img.format
+        # JPEGs decode only the luma plane, scaled down while decoding. The DCT scaling
+        # softens the image, it stops at twice the analysis side so the resize sets the scale
+        img.draft('L', (2 * side, 2 * side))
+        with memory_guard.budget.reserve(memory_guard.decoded_bytes(img)):
+            memory_guard.decode(img)
+            factor = max(1, round(size[0] / img.size[0]))
+            with instrumentation.stage('process'):
+                grey = img.convert('L')
+                grid = np.asarray(grey, dtype=np.float32) if image_format == 'JPEG' else None
+                # The Laplacian and noise scores change with the scale, every image is scored at one
+                shorter = min(grey.size)
+                if shorter > side:
+                    grey = grey.resize((max(1, round(grey.size[0] * side / shorter)),
+                                        max(1, round(grey.size[1] * side / shorter))),
+                                       Image.LANCZOS, reducing_gap=3.0)
+                luminance = np.asarray(grey, dtype=np.float32)
+    return luminance, grid, size, factor, image_format
+
+
+def sharpness(grey):
+    """Variance of the 4-neighbour Laplacian."""
+    laplacian = grey[1:-1, :-2] + grey[1:-1, 2:] + grey[:-2, 1:-1] + grey[2:, 1:-1] - 4 * grey[1:-1, 1:-1]
+    return float(laplacian.var())
+
+
+def noise_sigma(grey):
+    """Immerkaer's fast noise estimate: mean absolute response to a Laplacian difference mask."""
+    mask = (grey[:-2, :-2] + grey[:-2, 2:] + grey[2:, :-2] + grey[2:, 2:]
+            - 2 * (grey[:-2, 1:-1] + grey[2:, 1:-1] + grey[1:-1, :-2] + grey[1:-1, 2:])
+            + 4 * grey[1:-1, 1:-1])
+    return float(NOISE_SCALE * np.abs(mask).mean())
+
+
+def blockiness(grey, period):
+    """Mean step across block boundaries over the mean step inside blocks, both directions."""
+    steps_x = np.abs(np.diff(grey, axis=1))
+    steps_y = np.abs(np.diff(grey, axis=0))
+    on_x = (np.arange(steps_x.shape[1]) + 1) % period == 0
+    on_y = (np.arange(steps_y.shape[0]) + 1) % period == 0
+    if not on_x.any() or not on_y.any():
+        return None
+    boundary = steps_x[:, on_x].mean() + steps_y[on_y].mean()
+    inside = steps_x[:, ~on_x].mean() + steps_y[~on_y].mean()
+    return float(boundary / inside) if inside > 0 else 1.0
+
+
+def score_image(path, side=ANALYSIS_SIDE):
+    """Every metric of the image at path, plus its full width and height."""
+    grey, grid, size, factor, image_format = load_grey(path, side)
+    with instrumentation.stage('process'):
+        pixels = grey.size
+        scores = {
+            'width': size[0],
+            'height': size[1],
+            'sharpness': sharpness(grey),
+            'clipped_dark': 100.0 * int(np.count_nonzero(grey <= CLIP_LOW)) / pixels,
+            'clipped_bright': 100.0 * int(np.count_nonzero(grey >= CLIP_HIGH)) / pixels,
+            'noise': noise_sigma(grey),
+            'contrast': float(grey.std()),
+            'blockiness': None,
+        }
+        # The 8x8 grid shrinks with the decode, below 2 pixels it can't be told from detail
+        if image_format == 'JPEG' and JPEG_BLOCK % factor == 0 and JPEG_BLOCK // factor >= 2:
+            scores['blockiness'] = blockiness(grid, JPEG_BLOCK // factor)
+    return scores
+
+
+def score_chunk(paths, side=ANALYSIS_SIDE):
+    """Score one chunk of images, runs in a worker process. Returns [(path, scores or error message)]."""
+    results = []
+    for path in paths:
+        try:
+            results.append((path, score_image(path, side)))
+        except (OSError, ValueError, Image.DecompressionBombError, MemoryError) as e:
+            results.append((path, str(e)))
+    return results
+
+
+def check_scale(path, sides=SCALE_CHECK_SIDES, tolerance=SCALE_TOLERANCE):
+    """
+    Score the image at path resized to each shorter side in sides, saved in its own
+    format. Returns ({side: scores}, {metric: relative spread}, passed), the spread
+    being (max - min) / max of sharpness, noise and contrast.
+    """
+    work_dir = tempfile.mkdtemp(prefix='ds_scale_check_')
+    try:
+        results = {}
+        with memory_guard.decoded(path) as img:
+            extension = os.path.splitext(path)[1]
+            source = img.convert('RGB') if extension.lower() in ('.jpg', '.jpeg') else img
+            for side in sides:
+                scale = side / min(source.size)
+                resized = source.resize((round(source.size[0] * scale), round(source.size[1] * scale)), Image.LANCZOS)
+                resized_path = os.path.join(work_dir, f"{side}{extension}")
+                resized.save(resized_path, **({'quality': 95} if extension.lower() in ('.jpg', '.jpeg') else {}))
+                results[side] = score_image(resized_path)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    spread = {}
+    for metric in ('sharpness', 'noise', 'contrast'):
+        values = [scores[metric] for scores in results.values()]
+        spread[metric] = (max(values) - min(values)) / max(values) if max(values) > 0 else 0.0
+    return results, spread, all(value <= tolerance for value in spread.values())
+
+
+def low_quality_flags(scores, thresholds):
+    """Flags (blurry, clipped, noisy, blocky, flat) of the thresholds the scores fail, OFF thresholds skipped."""
+    values = dict(scores, clipped=scores['clipped_dark'] + scores['clipped_bright'])
+    flags = []
+    for name, (metric, minimum, flag) in THRESHOLDS.items():
+        limit = thresholds.get(name)
+        if limit is None or values[metric] is None:
+            continue
+        if (values[metric] < limit) if minimum else (values[metric] > limit):
+            flags.append(flag)
+    return flags
+
+
+class QualityMetrics:
+
+    def __init__(self, input_dir, output_dir):
+        self.input_dir = input_dir
+        self.output_dir = output_dir
+        self.thresholds = dict(DEFAULT_THRESHOLDS)
+        self.rename = False
+        self.move_files = False
+        self.recursive = False
+
+    def set_input_dir(self, input_dir):
+        if os.path.isdir(input_dir):
+            self.input_dir = input_dir
+        else:
+            print("Not valid, no changes made")
+
+    def set_output_dir(self, output_dir):
+        if os.path.isdir(output_dir):
+            self.output_dir = output_dir
+        else:
+            print("Not valid, no changes made")
+
+    def display_menu(self):
+        thresholds = {name: 'OFF' if value is None else f"{value:g}" for name, value in self.thresholds.items()}
+        print(colored(f'''
+    Current Input Directory: {self.input_dir}
+    Current Output Directory: {self.output_dir}
+    ┌──────────────────────────────────────────────────────────────────────────────┐
+    |                        FAST QUALITY METRICS MODULE                           |
+    |------------------------------------------------------------------------------|
+    |                                                                              |
+    |              Settings                                                        |
+    |                                                                              |
+    |          1 - Minimum Sharpness ({thresholds['min_sharpness']})
+    |          2 - Maximum Clipped Pixels % ({thresholds['max_clipped']})
+    |          3 - Maximum Noise ({thresholds['max_noise']})
+    |          4 - Maximum JPEG Blockiness ({thresholds['max_blockiness']})
+    |          5 - Minimum Contrast ({thresholds['min_contrast']})
+    |          6 - Label Filenames with {LABEL} ({'ON' if self.rename else 'OFF'})
+    |          7 - Move Low Quality to Output/{QUALITY_DIR} ({'ON' if self.move_files else 'OFF'})
+    |          8 - Recursive ({'ON' if self.recursive else 'OFF'})
+    |                                                                              |
+    └──────────────────────────────────────────────────────────────────────────────┘
+    |      I - Set Input     O - Set Output     R - Run     X - Exit to Menu       |
+    └──────────────────────────────────────────────────────────────────────────────┘
+    ''', 'light_red'))
+
+        print("Module scores sharpness, exposure clipping, noise, JPEG blockiness and contrast without machine vision")
+        print("Images failing any threshold are low quality, a threshold set to OFF is not checked")
+        print("Sharpness is the variance of the Laplacian, noise and contrast are on the 0-255 scale")
+        print("Blockiness is 1.0 without JPEG blocking and grows with it")
+        print(f"Every score is saved to {QUALITY_DIR}/{REPORT_FILE} in the Output Folder, use it or a Sample Preview to tune")
+        print("Recursive ON processes subfolders of the input directory\n")
+
+    def list_images(self):
+        pattern = '/**/*.*' if self.recursive else '/*.*'
+        return [filename for filename in glob.glob(self.input_dir.rstrip('/') + pattern, recursive=self.recursive)
+                if os.path.splitext(filename)[1].lower() in SUPPORTED_FORMATS
+                and QUALITY_DIR not in os.path.relpath(filename, self.input_dir).split(os.sep)]
+
+    def label(self, path, bar):
+        """Add the _XQ label to an image and its caption. Returns the new image path."""
+        stem, extension = os.path.splitext(path)
+        if LABEL in os.path.basename(stem):
+            return path
+        new_path = file_ops.unique_pair_path(f"{stem}{LABEL}{extension}")
+        file_ops.move(path, new_path)
+        bar.file(path, 'renamed', destination=new_path)
+        caption = file_ops.caption_for(path)
+        if os.path.isfile(caption):
+            file_ops.move(caption, file_ops.caption_for(new_path))
+            bar.file(caption, 'renamed', destination=file_ops.caption_for(new_path))
+        return new_path
+
+    def score_images(self):
+        filenames = self.list_images()
+        chunks = [filenames[i: i + CHUNK_SIZE] for i in range(0, len(filenames), CHUNK_SIZE)]
+        report_dir = os.path.join(self.output_dir, QUALITY_DIR)
+        os.makedirs(report_dir, exist_ok=True)
+        report_path = os.path.join(report_dir, REPORT_FILE)
+        counts = {flag: 0 for name, (metric, minimum, flag) in THRESHOLDS.items()}
+        scored = 0
+        low_quality = 0
+        failures = 0
+        start = time.time()
+
+        with progress.Progress("Quality Metrics", total=len(filenames), log_name='quality_metrics') as bar, \
+                open(report_path, 'w', newline='', encoding='utf-8') as report:
+            writer = csv.writer(report)
+            writer.writerow(['path', 'width', 'height'] + list(METRICS) + ['flags', 'destination'])
+            if len(chunks) > 1:
+                pool = ProcessPoolExecutor(max_workers=QUALITY_WORKERS)
+                results = pool.map(score_chunk, chunks)
+            else:
+                # Not worth starting processes for a single chunk
+                pool = None
+                results = map(score_chunk, chunks)
+            try:
+                for chunk, chunk_results in zip(chunks, results):
+                    for path, scores in chunk_results:
+                        if isinstance(scores, str):
+                            failures += 1
+                            bar.error(f"Unable to score image {path}: {scores}", path)
+                            continue
+                        scored += 1
+                        flags = low_quality_flags(scores, self.thresholds)
+                        bar.file(path, 'low_quality' if flags else 'scored', flags=flags,
+                                 **{metric: scores[metric] for metric in METRICS})
+                        destination = path
+                        if flags:
+                            low_quality += 1
+                            for flag in flags:
+                                counts[flag] += 1
+                            try:
+                                if self.rename:
+                                    destination = self.label(destination, bar)
+                                if self.move_files:
+                                    moved = file_ops.pair(destination, report_dir, 'move')
+                                    bar.file(destination, 'moved', destination=moved)
+                                    destination = moved
+                            except OSError as e:
+                                failures += 1
+                                bar.error(f"Unable to label or move {path}: {e}", path)
+                        writer.writerow([path, scores['width'], scores['height']]
+                                        + ['' if scores[metric] is None else round(scores[metric], 3) for metric in METRICS]
+                                        + [' '.join(flags), destination if destination != path else ''])
+                    bar.advance(len(chunk))
+            finally:
+                if pool:
+                    pool.shutdown()
+
+        elapsed = time.time() - start
+        print(f"Total images scored: {scored} in {elapsed:.1f}s ({scored / elapsed if elapsed > 0 else 0:.0f} images/s)")
+        print(f"Total low quality images: {low_quality}" + (f" ({', '.join(f'{flag} {count}' for flag, count in counts.items() if count)})" if low_quality else ''))
+        if failures:
+            print(colored(f"Total failures: {failures}", 'red'))
+        print(f"Report saved to: {report_path}")
+        return low_quality
+
+    def set_threshold(self, name, prompt):
+        user_input = input(f"{prompt} (Enter to turn it OFF): ").strip()
+        self.thresholds[name] = float(user_input) if user_input else None
+
+    def run(self):
+        while True:
+            self.display_menu()
+            choice = input("Enter your selection: ")
+
+            try:
+                if choice == '1':
+                    self.set_threshold('min_sharpness', "Minimum sharpness, blurrier images are low quality")
+                elif choice == '2':
+                    self.set_threshold('max_clipped', "Maximum percentage of pixels clipped to black or white")
+                elif choice == '3':
+                    self.set_threshold('max_noise', "Maximum noise level")
+                elif choice == '4':
+                    self.set_threshold('max_blockiness', "Maximum JPEG blockiness, 1.0 is none")
+                elif choice == '5':
+                    self.set_threshold('min_contrast', "Minimum contrast")
+                elif choice == '6':
+                    self.rename = input(f"Add {LABEL} to the filenames of low quality images? (Y/N)").lower() in ['y', 'yes']
+                elif choice == '7':
+                    self.move_files = input(f"Move low quality images to Output/{QUALITY_DIR}? (Y/N)").lower() in ['y', 'yes']
+                elif choice == '8':
+                    user_input = input("Process folders recursively? (Y/N)").lower()
+                    self.recursive = user_input in ['y', 'yes']
+                elif choice.lower() == 'i':
+                    new_input_dir = input("Change Input Directory: ")
+                    self.set_input_dir(new_input_dir)
+                elif choice.lower() == 'o':
+                    new_output_dir = input("Change Output Directory: ")
+                    self.set_output_dir(new_output_dir)
+                elif choice.lower() == 'r':
+                    if self.rename or self.move_files:
+                        confirm = input(f"WARNING: This will {'rename and move' if self.rename and self.move_files else 'rename' if self.rename else 'move'} "
+                                        "low quality images and their captions. Continue? (Y/N)")
+                        if confirm.lower() not in ['y', 'yes']:
+                            continue
+                    self.score_images()
+                elif choice.lower() == 'x':
+                    break
+                else:
+                    print("Invalid choice. Please choose a valid option or press 'x' to exit.")
+            except ValueError:
+                print("Not a number, no changes made.")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Dataset Sculptor fast quality metrics')
+    parser.add_argument('--input_dir', type=str, default=None, help='Folder with the images')
+    parser.add_argument('--check_scale', type=str, default=None, metavar='IMAGE',
+                        help=f"Score IMAGE resized to {', '.join(map(str, SCALE_CHECK_SIDES))} pixels and check the scores agree")
+    parser.add_argument('--output_dir', type=str, default=None, help='Report and moved images go to DS_LowQuality in this folder (default: the input directory)')
+    for name, (metric, minimum, flag) in THRESHOLDS.items():
+        parser.add_argument(f'--{name}', type=float, default=DEFAULT_THRESHOLDS[name],
+                            help=f"Images {'below' if minimum else 'above'} this {metric} are {flag}, a negative value turns it off (default: {DEFAULT_THRESHOLDS[name]:g})")
+    parser.add_argument('--rename', action='store_true', help=f'Add {LABEL} to the filenames of low quality images')
+    parser.add_argument('--move', action='store_true', help=f'Move low quality images and their captions to {QUALITY_DIR}')
+    parser.add_argument('--recursive', action='store_true', help='Include subfolders')
+    parser.add_argument('--quiet', action='store_true', help='No progress line, only summaries and errors')
+    parser.add_argument('--log_dir', type=str, default=None, help='Per-file log folder')
+    args = parser.parse_args()
+    if args.check_scale:
+        results, spread, passed = check_scale(args.check_scale)
+        for side, scores in results.items():
+            print(f"{side:>6} px  " + '  '.join(f"{metric} {scores[metric]:.2f}" for metric in spread))
+        print('  '.join(f"{metric} spread {value:.1%}" for metric, value in spread.items()))
+        print(colored('Scores agree across resolutions', 'green') if passed else
+              colored(f'Scores differ by more than {SCALE_TOLERANCE:.0%} across resolutions', 'red'))
+        raise SystemExit(0 if passed else 1)
+    if not args.input_dir:
+        parser.error('--input_dir is required')
+
+    scorer = QualityMetrics(args.input_dir, args.output_dir or args.input_dir)
+    scorer.thresholds = {name: None if getattr(args, name) < 0 else getattr(args, name) for name in THRESHOLDS}
+    scorer.rename = args.rename
+    scorer.move_files = args.move
+    scorer.recursive = args.recursive
+    progress.configure(quiet=args.quiet, log_dir=args.log_dir)
+    scorer.score_images()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,200 @@
+"""
+Run journal for long machine vision runs.
+
+Every processed image and every file action taken on it (rename, caption edit,
+move) is appended to a JSON lines file in Output/DS_Journal. When a run dies
+halfway, the next run over the same input directory can resume: finished images
+are skipped, BLIP answers already recorded are reused, and actions that already
+happened are not applied a second time.
+"""
+import hashlib
+import json
+import os
+
+from dataset_sculptor import catalog
+
+JOURNAL_DIR = "DS_Journal"
+
+
+def _digest(text):
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+
+def journal_path(output_dir, module, input_dir):
+    # One journal per module and input directory, so unrelated runs never collide
+    input_id = _digest(os.path.abspath(input_dir))[:10]
+    return os.path.join(output_dir, JOURNAL_DIR, f"{module}_{input_id}.jsonl")
+
+
+def has_unfinished_run(output_dir, module, input_dir):
+    """True if a journal exists for this module and input directory that never reached the end."""
+    path = journal_path(output_dir, module, input_dir)
+    if not os.path.isfile(path):
+        return False
+    last_line = None
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            if line.strip():
+                last_line = line
+    if last_line is None:
+        return False
+    try:
+        return json.loads(last_line).get('op') != 'complete'
+    except ValueError:
+        return True  # torn last line, the run crashed while writing it
+
+
+class RunJournal:
+
+    def __init__(self, output_dir, module, input_dir, resume=False):
+        self.path = journal_path(output_dir, module, input_dir)
+        self.items = {}  # key (original path) -> {'done': bool, 'answers': {}, 'actions': {}, 'intents': {}}
+        self.path_index = {}  # every path an item has lived at -> key
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+
+        if resume and os.path.isfile(self.path):
+            self._load()
+            self.file = open(self.path, 'a', encoding='utf-8')
+            print(f"Resuming from journal: {self.path} ({self.finished_count()} files already finished)")
+        else:
+            self.file = open(self.path, 'w', encoding='utf-8')
+
+    def _load(self):
+        with open(self.path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    break  # torn last line from the crash, everything before it is intact
+                self._apply(record)
+
+    def _apply(self, record):
+        op = record['op']
+        if op == 'complete':
+            return
+        key = record['key']
+        item = self.items.setdefault(key, {'done': False, 'answers': {}, 'actions': {}, 'intents': {}})
+        self.path_index[key] = key
+        if op == 'done':
+            item['done'] = True
+        elif op == 'answer':
+            item['answers'][record['question']] = record['answer']
+        elif op in ('intent', 'action'):
+            item['intents' if op == 'intent' else 'actions'][record['action']] = record
+            if record.get('dst'):
+                self.path_index[os.path.abspath(record['dst'])] = key
+
+    def _write(self, record):
+        self._apply(record)
+        self.file.write(json.dumps(record) + "\n")
+        self.file.flush()
+        os.fsync(self.file.fileno())
+
+    def finished_count(self):
+        return sum(1 for item in self.items.values() if item['done'])
+
+    def key_for(self, path):
+        """The key of the item a path belongs to. Files renamed by an interrupted run map back to their original."""
+        path = os.path.abspath(path)
+        return self.path_index.get(path, path)
+
+    def unfinished_keys(self):
+        return [key for key, item in self.items.items() if not item['done']]
+
+    def is_done(self, path):
+        item = self.items.get(self.key_for(path))
+        return bool(item and item['done'])
+
+    def begin(self, key):
+        if key not in self.items:
+            self._write({'op': 'begin', 'key': key})
+
+    def finish(self, key):
+        self._write({'op': 'done', 'key': key})
+
+    def answer(self, key, question):
+        """The BLIP answer recorded for this question, or None."""
+        return self.items[key]['answers'].get(question)
+
+    def record_answer(self, key, question, answer):
+        self._write({'op': 'answer', 'key': key, 'question': question, 'answer': answer})
+
+    def action_done(self, key, action):
+        return action in self.items[key]['actions']
+
+    def started(self, key, *actions):
+        """True if any of the actions was attempted for this item, even if the run died before it was recorded as done."""
+        item = self.items[key]
+        return any(action in item['actions'] or action in item['intents'] for action in actions)
+
+    def record_action(self, key, action, **info):
+        self._write(dict(info, op='action', key=key, action=action))
+
+    def intent(self, key, action):
+        return self.items[key]['intents'].get(action)
+
+    def record_intent(self, key, action, **info):
+        self._write(dict(info, op='intent', key=key, action=action))
+
+    def close(self, complete=True):
+        if complete:
+            self._write({'op': 'complete'})
+        self.file.close()
+
+
+def ask_once(journal, key, ask, image, question, path=None):
+    """
+    Query BLIP unless the journal already holds the answer from an interrupted run, or
+    the catalog holds one for the unchanged image file at path.
+    """
+    if journal:
+        answer = journal.answer(key, question)
+        if answer is not None:
+            return answer
+    cache = catalog.current() if path else None
+    answer = cache.answer(path, question) if cache else None
+    if answer is None:
+        answer = ask(image, question)
+        if cache:
+            cache.record_answer(path, question, answer)
+    if journal:
+        journal.record_answer(key, question, answer)
+    return answer
+
+
+def move_once(journal, key, action, src, dst, move=os.rename):
+    """Rename or move src to dst at most once per item. Returns dst."""
+    if journal is None:
+        move(src, dst)
+        return dst
+    if journal.action_done(key, action):
+        return dst
+    # A crash between the move and its journal record leaves src gone and dst in place
+    if os.path.exists(src) or not os.path.exists(dst):
+        journal.record_intent(key, action, src=src, dst=dst)
+        move(src, dst)
+    journal.record_action(key, action, src=src, dst=dst)
+    return dst
+
+
+def update_caption_once(journal, key, action, path, make_content):
+    """
+    Rewrite the caption at path with make_content(existing_text) at most once per item.
+    The digest of the new content is journaled before writing, so an edit that landed
+    just before a crash is recognised and not applied twice.
+    """
+    if journal and journal.action_done(key, action):
+        return False
+    with open(path, 'r+') as f:
+        existing = f.read()
+        intent = journal.intent(key, action) if journal else None
+        if intent is None or intent['digest'] != _digest(existing):
+            content = make_content(existing)
+            if journal:
+                journal.record_intent(key, action, path=path, digest=_digest(content))
+            f.seek(0)
+            f.write(content)
+            f.truncate()
+    if journal:
+        journal.record_action(key, action, path=path)
+    return True
@@ -0,0 +1,202 @@
+"""
+Sample preview for tuning thresholds.
+
+Instead of running a module over the whole dataset to see what a cutoff does, a
+seeded sample of N image-caption pairs is copied into Output/DS_Sample/input and
+the module runs there, with its output in Output/DS_Sample/output. The dataset
+itself is never touched, so every module gets a dry run without needing one of its
+own. Afterwards the per-file logs of the run are summarised: how many sampled files
+each action hit, and what that comes to over the whole dataset.
+
+The sample is stratified by subfolder and format, so a folder of PNG scans is not
+missed because it is 2% of the files, and the same seed always picks the same
+files, so runs with different settings are comparable.
+
+    with sampling.Sandbox(input_dir, output_dir, size=200, seed=0) as sandbox:
+        run_module(sandbox.input_dir, sandbox.output_dir)
+    sandbox.summary()
+"""
+import collections
+import json
+import os
+import random
+import shutil
+import statistics
+
+from termcolor import colored
+
+from dataset_sculptor import catalog
+from dataset_sculptor import file_ops
+from dataset_sculptor import progress
+from dataset_sculptor.delete_small_images import SUPPORTED_FORMATS
+
+SAMPLE_DIR = "DS_Sample"
+DEFAULT_SIZE = 200
+DEFAULT_SEED = 0
+EXAMPLES = 5  # original paths shown per action
+
+
+def list_pairs(input_dir):
+    """{relative stem: [relative file names]} for the image-caption pairs under input_dir, DS_* folders skipped."""
+    pairs = {}
+    for root, dirs, files in os.walk(input_dir):
+        dirs[:] = sorted(d for d in dirs if not d.startswith('DS_'))
+        relative_root = os.path.relpath(root, input_dir)
+        for name in files:
+            extension = os.path.splitext(name)[1].lower()
+            if extension in SUPPORTED_FORMATS or extension == '.txt':
+                relative = os.path.normpath(os.path.join(relative_root, name))
+                pairs.setdefault(os.path.splitext(relative)[0], []).append(relative)
+    return pairs
+
+
+def stratum(files):
+    """(subfolder, format) of a pair, a caption without an image is its own format."""
+    images = sorted(name for name in files if not name.lower().endswith('.txt'))
+    lead = images[0] if images else files[0]
+    return os.path.dirname(lead), os.path.splitext(lead)[1].lower()
+
+
+def allocate(sizes, n):
+    """
+    Split n draws over strata in proportion to their sizes (largest remainder), every
+    stratum getting at least one while n allows. Returns {stratum: draws}.
+    """
+    total = sum(sizes.values())
+    if n >= total:
+        return dict(sizes)
+    strata = sorted(sizes)
+    draws = {key: 0 for key in strata}
+    if n >= len(strata):
+        for key in strata:
+            draws[key] = 1
+    remaining = n - sum(draws.values())
+    spare = {key: sizes[key] - draws[key] for key in strata}
+    spare_total = sum(spare.values())
+    if remaining and spare_total:
+        shares = {key: remaining * spare[key] / spare_total for key in strata}
+        for key in strata:
+            draws[key] += int(shares[key])
+        left = n - sum(draws.values())
+        by_remainder = sorted(strata, key=lambda key: (-(shares[key] - int(shares[key])), key))
+        for key in by_remainder:
+            if left <= 0:
+                break
+            if draws[key] < sizes[key]:
+                draws[key] += 1
+                left -= 1
+    return draws
+
+
+def stratified_sample(pairs, n, seed=DEFAULT_SEED):
+    """
+    Pick n stems of pairs, stratified by subfolder and format. Each stratum draws with
+    its own generator seeded from seed and the stratum, so the sample depends on the
+    seed and the files only, not on listing order. Returns {stem: weight}, the weight
+    being how many pairs of the dataset each sampled pair stands for.
+    """
+    strata = collections.defaultdict(list)
+    for stem, files in pairs.items():
+        strata[stratum(files)].append(stem)
+    draws = allocate({key: len(stems) for key, stems in strata.items()}, n)
+    sample = {}
+    for key, count in draws.items():
+        if not count:
+            continue
+        stems = sorted(strata[key])
+        rng = random.Random(f"{seed}:{key[0]}:{key[1]}")
+        for stem in rng.sample(stems, count):
+            sample[stem] = len(stems) / count
+    return sample
+
+
+def _numbers(records, key):
+    return [record[key] for record in records
+            if isinstance(record.get(key), (int, float)) and not isinstance(record.get(key), bool)]
+
+
+class Sandbox:
+    """A stratified sample of input_dir copied to Output/DS_Sample, with logs and catalog redirected to it."""
+
+    def __init__(self, input_dir, output_dir, size=DEFAULT_SIZE, seed=DEFAULT_SEED):
+        self.source_dir = os.path.abspath(input_dir)
+        self.root = os.path.abspath(os.path.join(output_dir or input_dir, SAMPLE_DIR))
+        self.input_dir = os.path.join(self.root, 'input')
+        self.output_dir = os.path.join(self.root, 'output')
+        self.log_dir = os.path.join(self.root, progress.LOG_DIR)
+        self.size = size
+        self.seed = seed
+        self.population = 0
+        self.weights = {}  # sandbox path of every sampled pair without extension -> pairs of the dataset it stands for
+        self.originals = {}  # sandbox path -> original path
+        self.saved = None
+
+    def __enter__(self):
+        self.create()
+        self.saved = (progress._settings['log_dir'], catalog._settings['path'])
+        # Logs are what the summary is made from, sample paths must not reach the dataset's catalog
+        progress.configure(log_dir=self.log_dir)
+        catalog.configure(None)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        progress.configure(log_dir=self.saved[0])
+        catalog.configure(self.saved[1])
+
+    def create(self):
+        """Draw the sample and copy it, replacing the previous sandbox."""
+        if os.path.isdir(self.root):
+            shutil.rmtree(self.root)
+        file_ops.forget_dirs(self.root)
+        pairs = list_pairs(self.source_dir)
+        self.population = len(pairs)
+        sample = stratified_sample(pairs, self.size, self.seed)
+        for stem, weight in sorted(sample.items()):
+            self.weights[os.path.abspath(os.path.join(self.input_dir, stem))] = weight
+            for relative in pairs[stem]:
+                destination = os.path.join(self.input_dir, relative)
+                file_ops.ensure_dir(os.path.dirname(destination))
+                # Modules rewrite images in place, a hardlink would rewrite the original too
+                file_ops.copy(os.path.join(self.source_dir, relative), destination, mode='reflink')
+                self.originals[os.path.abspath(destination)] = os.path.join(self.source_dir, relative)
+        os.makedirs(self.output_dir, exist_ok=True)
+        strata = len({stratum(pairs[stem]) for stem in sample})
+        print(colored(f"Sample preview: {len(sample)} of {self.population} image-caption pairs from {strata} "
+                      f"folder/format groups (seed {self.seed}) copied to {self.input_dir}", 'yellow'))
+
+    def records(self):
+        """Every per-file record the run logged, in log order."""
+        records = []
+        if not os.path.isdir(self.log_dir):
+            return records
+        for name in sorted(os.listdir(self.log_dir)):
+            if name.endswith('.jsonl'):
+                with open(os.path.join(self.log_dir, name), 'r', encoding='utf-8') as f:
+                    records.extend(json.loads(line) for line in f if line.strip())
+        return records
+
+    def original(self, path):
+        return self.originals.get(os.path.abspath(path), path) if path else path
+
+    def summary(self):
+        """Print what the run did to the sample, and the same scaled to the whole dataset."""
+        events = collections.defaultdict(list)
+        for record in self.records():
+            events[record.get('event')].append(record)
+        sampled = len(self.weights)
+        print(colored(f"\nSample preview summary ({sampled} pairs sampled of {self.population}, nothing in the dataset was changed)", 'yellow'))
+        if not events:
+            print("  No file was changed")
+        for event, records in sorted(events.items(), key=lambda item: -len(item[1])):
+            pairs = {os.path.splitext(os.path.abspath(record['path']))[0] for record in records if record.get('path')}
+            estimate = sum(self.weights.get(pair, 0) for pair in pairs)
+            share = 100.0 * len(pairs) / sampled if sampled else 0.0
+            print(f"  {event}: {len(records)} files in {len(pairs)} pairs ({share:.1f}% of the sample, ~{estimate:,.0f} in the dataset)")
+            for key in sorted({key for record in records for key in record} - {'time', 'event', 'path'}):
+                values = _numbers(records, key)
+                if len(values) > 1:
+                    print(f"      {key}: min {min(values):g}, median {statistics.median(values):g}, max {max(values):g}")
+            for record in records[:EXAMPLES]:
+                message = f" ({record['message']})" if record.get('message') else ''
+                print(f"      {self.original(record.get('path'))}{message}")
+        print(f"Sampled files and results stay in {self.root} until the next sample preview")
@@ -0,0 +1,350 @@
+"""
+Sharded tar export.
+
+Packs image-caption pairs into numbered tar shards in the WebDataset layout, so
+training loaders read a few large files front to back instead of millions of small
+ones. The image and caption of a pair are stored next to each other under one key:
+
+    DS_Shards/shard-000000.tar
+        photos/beach_0001.jpg
+        photos/beach_0001.txt
+        ...
+
+A shard is closed when it holds shard_samples pairs or shard_mb of source files,
+whichever comes first. Shards are planned up front and written by a process pool,
+each worker writing whole shards. Images can be resized and converted on the way,
+with the same settings as Reduce Image and Convert. DS_Shards/index.json lists the
+shards with their pair counts and sizes, DS_Shards/manifest.csv has one line per
+pair with its shard, key and source file.
+
+    python -m dataset_sculptor.shard_export --input_dir /data/in --output_dir /data/out --recursive --max_image_length 1024
+"""
+import argparse
+import csv
+import io
+import json
+import os
+import random
+import tarfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from PIL import Image
+from termcolor import colored
+
+from dataset_sculptor import instrumentation
+from dataset_sculptor import memory_guard
+from dataset_sculptor import progress
+from dataset_sculptor.delete_small_images import SUPPORTED_FORMATS
+from dataset_sculptor.image_converter import SUPPORTED_FILETYPES, prepare_for_filetype
+from dataset_sculptor.reduce_img import ReduceImage
+
+SHARDS_DIR = "DS_Shards"
+SHARD_PREFIX = "shard"
+INDEX_FILE = "index.json"
+MANIFEST_FILE = "manifest.csv"
+SHARD_SAMPLES = 10000
+SHARD_MB = 1024
+EXPORT_WORKERS = min(8, os.cpu_count() or 4)
+
+
+def shard_name(index):
+    return f"{SHARD_PREFIX}-{index:06d}.tar"
+
+
+def sample_key(relative_stem):
+    """WebDataset splits a member name at the first dot of its file name, keys keep only the folder dots."""
+    folder, name = os.path.split(relative_stem.replace(os.sep, '/'))
+    return '/'.join(part for part in (folder, name.replace('.', '_')) if part)
+
+
+def plan_shards(pairs, shard_samples=SHARD_SAMPLES, shard_mb=SHARD_MB):
+    """Split [(image, caption or None, bytes, key)] into consecutive shards by count and source size."""
+    limit = shard_mb * 1024 * 1024
+    shards = [[]]
+    size = 0
+    for pair in pairs:
+        if shards[-1] and (len(shards[-1]) >= shard_samples or size + pair[2] > limit):
+            shards.append([])
+            size = 0
+        shards[-1].append(pair)
+        size += pair[2]
+    return [shard for shard in shards if shard]
+
+
+def _tar_add(tar, name, data):
+    info = tarfile.TarInfo(name)
+    info.size = len(data)
+    info.mtime = int(time.time())
+    info.mode = 0o644
+    tar.addfile(info, io.BytesIO(data))
+
+
+def convert_image(path, max_image_length=None, target_filetype=None):
+    """The image at path resized and converted as requested. Returns (bytes, extension)."""
+    extension = target_filetype or os.path.splitext(path)[1].lower()
+    reducer = ReduceImage()
+    with memory_guard.open_image(path) as header:
+        width, height = header.size
+    if not max_image_length or max(width, height) <= max_image_length:
+        if extension == os.path.splitext(path)[1].lower():
+            with open(path, 'rb') as f:
+                return f.read(), extension
+        new_size = None
+    else:
+        reducer.max_image_length = max_image_length
+        new_size = reducer.reduced_size(width, height)
+    with memory_guard.decoded(path, new_size) as img:
+        if new_size:
+            with instrumentation.stage('process'):
+                img = img.resize(new_size, Image.LANCZOS)
+        return instrumentation.encode_image(prepare_for_filetype(img, extension), extension), extension
+
+
+def write_shard(shard_path, pairs, max_image_length=None, target_filetype=None):
+    """
+    Write one shard from [(image, caption or None, bytes, key)], runs in a worker process.
+    Returns ([(image, key, image member, caption member, bytes written)], [(image, message)]).
+    """
+    rows = []
+    errors = []
+    temp_path = f"{shard_path}.{os.getpid()}.tmp"
+    with tarfile.open(temp_path, 'w') as tar:
+        for image, caption, size, key in pairs:
+            try:
+                data, extension = convert_image(image, max_image_length, target_filetype)
+                caption_data = None
+                if caption:
+                    with open(caption, 'rb') as f:
+                        caption_data = f.read()
+            except (OSError, ValueError, Image.DecompressionBombError, MemoryError) as e:
+                errors.append((image, str(e)))
+                continue
+            # Image and caption go in back to back, a loader sees the whole pair at once
+            _tar_add(tar, key + extension, data)
+            if caption_data is not None:
+                _tar_add(tar, key + '.txt', caption_data)
+            rows.append((image, key, key + extension, key + '.txt' if caption_data is not None else '',
+                         len(data) + len(caption_data or b'')))
+    os.replace(temp_path, shard_path)
+    return rows, errors
+
+
+class ShardExport:
+
+    def __init__(self, input_dir, output_dir):
+        self.input_dir = input_dir
+        self.output_dir = output_dir
+        self.shard_samples = SHARD_SAMPLES
+        self.shard_mb = SHARD_MB
+        self.max_image_length = None
+        self.target_filetype = None
+        self.shuffle = True
+        self.seed = 0
+        self.require_caption = False
+        self.recursive = False
+
+    def set_input_dir(self, input_dir):
+        if os.path.isdir(input_dir):
+            self.input_dir = input_dir
+        else:
+            print("Not valid, no changes made")
+
+    def set_output_dir(self, output_dir):
+        if os.path.isdir(output_dir):
+            self.output_dir = output_dir
+        else:
+            print("Not valid, no changes made")
+
+    def display_menu(self):
+        print(colored(f'''
+    Current Input Directory: {self.input_dir}
+    Current Output Directory: {self.output_dir}
+    ┌──────────────────────────────────────────────────────────────────────────────┐
+    |                         SHARDED TAR EXPORT MODULE                            |
+    |------------------------------------------------------------------------------|
+    |                                                                              |
+    |              Settings                                                        |
+    |                                                                              |
+    |          1 - Shard Size ({self.shard_samples} pairs or {self.shard_mb} MB)
+    |          2 - Resize Longest Side ({self.max_image_length or 'OFF'})
+    |          3 - Convert To ({self.target_filetype or 'OFF'})
+    |          4 - Shuffle ({'ON, seed ' + str(self.seed) if self.shuffle else 'OFF'})
+    |          5 - Only Images With Captions ({'ON' if self.require_caption else 'OFF'})
+    |          6 - Recursive ({'ON' if self.recursive else 'OFF'})
+    |                                                                              |
+    └──────────────────────────────────────────────────────────────────────────────┘
+    |      I - Set Input     O - Set Output     R - Run     X - Exit to Menu       |
+    └──────────────────────────────────────────────────────────────────────────────┘
+    ''', 'light_blue'))
+
+        print("Module packs image-caption pairs into tar shards in DS_Shards in the Output Folder, for WebDataset style loaders")
+        print("A shard is closed at the pair count or the size of its source files, whichever comes first")
+        print("Resize and Convert work like Reduce Image and Convert, originals are never changed")
+        print("Shuffle mixes pairs across shards, the same seed gives the same shards")
+        print("index.json lists the shards, manifest.csv the shard and key of every pair")
+        print("Recursive ON processes subfolders of the input directory\n")
+
+    def list_pairs(self):
+        """[(image, caption or None, size, key)] for every image under input_dir."""
+        pairs = []
+        keys = set()
+        for root, dirs, files in os.walk(self.input_dir):
+            dirs[:] = sorted(d for d in dirs if not d.startswith('DS_'))
+            names = set(files)
+            for name in sorted(files):
+                stem, extension = os.path.splitext(name)
+                if extension.lower() not in SUPPORTED_FORMATS:
+                    continue
+                caption = os.path.join(root, stem + '.txt') if stem + '.txt' in names else None
+                if self.require_caption and not caption:
+                    continue
+                image = os.path.join(root, name)
+                key = sample_key(os.path.relpath(os.path.join(root, stem), self.input_dir))
+                # photo.jpg and photo.png would share a key
+                unique, counter = key, 1
+                while unique in keys:
+                    unique = f"{key}_{counter}"
+                    counter += 1
+                keys.add(unique)
+                try:
+                    size = os.path.getsize(image) + (os.path.getsize(caption) if caption else 0)
+                except OSError:
+                    continue
+                pairs.append((image, caption, size, unique))
+            if not self.recursive:
+                break
+        return pairs
+
+    def export(self):
+        pairs = self.list_pairs()
+        if self.shuffle:
+            random.Random(self.seed).shuffle(pairs)
+        shards = plan_shards(pairs, self.shard_samples, self.shard_mb)
+        shards_dir = os.path.join(self.output_dir, SHARDS_DIR)
+        os.makedirs(shards_dir, exist_ok=True)
+        start = time.time()
+        index = []
+        written = 0
+        failures = 0
+
+        with progress.Progress("Shard Export", total=len(pairs), log_name='shard_export') as bar, \
+                open(os.path.join(shards_dir, MANIFEST_FILE), 'w', newline='', encoding='utf-8') as manifest:
+            writer = csv.writer(manifest)
+            writer.writerow(['shard', 'key', 'image', 'caption', 'bytes', 'source'])
+            paths = [os.path.join(shards_dir, shard_name(i)) for i in range(len(shards))]
+            arguments = ([self.max_image_length] * len(shards), [self.target_filetype] * len(shards))
+            if len(shards) > 1:
+                pool = ProcessPoolExecutor(max_workers=EXPORT_WORKERS)
+                results = pool.map(write_shard, paths, shards, *arguments)
+            else:
+                pool = None
+                results = map(write_shard, paths, shards, *arguments)
+            try:
+                for path, shard, (rows, errors) in zip(paths, shards, results):
+                    name = os.path.basename(path)
+                    for source, key, image_member, caption_member, size in rows:
+                        writer.writerow([name, key, image_member, caption_member, size, source])
+                        bar.file(source, 'exported', shard=name, key=key)
+                    for source, message in errors:
+                        failures += 1
+                        bar.error(f"Unable to export {source}: {message}", source)
+                    index.append({'shard': name, 'samples': len(rows), 'bytes': os.path.getsize(path)})
+                    written += len(rows)
+                    bar.advance(len(shard))
+            finally:
+                if pool:
+                    pool.shutdown()
+
+        with open(os.path.join(shards_dir, INDEX_FILE), 'w', encoding='utf-8') as f:
+            json.dump({'source': os.path.abspath(self.input_dir), 'samples': written, 'shards': index,
+                       'max_image_length': self.max_image_length, 'target_filetype': self.target_filetype,
+                       'shuffle_seed': self.seed if self.shuffle else None}, f, indent=2)
+
+        total_mb = sum(entry['bytes'] for entry in index) / (1024 * 1024)
+        print(f"Total pairs exported: {written} into {len(index)} shards ({total_mb:.1f} MB) in {time.time() - start:.1f}s")
+        if index:
+            print(f"WebDataset url: {os.path.join(shards_dir, SHARD_PREFIX)}-{{000000..{len(index) - 1:06d}}}.tar")
+        if failures:
+            print(colored(f"Total failures: {failures}", 'red'))
+        return written
+
+    def run(self):
+        while True:
+            self.display_menu()
+            choice = input("Enter your selection: ")
+
+            try:
+                if choice == '1':
+                    self.shard_samples = int(input("Pairs per shard: ") or self.shard_samples)
+                    self.shard_mb = int(input("Maximum MB of source files per shard: ") or self.shard_mb)
+                elif choice == '2':
+                    user_input = input("Longest side in pixels (Enter to turn resizing off): ").strip()
+                    self.max_image_length = int(user_input) if user_input else None
+                elif choice == '3':
+                    user_input = input("Convert to, e.g. .jpg, .png or .webp (Enter to keep formats): ").strip().lower()
+                    if not user_input:
+                        self.target_filetype = None
+                    elif user_input.lstrip('.') in SUPPORTED_FILETYPES:
+                        self.target_filetype = '.' + user_input.lstrip('.')
+                    else:
+                        print("Unsupported file type, no changes made.")
+                elif choice == '4':
+                    self.shuffle = input("Shuffle pairs across shards? (Y/N)").lower() in ['y', 'yes']
+                    if self.shuffle:
+                        self.seed = int(input(f"Seed (Enter keeps {self.seed}): ") or self.seed)
+                elif choice == '5':
+                    self.require_caption = input("Only export images that have a caption? (Y/N)").lower() in ['y', 'yes']
+                elif choice == '6':
+                    user_input = input("Process folders recursively? (Y/N)").lower()
+                    self.recursive = user_input in ['y', 'yes']
+                elif choice.lower() == 'i':
+                    new_input_dir = input("Change Input Directory: ")
+                    self.set_input_dir(new_input_dir)
+                elif choice.lower() == 'o':
+                    new_output_dir = input("Change Output Directory: ")
+                    self.set_output_dir(new_output_dir)
+                elif choice.lower() == 'r':
+                    self.export()
+                elif choice.lower() == 'x':
+                    break
+                else:
+                    print("Invalid choice. Please choose a valid option or press 'x' to exit.")
+            except ValueError:
+                print("Not a number, no changes made.")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Dataset Sculptor sharded tar export')
+    parser.add_argument('--input_dir', type=str, required=True, help='Folder with the image-caption pairs')
+    parser.add_argument('--output_dir', type=str, default=None, help='Shards go to DS_Shards in this folder (default: the input directory)')
+    parser.add_argument('--shard_samples', type=int, default=SHARD_SAMPLES, help='Pairs per shard')
+    parser.add_argument('--shard_mb', type=int, default=SHARD_MB, help='Maximum MB of source files per shard')
+    parser.add_argument('--max_image_length', type=int, default=None, help='Resize images to this longest side')
+    parser.add_argument('--target_filetype', type=str, default=None, help='Convert images, e.g. .jpg')
+    parser.add_argument('--no_shuffle', action='store_true', help='Keep folder order instead of shuffling')
+    parser.add_argument('--seed', type=int, default=0, help='Shuffle seed')
+    parser.add_argument('--require_caption', action='store_true', help='Skip images without a caption')
+    parser.add_argument('--recursive', action='store_true', help='Include subfolders')
+    parser.add_argument('--quiet', action='store_true', help='No progress line, only summaries and errors')
+    parser.add_argument('--log_dir', type=str, default=None, help='Per-file log folder')
+    args = parser.parse_args()
+
+    exporter = ShardExport(args.input_dir, args.output_dir or args.input_dir)
+    exporter.shard_samples = args.shard_samples
+    exporter.shard_mb = args.shard_mb
+    exporter.max_image_length = args.max_image_length
+    if args.target_filetype:
+        exporter.target_filetype = '.' + args.target_filetype.lower().lstrip('.')
+        if exporter.target_filetype[1:] not in SUPPORTED_FILETYPES:
+            parser.error(f"Unsupported target filetype: {args.target_filetype}")
+    exporter.shuffle = not args.no_shuffle
+    exporter.seed = args.seed
+    exporter.require_caption = args.require_caption
+    exporter.recursive = args.recursive
+    progress.configure(quiet=args.quiet, log_dir=args.log_dir)
+    exporter.export()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+"""
+Synthetic dataset generator for benchmarks and trial runs.
+
+Writes a reproducible folder of images with caption sidecars: a mix of resolutions,
+formats, color and greyscale images, images without captions and orphan captions
+without images, optionally spread over subfolders.
+
+    python -m dataset_sculptor.synthetic_dataset C:/Training_DS/Trial --count 500 --formats jpg,png,webp
+"""
+import argparse
+import os
+import random
+
+from PIL import Image, ImageDraw
+
+DEFAULT_RESOLUTIONS = ((256, 256), (512, 768), (1024, 1024), (3000, 2000))
+DEFAULT_FORMATS = ('jpg', 'png', 'webp')
+
+CAPTION_WORDS = ('a photo of', 'portrait', 'landscape', 'city street', 'mountain', 'river', 'studio lighting',
+                 'close up', 'wide angle', 'vintage', 'film grain', 'sunset', 'night', 'forest', 'beach')
+
+
+def make_image(width, height, greyscale, rng):
+    """A cheap but non-trivial image: gradients, noise and a few shapes, so encoders have real work to do."""
+    gradient = Image.linear_gradient('L').resize((width, height))
+    noise = Image.effect_noise((width, height), rng.uniform(20, 80))
+    if greyscale:
+        img = Image.blend(gradient, noise, 0.3)
+        # Greyscale images come both as single band files and as RGB files with equal channels
+        img = img.convert('RGB') if rng.random() < 0.5 else img
+    else:
+        radial = Image.radial_gradient('L').resize((width, height))
+        img = Image.merge('RGB', (gradient, noise, radial))
+
+    draw = ImageDraw.Draw(img)
+    for _ in range(rng.randint(2, 6)):
+        x0, y0 = rng.randrange(width), rng.randrange(height)
+        x1, y1 = min(width, x0 + rng.randrange(1, width // 2 + 2)), min(height, y0 + rng.randrange(1, height // 2 + 2))
+        fill = rng.randrange(256) if img.mode == 'L' else tuple(rng.randrange(256) for _ in range(3))
+        if greyscale and img.mode == 'RGB':
+            fill = (fill[0],) * 3
+        draw.ellipse((x0, y0, x1, y1), fill=fill)
+    return img
+
+
+def make_caption(rng):
+    return ', '.join(rng.sample(CAPTION_WORDS, rng.randint(2, 6)))
+
+
+def generate(output_dir, count=200, resolutions=DEFAULT_RESOLUTIONS, formats=DEFAULT_FORMATS, greyscale_ratio=0.3,
+             caption_ratio=0.9, orphan_captions=10, subfolders=0, seed=0):
+    """Generate the dataset and return a summary dict. The same arguments always produce the same files."""
+    rng = random.Random(seed)
+    folders = [output_dir] + [os.path.join(output_dir, f"sub_{i:02d}") for i in range(subfolders)]
+    for folder in folders:
+        os.makedirs(folder, exist_ok=True)
+
+    summary = {'images': 0, 'greyscale': 0, 'captions': 0, 'orphan_captions': 0, 'bytes': 0}
+    for i in range(count):
+        folder = rng.choice(folders)
+        width, height = rng.choice(resolutions)
+        extension = rng.choice(formats)
+        greyscale = rng.random() < greyscale_ratio
+
+        path = os.path.join(folder, f"synthetic_{i:06d}.{extension}")
+        img = make_image(width, height, greyscale, rng)
+        if extension in ('jpg', 'jpeg') and img.mode not in ('RGB', 'L'):
+            img = img.convert('RGB')
+        img.save(path)
+        summary['images'] += 1
+        summary['greyscale'] += greyscale
+        summary['bytes'] += os.path.getsize(path)
+
+        if rng.random() < caption_ratio:
+            with open(os.path.splitext(path)[0] + '.txt', 'w', encoding='utf-8') as f:
+                f.write(make_caption(rng))
+            summary['captions'] += 1
+
+    for i in range(orphan_captions):
+        with open(os.path.join(rng.choice(folders), f"orphan_{i:06d}.txt"), 'w', encoding='utf-8') as f:
+            f.write(make_caption(rng))
+        summary['orphan_captions'] += 1
+
+    return summary
+
+
+def _parse_resolutions(text):
+    return tuple(tuple(int(side) for side in item.lower().split('x')) for item in text.split(','))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Generate a synthetic Dataset Sculptor dataset')
+    parser.add_argument('output_dir', type=str, help='Folder to write the dataset to')
+    parser.add_argument('--count', type=int, default=200, help='Number of images')
+    parser.add_argument('--resolutions', type=str, default=','.join(f"{w}x{h}" for w, h in DEFAULT_RESOLUTIONS),
+                        help='Comma separated WIDTHxHEIGHT list')
+    parser.add_argument('--formats', type=str, default=','.join(DEFAULT_FORMATS), help='Comma separated extensions')
+    parser.add_argument('--greyscale', type=float, default=0.3, help='Share of greyscale images (0-1)')
+    parser.add_argument('--captions', type=float, default=0.9, help='Share of images with a caption (0-1)')
+    parser.add_argument('--orphans', type=int, default=10, help='Number of captions without an image')
+    parser.add_argument('--subfolders', type=int, default=0, help='Spread images over this many subfolders')
+    parser.add_argument('--seed', type=int, default=0, help='Random seed')
+    args = parser.parse_args()
+
+    summary = generate(args.output_dir, args.count, _parse_resolutions(args.resolutions), tuple(args.formats.split(',')),
+                       args.greyscale, args.captions, args.orphans, args.subfolders, args.seed)
+    print(f"Generated {summary['images']} images ({summary['greyscale']} greyscale), {summary['captions']} captions "
+          f"and {summary['orphan_captions']} orphan captions in {args.output_dir}")
+
+
+if __name__ == "__main__":
+    main()
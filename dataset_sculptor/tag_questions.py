@@ -1,257 +1,346 @@
-import glob
-import os
-import cv2
-import argparse
-from termcolor import colored
-from torchvision.transforms.functional import InterpolationMode
-from transformers import AutoProcessor, BlipForQuestionAnswering
-import shutil
-import random
-import traceback
-
-MODEL_NAME = "Salesforce/blip-vqa-base"
-
-def query_blip(blip_model, processor, image, question, max_new_tokens=30):
-    inputs = processor(images=image, text=question, return_tensors="pt")
-    outputs = blip_model.generate(**inputs, max_new_tokens=max_new_tokens)
-    return processor.decode(outputs[0], skip_special_tokens=True)
-
-def move_to_quality_dir(file_path, output_dir):
-    ds_question_dir = os.path.join(output_dir, "DS_Question")
-
-    if not os.path.exists(ds_question_dir):
-        os.makedirs(ds_question_dir)
-
-    destination_path = os.path.join(ds_question_dir, os.path.basename(file_path))
-    shutil.move(file_path, destination_path)
-
-    print(f"Moved file to: {destination_path}")
-    return destination_path
-
-def rename_and_update_file(base_path, options, prefix='', update_text=''):
-    base_file_name, file_extension = os.path.splitext(os.path.basename(base_path))
-    if options['rename_position'] == 'start':
-        new_file_name = f"{prefix}{base_file_name}{file_extension}"
-    else:
-        new_file_name = f"{base_file_name}{prefix}{file_extension}"
-    
-    new_path = os.path.join(os.path.dirname(base_path), new_file_name)
-    if options['rename']:
-        os.rename(base_path, new_path)
-        print(f"Renamed image file: {base_path} -> {new_path}")
-
-    txt_file_name = os.path.splitext(base_path)[0] + ".txt"
-    if os.path.isfile(txt_file_name) and options['update_caption']:
-        new_txt_file_name = f"{os.path.splitext(new_file_name)[0]}.txt"
-        new_txt_path = os.path.join(os.path.dirname(txt_file_name), new_txt_file_name)
-
-        with open(txt_file_name, 'r+') as f:
-            existing_caption = f.read().rstrip('\n')
-            lines = existing_caption.split('\n')
-            separator = '\n' if options['newline_caption'] else ' '
-
-            if options['update_caption_position'] == 'random':
-                random_index = random.randint(0, len(lines))
-                lines.insert(random_index, update_text)
-                content = separator.join(lines)
-            elif options['update_caption_position'] == 'before':
-                content = f"{update_text}{separator}{existing_caption}"
-            else:  # 'after'
-                content = f"{existing_caption}{separator}{update_text}"
-
-            f.seek(0)
-            f.write(content)
-            f.truncate()
-        print(f"Updated content in: {txt_file_name}")
-
-        os.rename(txt_file_name, new_txt_path)
-        print(f"Renamed caption file: {txt_file_name} -> {new_txt_path}")
-
-        # Move files after rename
-        if options['move_files']:
-            new_txt_path = move_to_quality_dir(new_txt_path, options['output_dir'])
-            new_path = move_to_quality_dir(new_path, options['output_dir'])
-    
-    return new_path
-
-def label_bad_quality_images(input_dir, output_dir, options):
-    if 'output_dir' not in options:
-        print("Error: 'output_dir' key missing in options!")
-        return
-    options['output_dir'] = output_dir
-    print("Starting...")
-
-    blip_model = BlipForQuestionAnswering.from_pretrained(MODEL_NAME)
-    print("Model loaded.")
-    processor = AutoProcessor.from_pretrained(MODEL_NAME)
-    print("Processor loaded.")
-    
-    ext = ('.jpg', '.jpeg', '.png', '.webp', '.tif', '.tga', '.tiff', '.bmp', '.gif',
-           '.JPG', '.JPEG', '.PNG', '.WEBP', '.TIF', '.TGA', '.TIFF', '.BMP', '.GIF')
-    files_processed = 0
-    answer_counts = {}
-
-    for idx, img_file_name in enumerate(glob.glob(os.path.join(input_dir, "**", "*.*"), recursive=True)):
-        print(f"Checking file: {img_file_name}")
-        if img_file_name.endswith(ext):
-            print(f"Processing image: {img_file_name}")
-            try:
-                # Assuming you've loaded the image and stored it in the variable named 'image'
-                
-                image = cv2.imread(img_file_name)  # Load the image using OpenCV
-                answer_quality = query_blip(blip_model, processor, image, options['blip_question1'])
-
-                
-                if answer_quality.lower() in answer_counts:
-                    answer_counts[answer_quality.lower()] += 1
-                else:
-                    answer_counts[answer_quality.lower()] = 1
-                    
-                if "yes" in answer_quality.lower() or "true" in answer_quality.lower():
-                    
-                    # Update the file's name with the user-specified label (from prompt 3)
-                    new_img_file_name = rename_and_update_file(img_file_name, options, prefix=options['rename_label'])
-                    
-                    # Get the answer to the second question and update the caption with this answer
-                    answer_caption = query_blip(blip_model, processor, image, options['blip_question2'])
-                    
-                    # Check if there's a corresponding txt file and update its content
-                    txt_file_name = os.path.splitext(new_img_file_name)[0] + ".txt"
-                    if os.path.isfile(txt_file_name):
-                        with open(txt_file_name, 'r+') as f:
-                            existing_caption = f.read().rstrip('\n')
-                            separator = '\n' if options['newline_caption'] else ' '
-                            
-                            if options['update_caption_position'] == 'random':
-                                lines = existing_caption.split('\n')
-                                random_index = random.randint(0, len(lines))
-                                lines.insert(random_index, answer_caption)
-                                content = separator.join(lines)
-                            elif options['update_caption_position'] == 'before':
-                                content = f"{answer_caption}{separator}{existing_caption}"
-                            else:  # 'after'
-                                content = f"{existing_caption}{separator}{answer_caption}"
-
-                            f.seek(0)
-                            f.write(content)
-                            f.truncate()
-                        print(f"Updated content in: {txt_file_name}")
-                        
-                files_processed += 1
-
-            except Exception as e:
-                print(f"Failed to process image: {img_file_name}. Error: {e}")
-                traceback.print_exc()
-                continue
-
-        print(f"Processed {files_processed} files.")
-        print(f"Answer counts: {answer_counts}")
-
-def run(input_dir, output_dir):
-    while True:
-        print(colored(f'''
-                   ___      __   ___  __           ___      ___           
-                  |__  \_/ |__) |__  |__) |  |\/| |__  |\ |  |   /\  |    
-                  |___ / \ |    |___ |  \ |  |  | |___ | \|  |  /~~\ |___ 
-        ''', 'light_yellow'))                                              
-        print(colored(f'''
-        Current Input Directory: {input_dir}
-        Current Output Directory: {output_dir}
-     ┌──────────────────────────────────────────────────────────────────────────────┐
-     |                           IMAGE QUESTIONING MODULE                           |
-     |------------------------------------------------------------------------------|
-     |                                                                              |
-     |            Prompt List Order (linear sequence on Run, not interactive)       | 
-     |                                                                              |
-     |        1 - Rename with label if BlipQuestion1 is TRUE (Y, N)                 |
-     |        2 - Add label at beginning (1) or end (2) of the filename?            |                                         
-     |        3 - Please enter the label for the filename:                          | 
-     |        4 - Append captions with answer to BlipQuestion2? (Y, N):             |
-     |        5 - Caption before (1), after (2), or random position (3)?            |                                         
-     |        6 - New line for the additional caption? (Y, N)                       |  
-     |        7 - Move images and text files to Output folder (Y, N)                | 
-     |        8 - First question to ask about image                                 | 
-     |        9 - Second question to ask of image                                   |                        
-     |                                                                              |
-     └──────────────────────────────────────────────────────────────────────────────┘
-     |      I - Set input     O - Set Output     R - Run     X - Exit to Menu       |
-     └──────────────────────────────────────────────────────────────────────────────┘
-
-		Notes:
-	1 - 5 	self-explanatory
-	6 - 	Adds a new line before or after existing caption for use with trainers 
-		that accept multiple caption lines. Recommended off unless your questions
-		are able to pull longer answers from BlipQuestion
-	7 -     Moves images to new output subfolder DS_Question
-	8 - 	First question to ask about the images, should be binary Yes or No
-	9 - 	Second question to ask about the images, should be open-ended
-	
-    ''', 'light_green'))
-
-        choice = input("Enter one of the options from system menu (I, O, R, X): ").upper()
-
-        if choice == 'I':
-            input_dir = input("Set new input directory: ")
-        elif choice == 'O':
-            output_dir = input("Set new output directory: ")
-        elif choice == 'R':
-            break
-        elif choice == 'X':
-            return
-
-    # Capture the rest of the user inputs
-    rename_files = input("Rename with label if BlipQuestion1 answer is TRUE? (Y, N): ")
-    rename_files = rename_files.upper() == 'Y'
-    rename_position = ''
-    rename_label = ''
-    if rename_files:
-        rename_position = input("Add label at the beginning (1) or the end (2) of the filename? ")
-        if rename_position == '1':
-            rename_position = 'start'
-        elif rename_position == '2':
-            rename_position = 'end'
-        rename_label = input("Please enter the label for the file: ")
-
-    update_caption = input("Append captions with answer to follow up BlipQuestion2? (Y, N): ")
-    update_caption = update_caption.upper() == 'Y'
-    if update_caption:
-        update_caption_position = input("Should the caption go before (1), after (2), or at a random position (3)? ")
-        if update_caption_position == '1':
-            update_caption_position = 'before'
-        elif update_caption_position == '2':
-            update_caption_position = 'after'
-        elif update_caption_position == '3':
-            update_caption_position = 'random'
-    else:
-        update_caption_position = None
-
-    newline_caption = input("New line for the additional caption? (Y, N): ")
-    newline_caption = newline_caption.upper() == 'Y'
-
-    move_files = input("Move images and text files to Output folder (Y, N): ")
-    move_files = move_files.upper() == 'Y'
-
-    blip_question1 = input("Please enter BlipQuestion1: ")
-    blip_question2 = input("Please enter BlipQuestion2 (if BlipQuestion1 answer is TRUE): ")
-    blip_question2 = blip_question2 if blip_question2 else None
-
-    options = {
-        'rename': rename_files,
-        'rename_position': rename_position,
-        'rename_label': rename_label,
-        'update_caption': update_caption,
-        'update_caption_position': update_caption_position,
-        'newline_caption': newline_caption,
-        'move_files': move_files,
-        'blip_question1': blip_question1,
-        'blip_question2': blip_question2,
-        'output_dir': output_dir, 
-        'input_dir': input_dir 
-}
-
-    label_bad_quality_images(input_dir, output_dir, options)
-
-
-
-if __name__ == '__main__':
+import os
+import cv2
+import numpy as np
+import argparse
+from termcolor import colored
+from dataset_sculptor import archive_io
+from dataset_sculptor import blip_daemon
+from dataset_sculptor import file_ops
+from dataset_sculptor import instrumentation
+from dataset_sculptor import integrity_scan
+from dataset_sculptor import memory_guard
+from dataset_sculptor import progress
+from dataset_sculptor import run_journal
+from dataset_sculptor.run_journal import ask_once, move_once, update_caption_once
+import random
+import traceback
+
+MODEL_NAME = "Salesforce/blip-vqa-base"
+
+def query_blip(blip_model, processor, image, question, max_new_tokens=30):
+    inputs = processor(images=image, text=question, return_tensors="pt")
+    outputs = blip_model.generate(**inputs, max_new_tokens=max_new_tokens)
+    return processor.decode(outputs[0], skip_special_tokens=True)
+
+def move_to_quality_dir(file_path, output_dir):
+    ds_question_dir = os.path.join(output_dir, "DS_Question")
+
+    file_ops.ensure_dir(ds_question_dir)
+
+    destination_path = os.path.join(ds_question_dir, os.path.basename(file_path))
+    file_ops.move(file_path, destination_path)
+
+    progress.file_event(file_path, 'moved', destination=destination_path)
+    return destination_path
+
+def insert_caption_text(existing_caption, update_text, options):
+    existing_caption = existing_caption.rstrip('\n')
+    separator = '\n' if options['newline_caption'] else ' '
+
+    if options['update_caption_position'] == 'random':
+        lines = existing_caption.split('\n')
+        random_index = random.randint(0, len(lines))
+        lines.insert(random_index, update_text)
+        return separator.join(lines)
+    elif options['update_caption_position'] == 'before':
+        return f"{update_text}{separator}{existing_caption}"
+    else:  # 'after'
+        return f"{existing_caption}{separator}{update_text}"
+
+def rename_and_update_file(base_path, options, prefix='', update_text='', journal=None, key=None):
+    # With a journal, every step runs at most once per image so a resumed run
+    # never adds the label or the caption text twice
+    base_file_name, file_extension = os.path.splitext(os.path.basename(base_path))
+    if options['rename_position'] == 'start':
+        new_file_name = f"{prefix}{base_file_name}{file_extension}"
+    else:
+        new_file_name = f"{base_file_name}{prefix}{file_extension}"
+    
+    new_path = base_path
+    if options['rename']:
+        new_path = move_once(journal, key, 'rename_image', base_path, os.path.join(os.path.dirname(base_path), new_file_name))
+        progress.file_event(base_path, 'renamed', destination=new_path)
+
+    txt_file_name = os.path.splitext(base_path)[0] + ".txt"
+    new_txt_path = None
+    if os.path.isfile(txt_file_name) or (journal and journal.started(key, 'update_caption', 'rename_caption', 'move_caption')):
+        new_txt_path = txt_file_name
+
+        if options['update_caption'] and update_text:
+            if update_caption_once(journal, key, 'update_caption', txt_file_name,
+                                   lambda existing_caption: insert_caption_text(existing_caption, update_text, options)):
+                progress.file_event(txt_file_name, 'caption_updated', text=update_text)
+
+        if options['rename']:
+            new_txt_path = move_once(journal, key, 'rename_caption', txt_file_name, os.path.splitext(new_path)[0] + ".txt")
+            progress.file_event(txt_file_name, 'renamed', destination=new_txt_path)
+
+    # Move files after rename
+    if options['move_files']:
+        ds_question_dir = os.path.join(options['output_dir'], "DS_Question")
+        move = lambda src, dst: move_to_quality_dir(src, options['output_dir'])
+        if new_txt_path:
+            new_txt_path = move_once(journal, key, 'move_caption', new_txt_path, os.path.join(ds_question_dir, os.path.basename(new_txt_path)), move)
+        new_path = move_once(journal, key, 'move_image', new_path, os.path.join(ds_question_dir, os.path.basename(new_path)), move)
+    
+    return new_path
+
+def load_image(img_file_name):
+    with instrumentation.stage('decode'):
+        image = cv2.imread(img_file_name)
+    if image is None:
+        return None
+
+    if image.shape[2] == 1:
+        image = cv2.cvtColor(image, cv2.COLOR_GRAY2RGB)
+    elif image.shape[2] == 4:
+        image = cv2.cvtColor(image, cv2.COLOR_RGBA2RGB)
+    return image
+
+def load_image_bytes(data):
+    """load_image() for an image held in memory, e.g. read from an archive."""
+    with memory_guard.decoded_data(data) as img:
+        with instrumentation.stage('process'):
+            # Same channel order as cv2.imread, so answers match a run on the extracted folder
+            return cv2.cvtColor(np.asarray(img.convert('RGB')), cv2.COLOR_RGB2BGR)
+
+def process_image(img_file_name, image, ask, options, answer_counts, journal=None, key=None):
+    answer_quality = ask_once(journal, key, ask, image, options['blip_question1'], img_file_name)
+
+    if answer_quality.lower() in answer_counts:
+        answer_counts[answer_quality.lower()] += 1
+    else:
+        answer_counts[answer_quality.lower()] = 1
+
+    if "yes" in answer_quality.lower() or "true" in answer_quality.lower():
+        # Get the answer to the second question, it goes into the caption while the
+        # file gets the user-specified label (from prompt 3)
+        answer_caption = ''
+        if options['blip_question2']:
+            answer_caption = ask_once(journal, key, ask, image, options['blip_question2'], img_file_name)
+
+        img_file_name = rename_and_update_file(key or img_file_name, options, prefix=options['rename_label'],
+                                               update_text=answer_caption, journal=journal, key=key)
+
+    if journal:
+        journal.finish(key)
+    return img_file_name
+
+def label_archive(archive, output_dir, options):
+    """
+    label_bad_quality_images() for a zip or tar archive. Pairs are read without
+    extracting the archive and the actions are applied to a copy of it, saved in
+    output_dir as <archive name>_tag_questions with the archive's extension. There
+    is no journal, an interrupted run starts over.
+    """
+    answer_counts = {}
+    output_path = None
+    if options['rename'] or options['update_caption'] or options['move_files']:
+        output_path = archive_io.output_path(archive, output_dir, "tag_questions")
+
+    # Share the model with a running BLIP daemon instead of loading another copy
+    ask, client = blip_daemon.load_ask(MODEL_NAME, query_blip)
+
+    def handle(img_file_name, scratch_output_dir, pair):
+        image = load_image_bytes(pair.image)
+        process_image(img_file_name, image, ask, dict(options, output_dir=scratch_output_dir), answer_counts)
+
+    with progress.Progress("Tag Questions") as bar:
+        files_processed, failures = archive_io.run_on_files(archive, output_path, handle, bar)
+
+    print(f"Processed {files_processed} files.")
+    print(f"Answer counts: {answer_counts}")
+    if failures:
+        print(f"Failed {failures} files, kept unchanged.")
+    if output_path:
+        print(f"Output archive: {output_path}")
+
+    if client:
+        client.close()
+
+def label_bad_quality_images(input_dir, output_dir, options):
+    if 'output_dir' not in options:
+        print("Error: 'output_dir' key missing in options!")
+        return
+    options['output_dir'] = output_dir
+    print("Starting...")
+    if archive_io.is_archive(input_dir):
+        label_archive(input_dir, output_dir, options)
+        return
+
+    journal = run_journal.RunJournal(output_dir, "tag_questions", input_dir, resume=options.get('resume', False))
+    
+    ext = ('.jpg', '.jpeg', '.png', '.webp', '.tif', '.tga', '.tiff', '.bmp', '.gif',
+           '.JPG', '.JPEG', '.PNG', '.WEBP', '.TIF', '.TGA', '.TIFF', '.BMP', '.GIF')
+    files_processed = 0
+    files_skipped = 0
+    visited = set()
+    answer_counts = {}
+
+    image_files = []
+    for root, dirs, files in os.walk(input_dir):
+        # Output folders such as DS_Quarantine can sit inside the input folder
+        dirs[:] = sorted(d for d in dirs if not d.startswith('DS_'))
+        image_files.extend(os.path.join(root, name) for name in sorted(files) if name.endswith(ext))
+    # Corrupt files would only fail once the model is loaded, they are quarantined first
+    image_files = integrity_scan.quarantine_corrupt(image_files, output_dir)
+
+    # Share the model with a running BLIP daemon instead of loading another copy
+    ask, client = blip_daemon.load_ask(MODEL_NAME, query_blip)
+
+    with progress.Progress("Tag Questions", total=len(image_files)) as bar:
+        for img_file_name in image_files:
+            bar.advance()
+            if journal.is_done(img_file_name):
+                files_skipped += 1
+                continue
+
+            key = journal.key_for(img_file_name)
+            visited.add(key)
+            try:
+                image = load_image(img_file_name)  # Load the image using OpenCV
+                if image is None:
+                    raise ValueError("Failed to read image")
+                journal.begin(key)
+                process_image(img_file_name, image, ask, options, answer_counts, journal, key)
+                files_processed += 1
+
+            except Exception as e:
+                bar.error(f"Failed to process image: {img_file_name}. Error: {e}", img_file_name,
+                          traceback=traceback.format_exc())
+                continue
+
+        # Images interrupted after they were already moved out of the input directory.
+        # Their answers are in the journal, so only the remaining file actions are applied.
+        for key in journal.unfinished_keys():
+            if key not in visited and journal.answer(key, options['blip_question1']) is not None:
+                bar.file(key, 'finishing_interrupted')
+                try:
+                    process_image(key, None, ask, options, answer_counts, journal, key)
+                    files_processed += 1
+                except Exception as e:
+                    bar.error(f"Failed to process image: {key}. Error: {e}", key, traceback=traceback.format_exc())
+
+    journal.close()
+
+    print(f"Processed {files_processed} files.")
+    if files_skipped:
+        print(f"Skipped {files_skipped} files finished in a previous run.")
+    print(f"Answer counts: {answer_counts}")
+
+    if client:
+        client.close()
+
+def run(input_dir, output_dir):
+    while True:
+        print(colored(f'''
+                   ___      __   ___  __           ___      ___           
+                  |__  \_/ |__) |__  |__) |  |\/| |__  |\ |  |   /\  |    
+                  |___ / \ |    |___ |  \ |  |  | |___ | \|  |  /~~\ |___ 
+        ''', 'light_yellow'))                                              
+        print(colored(f'''
+        Current Input Directory: {input_dir}
+        Current Output Directory: {output_dir}
+     ┌──────────────────────────────────────────────────────────────────────────────┐
+     |                           IMAGE QUESTIONING MODULE                           |
+     |------------------------------------------------------------------------------|
+     |                                                                              |
+     |            Prompt List Order (linear sequence on Run, not interactive)       | 
+     |                                                                              |
+     |        1 - Rename with label if BlipQuestion1 is TRUE (Y, N)                 |
+     |        2 - Add label at beginning (1) or end (2) of the filename?            |                                         
+     |        3 - Please enter the label for the filename:                          | 
+     |        4 - Append captions with answer to BlipQuestion2? (Y, N):             |
+     |        5 - Caption before (1), after (2), or random position (3)?            |                                         
+     |        6 - New line for the additional caption? (Y, N)                       |  
+     |        7 - Move images and text files to Output folder (Y, N)                | 
+     |        8 - First question to ask about image                                 | 
+     |        9 - Second question to ask of image                                   |                        
+     |                                                                              |
+     └──────────────────────────────────────────────────────────────────────────────┘
+     |      I - Set input     O - Set Output     R - Run     X - Exit to Menu       |
+     └──────────────────────────────────────────────────────────────────────────────┘
+
+		Notes:
+	1 - 5 	self-explanatory
+	6 - 	Adds a new line before or after existing caption for use with trainers 
+		that accept multiple caption lines. Recommended off unless your questions
+		are able to pull longer answers from BlipQuestion
+	7 -     Moves images to new output subfolder DS_Question
+	8 - 	First question to ask about the images, should be binary Yes or No
+	9 - 	Second question to ask about the images, should be open-ended
+	
+    ''', 'light_green'))
+
+        choice = input("Enter one of the options from system menu (I, O, R, X): ").upper()
+
+        if choice == 'I':
+            input_dir = input("Set new input directory: ")
+        elif choice == 'O':
+            output_dir = input("Set new output directory: ")
+        elif choice == 'R':
+            break
+        elif choice == 'X':
+            return
+
+    # Capture the rest of the user inputs
+    rename_files = input("Rename with label if BlipQuestion1 answer is TRUE? (Y, N): ")
+    rename_files = rename_files.upper() == 'Y'
+    rename_position = ''
+    rename_label = ''
+    if rename_files:
+        rename_position = input("Add label at the beginning (1) or the end (2) of the filename? ")
+        if rename_position == '1':
+            rename_position = 'start'
+        elif rename_position == '2':
+            rename_position = 'end'
+        rename_label = input("Please enter the label for the file: ")
+
+    update_caption = input("Append captions with answer to follow up BlipQuestion2? (Y, N): ")
+    update_caption = update_caption.upper() == 'Y'
+    if update_caption:
+        update_caption_position = input("Should the caption go before (1), after (2), or at a random position (3)? ")
+        if update_caption_position == '1':
+            update_caption_position = 'before'
+        elif update_caption_position == '2':
+            update_caption_position = 'after'
+        elif update_caption_position == '3':
+            update_caption_position = 'random'
+    else:
+        update_caption_position = None
+
+    newline_caption = input("New line for the additional caption? (Y, N): ")
+    newline_caption = newline_caption.upper() == 'Y'
+
+    move_files = input("Move images and text files to Output folder (Y, N): ")
+    move_files = move_files.upper() == 'Y'
+
+    blip_question1 = input("Please enter BlipQuestion1: ")
+    blip_question2 = input("Please enter BlipQuestion2 (if BlipQuestion1 answer is TRUE): ")
+    blip_question2 = blip_question2 if blip_question2 else None
+
+    options = {
+        'rename': rename_files,
+        'rename_position': rename_position,
+        'rename_label': rename_label,
+        'update_caption': update_caption,
+        'update_caption_position': update_caption_position,
+        'newline_caption': newline_caption,
+        'move_files': move_files,
+        'blip_question1': blip_question1,
+        'blip_question2': blip_question2,
+        'output_dir': output_dir, 
+        'input_dir': input_dir,
+        'resume': False
+}
+
+    if run_journal.has_unfinished_run(output_dir, "tag_questions", input_dir):
+        resume_response = input("An interrupted run was found for this Input Directory. Resume it? (Y, N): ")
+        options['resume'] = resume_response.upper() == 'Y'
+
+    label_bad_quality_images(input_dir, output_dir, options)
+
+
+
+if __name__ == '__main__':
     run('default_input_dir', 'default_output_dir')  # These can be changed to your default directories.
\ No newline at end of file
@@ -0,0 +1,211 @@
+"""
+Memory-mapped thumbnail cache.
+
+Black and white detection, perceptual hashing and similar analyses only look at a
+few dozen pixels per side, yet each of them used to decode the full image again.
+The cache decodes every image once, at a reduced scale, into a fixed-size RGBA
+thumbnail stored as one slot of a flat uint8 file next to the catalog:
+
+    DS_Catalog/thumbnails_48.u8       slots of 48 x 48 x 4 bytes, memory-mapped
+    DS_Catalog/thumbnails_48.sqlite   path -> slot, with the file's size and mtime
+
+get() returns a NumPy view into the mapped file, no copy is made, so a repeat
+analysis over a million images costs page cache reads instead of JPEG decodes. Like
+the catalog, an entry whose file changed since is treated as missing and its slot is
+filled again. Several processes can share a cache, slots are handed out inside a
+write transaction on the index, so two files never get the same slot. Thumbnails
+are squashed to a square, the analyses using them resize to a square anyway.
+
+    cache = thumbnails.current()
+    thumb, info = cache.get(path)
+    grey = thumbnails.grey(thumb, (9, 8))
+"""
+import atexit
+import functools
+import os
+import sqlite3
+import threading
+
+import numpy as np
+from PIL import Image
+
+from dataset_sculptor import catalog
+from dataset_sculptor import instrumentation
+from dataset_sculptor import memory_guard
+
+THUMB_SIZE = 48
+CHANNELS = 4  # RGBA, bw_mse counts the alpha band of RGBA images
+GROW_SLOTS = 4096  # slots the data file grows by at a time
+RESIZE_MODES = ('1', 'L', 'LA', 'RGB', 'RGBA', 'I', 'F')  # resized before conversion, others are converted first
+GREY_WEIGHTS = np.array([0.299, 0.587, 0.114], dtype=np.float32)  # same as Image.convert('L')
+
+_open = {}
+_lock = threading.Lock()
+
+
+def current():
+    """The thumbnail cache next to the configured catalog, or None when there is no catalog."""
+    path = catalog._settings['path']
+    return cache_for(os.path.dirname(os.path.abspath(path))) if path else None
+
+
+def cache_for(directory):
+    """The thumbnail cache in directory, one per directory and process."""
+    with _lock:
+        if directory not in _open:
+            if not _open:
+                atexit.register(close_all)
+            _open[directory] = ThumbnailCache(directory)
+        return _open[directory]
+
+
+def close_all():
+    for cache in list(_open.values()):
+        cache.close()
+
+
+def make_thumbnail(path, size=THUMB_SIZE):
+    """
+    Decode path straight to a size x size RGBA array. Returns (array, info) with the
+    full width and height and the image's bands, e.g. 'RGB' or 'L'.
+    """
+    with memory_guard.open_image(path) as img:
+        width, height = img.size
+        bands = ''.join(img.getbands())
+        # JPEGs decode straight to a reduced scale no smaller than the thumbnail
+        img.draft(img.mode, (size, size))
+        with memory_guard.budget.reserve(memory_guard.decoded_bytes(img)):
+            memory_guard.decode(img)
+            with instrumentation.stage('process'):
+                if img.mode not in RESIZE_MODES:
+                    img = img.convert('RGBA')
+                thumb = img.resize((size, size), Image.BOX, reducing_gap=2.0).convert('RGBA')
+    return np.asarray(thumb, dtype=np.uint8), {'width': width, 'height': height, 'bands': bands}
+
+
+@functools.lru_cache(maxsize=None)
+def _area_matrix(source, target):
+    """(target, source) weights averaging the source pixels each target pixel covers."""
+    edges = np.arange(target + 1) * source / target
+    low = np.maximum(edges[:-1, None], np.arange(source)[None, :])
+    high = np.minimum(edges[1:, None], np.arange(1, source + 1)[None, :])
+    return (np.clip(high - low, 0, None) * target / source).astype(np.float32)
+
+
+def resized(thumb, size):
+    """thumb (height, width[, channels]) area-resized to size (width, height), as float32."""
+    rows = _area_matrix(thumb.shape[0], size[1])
+    columns = _area_matrix(thumb.shape[1], size[0])
+    return np.einsum('ij,jk...,lk->il...', rows, thumb.astype(np.float32), columns)
+
+
+def grey(thumb, size):
+    """Greyscale of an RGBA thumbnail resized to size (width, height), as float32 0-255."""
+    return resized(thumb[..., :3].astype(np.float32) @ GREY_WEIGHTS, size)
+
+
+class ThumbnailCache:
+
+    def __init__(self, directory, size=THUMB_SIZE):
+        self.size = size
+        self.slot_shape = (size, size, CHANNELS)
+        self.slot_bytes = size * size * CHANNELS
+        os.makedirs(directory, exist_ok=True)
+        self.data_path = os.path.join(directory, f"thumbnails_{size}.u8")
+        self.index_path = os.path.join(directory, f"thumbnails_{size}.sqlite")
+        # Analyses load from thread pools, the lock serialises the index and slot allocation
+        self.lock = threading.RLock()
+        # Transactions are explicit, a slot is taken and its row written in one
+        self.conn = sqlite3.connect(self.index_path, timeout=60, check_same_thread=False, isolation_level=None)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.execute('''
+            CREATE TABLE IF NOT EXISTS thumbnails (
+                path TEXT PRIMARY KEY,
+                size INTEGER NOT NULL,
+                mtime_ns INTEGER NOT NULL,
+                slot INTEGER NOT NULL,
+                width INTEGER NOT NULL,
+                height INTEGER NOT NULL,
+                bands TEXT NOT NULL
+            )''')
+        # Caches written by processes racing for a slot can hold rows sharing one, neither can be trusted
+        self.conn.execute('DELETE FROM thumbnails WHERE slot IN '
+                          '(SELECT slot FROM thumbnails GROUP BY slot HAVING COUNT(*) > 1)')
+        self.conn.execute('CREATE UNIQUE INDEX IF NOT EXISTS thumbnails_slot ON thumbnails (slot)')
+        self.data = None
+        if not os.path.exists(self.data_path):
+            open(self.data_path, 'wb').close()
+        self._map(max(self._end(), os.path.getsize(self.data_path) // self.slot_bytes))
+
+    def _map(self, capacity):
+        """Map the data file with room for capacity slots, growing the file if needed."""
+        capacity = max(GROW_SLOTS, -(-capacity // GROW_SLOTS) * GROW_SLOTS)
+        # Other processes grow the file too, it only ever grows
+        if os.path.getsize(self.data_path) < capacity * self.slot_bytes:
+            with open(self.data_path, 'r+b') as f:
+                f.truncate(capacity * self.slot_bytes)
+        if self.data is not None:
+            self.data.flush()
+        # Views handed out earlier keep the previous mapping alive, they stay valid
+        self.data = np.memmap(self.data_path, dtype=np.uint8, mode='r+', shape=(capacity,) + self.slot_shape)
+
+    def close(self):
+        with self.lock:
+            self.data.flush()
+            self.conn.close()
+        _open.pop(os.path.dirname(self.data_path), None)
+
+    def _row(self, path):
+        return self.conn.execute('SELECT size, mtime_ns, slot, width, height, bands FROM thumbnails WHERE path = ?',
+                                 (path,)).fetchone()
+
+    def _end(self):
+        """The first slot no row uses."""
+        return self.conn.execute('SELECT COALESCE(MAX(slot) + 1, 0) FROM thumbnails').fetchone()[0]
+
+    def get(self, path):
+        """
+        (thumbnail, info) for the image at path, decoded only if the cache has no thumbnail
+        of the file as it is now. thumbnail is a read-only (size, size, 4) view into the
+        mapped file, info has the image's width, height, bands and file size in bytes.
+        """
+        path = os.path.abspath(path)
+        stat = os.stat(path)
+        with self.lock:
+            row = self._row(path)
+            # The slot is only trusted while the row still describes the file as it is on disk
+            if row is not None and (row[0], row[1]) == (stat.st_size, stat.st_mtime_ns):
+                instrumentation.count('thumbnail_hits')
+                return self._view(row[2]), {'width': row[3], 'height': row[4], 'bands': row[5], 'bytes': row[0]}
+
+        thumb, info = make_thumbnail(path, self.size)
+        instrumentation.count('thumbnail_decodes')
+        with self.lock:
+            # Takes the index's write lock, other processes see the slot taken or not at all
+            self.conn.execute('BEGIN IMMEDIATE')
+            try:
+                # Another thread or process may have cached the file meanwhile, a changed file keeps its slot
+                row = self._row(path)
+                slot = row[2] if row is not None else self._end()
+                if slot >= len(self.data):
+                    self._map(slot + 1)
+                # Pixels first, an index row never points at a slot that isn't written yet
+                self.data[slot] = thumb
+                self.conn.execute('INSERT OR REPLACE INTO thumbnails VALUES (?, ?, ?, ?, ?, ?, ?)',
+                                  (path, stat.st_size, stat.st_mtime_ns, slot,
+                                   info['width'], info['height'], info['bands']))
+                self.conn.execute('COMMIT')
+            except BaseException:
+                self.conn.execute('ROLLBACK')
+                raise
+            view = self._view(slot)
+        return view, dict(info, bytes=stat.st_size)
+
+    def _view(self, slot):
+        if slot >= len(self.data):
+            # Taken by another process after this one mapped the file
+            self._map(slot + 1)
+        view = self.data[slot].view(np.ndarray)
+        view.flags.writeable = False
+        return view